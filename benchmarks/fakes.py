@@ -0,0 +1,195 @@
+# author: Luka Pacar
+"""In-process fakes of the EC2 and DigitalOcean APIs, counting every request they answer."""
+import contextlib
+import itertools
+import math
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from ipaddress import IPv4Address
+from types import SimpleNamespace
+from unittest import mock
+
+# DigitalOcean lists at most this many droplets per page
+DIGITALOCEAN_PAGE_SIZE = 200
+
+AWS_INSTANCE_TYPE = "t3.micro"
+DIGITALOCEAN_SIZES = (("s-1vcpu-1gb", 0.00893), ("s-2vcpu-2gb", 0.02679))
+
+
+class FakeCloud:
+    """Shared state of both fake APIs.
+
+    Args:
+        latency (float): Seconds every request takes.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = Counter()
+        self.instances = {}
+        self.instance_ids_by_name = {}
+        self.droplets = {}
+        self._ids = itertools.count(1)
+        self._ips = itertools.count(int(IPv4Address("10.0.0.1")))
+
+    def request(self, service: str, operation: str, pages: int = 1):
+        self.requests[f"{service}.{operation}"] += pages
+        if self.latency:
+            time.sleep(self.latency * pages)
+
+    def next_ip(self) -> str:
+        return str(IPv4Address(next(self._ips)))
+
+    # EC2
+
+    def add_instance(self, name: str, state: str = "running") -> dict:
+        instance = {
+            "InstanceId": f"i-{next(self._ids):017x}",
+            "InstanceType": AWS_INSTANCE_TYPE,
+            "State": {"Name": state},
+            "LaunchTime": datetime.now(timezone.utc) - timedelta(hours=2),
+            "PublicIpAddress": self.next_ip(),
+            "Tags": [{"Key": "Name", "Value": name}],
+        }
+        self.instances[instance["InstanceId"]] = instance
+        self.instance_ids_by_name.setdefault(name, []).append(instance["InstanceId"])
+        return instance
+
+    # DigitalOcean
+
+    def add_droplet(self, name: str, size_slug: str = DIGITALOCEAN_SIZES[0][0], droplet=None):
+        droplet = droplet or FakeDroplet(self, name=name, size_slug=size_slug)
+        droplet.id = next(self._ids)
+        droplet.status = "active"
+        droplet.ip_address = self.next_ip()
+        droplet.created_at = (datetime.now(timezone.utc) - timedelta(hours=2)).strftime(
+            "%Y-%m-%dT%H:%M:%SZ"
+        )
+        self.droplets[droplet.id] = droplet
+        return droplet
+
+
+class FakeEC2Client:
+    """Answers the EC2 calls made by AWS from FakeCloud, like moto does without HTTP."""
+
+    def __init__(self, cloud: FakeCloud):
+        self.cloud = cloud
+        # Lets metrics.instrument_boto3_client() register its hooks
+        self.meta = SimpleNamespace(events=SimpleNamespace(register=lambda *a, **k: None))
+
+    def describe_regions(self, **kwargs):
+        self.cloud.request("ec2", "DescribeRegions")
+        return {"Regions": [{"RegionName": "us-east-1"}]}
+
+    def describe_instances(self, InstanceIds=None, Filters=None, **kwargs):
+        self.cloud.request("ec2", "DescribeInstances")
+        if InstanceIds is not None:
+            ids = InstanceIds
+        else:
+            ids = list(self.cloud.instances)
+            for instance_filter in Filters or []:
+                if instance_filter["Name"] == "tag:Name":
+                    ids = [
+                        instance_id
+                        for name in instance_filter["Values"]
+                        for instance_id in self.cloud.instance_ids_by_name.get(name, [])
+                    ]
+        instances = [self.cloud.instances[i] for i in ids if i in self.cloud.instances]
+        return {"Reservations": [{"Instances": instances}] if instances else []}
+
+    def run_instances(self, **params):
+        self.cloud.request("ec2", "RunInstances")
+        name = params["TagSpecifications"][0]["Tags"][0]["Value"]
+        return {"Instances": [self.cloud.add_instance(name)]}
+
+    def _set_state(self, operation: str, instance_ids, state: str):
+        self.cloud.request("ec2", operation)
+        for instance_id in instance_ids:
+            self.cloud.instances[instance_id]["State"]["Name"] = state
+        return {}
+
+    def start_instances(self, InstanceIds, **kwargs):
+        return self._set_state("StartInstances", InstanceIds, "running")
+
+    def stop_instances(self, InstanceIds, **kwargs):
+        return self._set_state("StopInstances", InstanceIds, "stopped")
+
+    def terminate_instances(self, InstanceIds, **kwargs):
+        return self._set_state("TerminateInstances", InstanceIds, "terminated")
+
+
+class FakeManager:
+    """Answers the digitalocean.Manager calls made by DigitalOcean from FakeCloud."""
+
+    def __init__(self, cloud: FakeCloud, **kwargs):
+        self.cloud = cloud
+
+    def get_all_droplets(self):
+        droplets = list(self.cloud.droplets.values())
+        pages = max(1, math.ceil(len(droplets) / DIGITALOCEAN_PAGE_SIZE))
+        self.cloud.request("digitalocean", "GET /v2/droplets", pages)
+        return droplets
+
+    def get_all_sizes(self):
+        self.cloud.request("digitalocean", "GET /v2/sizes")
+        return [
+            SimpleNamespace(slug=slug, price_hourly=price)
+            for slug, price in DIGITALOCEAN_SIZES
+        ]
+
+
+class FakeDroplet:
+    """Stands in for digitalocean.Droplet."""
+
+    def __init__(self, cloud: FakeCloud, name=None, size_slug=None, size=None, **kwargs):
+        self.cloud = cloud
+        self.name = name
+        self.size_slug = size_slug or size
+        self.id = kwargs.get("id")
+        self.status = None
+        self.ip_address = None
+        self.created_at = None
+
+    def create(self):
+        self.cloud.request("digitalocean", "POST /v2/droplets")
+        self.cloud.add_droplet(self.name, self.size_slug, self)
+
+    def load(self):
+        self.cloud.request("digitalocean", "GET /v2/droplets/{id}")
+
+    def _action(self, status):
+        self.cloud.request("digitalocean", "POST /v2/droplets/{id}/actions")
+        self.status = status
+
+    def power_on(self):
+        self._action("active")
+
+    def power_off(self):
+        self._action("off")
+
+    def destroy(self):
+        self.cloud.request("digitalocean", "DELETE /v2/droplets/{id}")
+        self.cloud.droplets.pop(self.id, None)
+
+
+@contextlib.contextmanager
+def fake_cloud(cloud: FakeCloud):
+    """Routes all provider clients and reachability checks created within the block to the fakes."""
+    import boto3
+    import digitalocean
+
+    from backend.vm import VirtualMachine
+
+    def is_reachable(vm):
+        cloud.request("ssh", "ping")
+        return True
+
+    with mock.patch.object(
+        boto3, "client", lambda *args, **kwargs: FakeEC2Client(cloud)
+    ), mock.patch.object(
+        digitalocean, "Manager", lambda **kwargs: FakeManager(cloud, **kwargs)
+    ), mock.patch.object(
+        digitalocean, "Droplet", lambda **kwargs: FakeDroplet(cloud, **kwargs)
+    ), mock.patch.object(VirtualMachine, "is_reachable", is_reachable):
+        yield cloud
@@ -0,0 +1,223 @@
+# author: Luka Pacar
+"""Benchmarks the backend against fake providers at growing fleet sizes.
+
+    python benchmarks/run.py                          # 10, 100, 1000 and 10000 VMs
+    python benchmarks/run.py --sizes 10 100 --latency-ms 20
+    python benchmarks/run.py --compare benchmarks/results/<earlier>.json
+
+Every run is saved to benchmarks/results/. With --compare, benchmarks that got slower than
+--threshold times the earlier run are reported and the exit status is 1.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend.aws_provider import AWS  # noqa: E402
+from backend.db import Database  # noqa: E402
+from backend.digitalocean_provider import DigitalOcean  # noqa: E402
+from backend.fleet import refresh_costs  # noqa: E402
+from backend.metrics import api_metrics  # noqa: E402
+from backend.reached_cost_limits import get_reached_cost_limits  # noqa: E402
+from backend.server_is_active import get_active_servers  # noqa: E402
+from backend.vm import VirtualMachine  # noqa: E402
+from fakes import FakeCloud, fake_cloud  # noqa: E402
+
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# VMs created by the create_vm benchmark, independent of the fleet size
+created_vms = 10
+
+
+def build_fleet(db: Database, cloud: FakeCloud, size: int):
+    """Stores an AWS and a DigitalOcean account with size VMs split between them."""
+    aws = AWS("bench-aws", date.today(), "AKIAFAKE", "fake", "us-east-1", "vpc-1", "subnet-1", "sg-1")
+    digitalocean = DigitalOcean("bench-do", date.today(), "fake-token")
+    db.insert_provider(aws, print_output=False)
+    db.insert_provider(digitalocean, print_output=False)
+
+    for i in range(size):
+        name = f"bench-vm-{i}"
+        if i % 2 == 0:
+            provider = aws
+            public_ip = cloud.add_instance(name)["PublicIpAddress"]
+        else:
+            provider = digitalocean
+            public_ip = cloud.add_droplet(name).ip_address
+        db.insert_vm(
+            VirtualMachine(
+                name, provider, 50, public_ip, date.today(), "root", "", "", "", False
+            ),
+            print_output=False,
+        )
+
+
+def bench_read(db, cloud, size):
+    providers = db.read_provider()
+    db.read_vm(providers)
+
+
+def bench_refresh_costs(db, cloud, size):
+    # The logic behind CloudsurgeWindow.update_cost, the first refresh seeds the cost ledger
+    vms = db.read_vm(db.read_provider())
+    refresh_costs(db, vms, db.read_accrued_costs())
+
+
+def bench_reached_cost_limits(db, cloud, size):
+    get_reached_cost_limits(db)
+
+
+def bench_active_servers(db, cloud, size):
+    get_active_servers(db)
+
+
+def bench_create_vm(db, cloud, size):
+    providers = {p.get_provider_name(): p for p in db.read_provider()}
+    for i in range(created_vms):
+        name = f"bench-new-{size}-{i}"
+        if i % 2 == 0:
+            vm = providers["AWS"].create_vm(
+                name, "bench-key", "", 50, retry_interval=0, print_output=False
+            )
+        else:
+            vm = providers["DigitalOcean"].create_vm(
+                name,
+                [],
+                "",
+                "",
+                50,
+                vm_size="s-1vcpu-1gb",
+                retry_interval=0,
+                print_output=False,
+            )
+        db.insert_vm(vm, print_output=False)
+
+
+# In order, later benchmarks see the state left by earlier ones (e.g. a seeded cost ledger)
+benchmarks = (
+    ("read_provider+read_vm", bench_read),
+    ("refresh_costs", bench_refresh_costs),
+    ("get_reached_cost_limits", bench_reached_cost_limits),
+    ("get_active_servers", bench_active_servers),
+    ("create_vm", bench_create_vm),
+)
+
+
+def measure(function, db, cloud, size) -> dict:
+    """Runs a benchmark, returns its wall time, API requests and peak traced memory."""
+    requests_before = cloud.requests.copy()
+    calls_before = api_metrics.copy()[0]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(db, cloud, size)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    requests = cloud.requests - requests_before
+    calls = {
+        f"{provider}.{method}"
+        + ("" if outcome == "success" else f" ({outcome})"): count
+        - calls_before.get((provider, method, outcome), 0)
+        for (provider, method, outcome), count in api_metrics.copy()[0].items()
+    }
+    return {
+        "seconds": seconds,
+        "peak_bytes": peak,
+        "api_requests": sum(
+            count for key, count in requests.items() if not key.startswith("ssh.")
+        ),
+        "requests": dict(requests),
+        "provider_calls": {key: count for key, count in calls.items() if count},
+    }
+
+
+def run(sizes, latency: float) -> dict:
+    results = []
+    for size in sizes:
+        cloud = FakeCloud(latency)
+        with tempfile.TemporaryDirectory() as tmp, fake_cloud(cloud):
+            db = Database(os.path.join(tmp, "bench.db"))
+            db.init()
+            with contextlib.redirect_stdout(io.StringIO()):
+                build_fleet(db, cloud, size)
+            for name, function in benchmarks:
+                result = {"benchmark": name, "vms": size}
+                result.update(measure(function, db, cloud, size))
+                results.append(result)
+                print(
+                    f"{name:<26} {size:>6} VMs  {result['seconds']:>9.3f}s"
+                    f"  {result['api_requests']:>7} requests  {result['peak_bytes'] / 2**20:>8.1f} MiB",
+                    file=sys.stderr,
+                )
+            db.close()
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "latency_ms": latency * 1000,
+        "results": results,
+    }
+
+
+def compare(current: dict, previous: dict, threshold: float) -> list:
+    """Returns the benchmarks that got slower by more than threshold or make more requests."""
+    earlier = {(r["benchmark"], r["vms"]): r for r in previous["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = earlier.get((result["benchmark"], result["vms"]))
+        if before is None:
+            continue
+        ratio = result["seconds"] / max(before["seconds"], 1e-9)
+        print(
+            f"{result['benchmark']:<26} {result['vms']:>6} VMs  x{ratio:>6.2f} time"
+            f"  {before['api_requests']:>7} -> {result['api_requests']:>7} requests",
+            file=sys.stderr,
+        )
+        # More requests for the same work is an API fan-out regression
+        if ratio > threshold or result["api_requests"] > before["api_requests"]:
+            regressions.append(result)
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Backend benchmarks with fake providers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latency of every fake API request")
+    parser.add_argument("--compare", help="Earlier results to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Allowed slowdown factor")
+    parser.add_argument("--output", help="Where to save the results (default: benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    current = run(args.sizes, args.latency_ms / 1000)
+
+    output = args.output or os.path.join(
+        results_dir, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"Saved {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(current, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,10 +18,16 @@ if [[ "$(id -u)" -eq 0 ]]; then
   exit 1
 fi
 
+if ! command -v jq >/dev/null; then
+  error "jq is required by the CloudSurge job, please install it first!"
+  exit 1
+fi
+
 CLOUDSURGE_FLATPAK="https://github.com/TechTowers/CloudSurge/releases/latest/download/cloudsurge.flatpak"
 JOB_SCRIPT="https://raw.githubusercontent.com/TechTowers/CloudSurge/refs/heads/main/scripts/cloudsurge-job.sh"
 JOB_TIMER="https://raw.githubusercontent.com/TechTowers/CloudSurge/refs/heads/main/services/cloudsurge-job.timer"
 JOB_SERVICE="https://raw.githubusercontent.com/TechTowers/CloudSurge/refs/heads/main/services/cloudsurge-job.service"
+DAEMON_SERVICE="https://raw.githubusercontent.com/TechTowers/CloudSurge/refs/heads/main/services/cloudsurge-daemon.service"
 
 SERVICE_DIR="$HOME/.config/systemd/user"
 
@@ -32,14 +38,17 @@ info "Installing the latest CloudSurge version"
 flatpak install cloudsurge.flatpak ||
   error "You already have the newest version!"
 
-info "Downloading SystemD service and timer"
+info "Downloading SystemD services and timer"
 mkdir -p "$SERVICE_DIR"
 curl -fsSL $JOB_SCRIPT >"$HOME"/.local/bin/cloudsurge-job.sh
 chmod +x "$HOME"/.local/bin/cloudsurge-job.sh
 curl -fsSL $JOB_TIMER >"$SERVICE_DIR"/cloudsurge-job.timer
 curl -fsSL $JOB_SERVICE >"$SERVICE_DIR"/cloudsurge-job.service
+curl -fsSL $DAEMON_SERVICE >"$SERVICE_DIR"/cloudsurge-daemon.service
 
-info "Enabling service and timer"
+info "Enabling services and timer"
+systemctl --user daemon-reload
+systemctl enable --user --now cloudsurge-daemon.service
 systemctl enable --user --now cloudsurge-job.timer
 
 info "Successfully installed CloudSurge and it's services :)"
@@ -1,33 +1,14 @@
 #!/usr/bin/env bash
 
-if pgrep cloudsurge; then
-  exit 0
-fi
-
-# Lists for costs
-PROVIDERS=()
-VMS=()
-LIMITS=()
-EXCEEDS=()
+# Without jq the status can not be read, so there is nothing to notify about
+command -v jq >/dev/null || exit 1
 
-# Fill the lists
-while read -r LINE; do
-  PROVIDERS+=("$(echo "$LINE" | cut -d ";" -f 1)")
-  VMS+=("$(echo "$LINE" | cut -d ";" -f 2)")
-  LIMITS+=("$(echo "$LINE" | cut -d ";" -f 3)")
-  EXCEEDS+=("$(echo "$LINE" | cut -d ";" -f 4)")
-done < <(flatpak run org.techtowers.CloudSurge -c)
+# Costs and online status in one launch, answered by the daemon or the GUI if either runs
+STATUS=$(flatpak run org.techtowers.CloudSurge --status) || exit 1
 
 # Build the notification
-BODY=""
-
-for INDEX in $(seq ${#PROVIDERS[@]}); do
-  PROVIDER=${PROVIDERS[((INDEX - 1))]}
-  VM=${VMS[((INDEX - 1))]}
-  LIMIT=${LIMITS[((INDEX - 1))]}
-  EXCEED=${EXCEEDS[((INDEX - 1))]}
-  BODY+="$VM ($PROVIDER) exceeds the cost limit of $LIMIT by $EXCEED\n"
-done
+BODY=$(jq -r '.exceeded[] | "\(.vm_name) (\(.provider)) exceeds the cost limit of \(.cost_limit) by \(.exceeded_by)"' <<<"$STATUS")
+VMS_RUNNING=$(jq -r '.online' <<<"$STATUS")
 
 if [[ -n $BODY ]]; then
   ACTION=$(
@@ -43,7 +24,7 @@ if [[ "$ACTION" == default ]]; then
   flatpak run org.techtowers.CloudSurge
 fi
 
-if [[ $(flatpak run org.techtowers.CloudSurge -o) != "0" ]] && ! pgrep gns; then
+if [[ $VMS_RUNNING != "0" ]] && ! pgrep gns; then
   ACTION=$(
     notify-send -a "CloudSurge" \
       "$VMS_RUNNING VMs are running!" \
@@ -37,6 +37,7 @@
         packages = with pkgs; [
           vhs
           bashInteractive
+          jq
         ];
       };
   };
@@ -1,11 +1,10 @@
-from datetime import date
-from .aws_provider import AWS
-from .db import Database
-from .digitalocean_provider import DigitalOcean
-from .vm import VirtualMachine
-
-
 if __name__ == "__main__":
+    from datetime import date
+    from .aws_provider import AWS
+    from .db import Database
+    from .digitalocean_provider import DigitalOcean
+    from .vm import VirtualMachine
+
     db = Database()
     db.init()
     # db.delete_database()
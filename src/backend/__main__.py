@@ -0,0 +1,7 @@
+# author: Luka Pacar
+import sys
+
+from .cli import main
+
+# Runs the headless CLI without the GUI launcher, e.g. python -m backend costs
+sys.exit(main())
@@ -7,6 +7,8 @@ import pytz
 import boto3
 from botocore.exceptions import ClientError
 
+from .metrics import instrument_boto3_client, timed_api_call
+from .spans import logger
 from .vm import VirtualMachine, Provider
 
 
@@ -42,11 +44,14 @@ class AWS(Provider):
         self.vpc_id = vpc_id
         self.subnet_id = subnet_id
         self.security_group_id = security_group_id
-        self.client = boto3.client(
-            "ec2",
-            aws_access_key_id=self.access_key,
-            aws_secret_access_key=self.secret_key,
-            region_name=self.region,
+        self.client = instrument_boto3_client(
+            boto3.client(
+                "ec2",
+                aws_access_key_id=self.access_key,
+                aws_secret_access_key=self.secret_key,
+                region_name=self.region,
+            ),
+            self.get_provider_name(),
         )
 
     @staticmethod
@@ -82,6 +87,7 @@ class AWS(Provider):
             + f"{self.access_key}{Provider.delimiter}{self.secret_key}{Provider.delimiter}{self.region}{Provider.delimiter}{self.vpc_id}{Provider.delimiter}{self.subnet_id}{Provider.delimiter}{self.security_group_id}"
         )
 
+    @timed_api_call
     def connection_is_alive(self, print_output=True) -> bool:
         """Verifies if AWS credentials and connection work."""
         try:
@@ -92,6 +98,7 @@ class AWS(Provider):
             print(f"Authentication failed: {e}") if print_output else None
             return False
 
+    @timed_api_call
     def create_resources(self, location: str, print_output=True):
         """Creates VPC, subnet, security group only if not already created."""
         try:
@@ -158,6 +165,89 @@ class AWS(Provider):
         except ClientError as e:
             print(f"Failed to create resources: {e}")
 
+    @timed_api_call
+    def delete_resources(
+        self, attempts: int = 10, retry_interval: int = 6, print_output=True
+    ):
+        """
+        Deletes the VPC, subnet, internet gateway, route tables and security group of create_resources().
+
+        Terminated instances release their network interfaces with a delay, so deletions refused
+        with a DependencyViolation are retried. Resources that are already gone are skipped.
+
+        :param attempts: How often the deletion is tried.
+        :param retry_interval: Seconds between the attempts.
+        :raises ValueError: If the resources could not be deleted.
+        """
+        if self.vpc_id is None:
+            return
+        for attempt in range(attempts):
+            try:
+                self._delete_resources()
+                break
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code != "DependencyViolation" or attempt == attempts - 1:
+                    raise ValueError(f"Failed to delete resources: {e}")
+                time.sleep(retry_interval)
+
+        self.vpc_id = None
+        self.subnet_id = None
+        self.security_group_id = None
+        print(
+            "\033[32mDeleted VPC, subnet, security group and associated resources.\033[0m"
+        ) if print_output else None
+
+    def _delete_resources(self):
+        def ignore_missing(operation, **params):
+            try:
+                operation(**params)
+            except ClientError as e:
+                if not e.response.get("Error", {}).get("Code", "").endswith("NotFound"):
+                    raise
+
+        vpc_filter = [{"Name": "vpc-id", "Values": [self.vpc_id]}]
+        if self.security_group_id:
+            ignore_missing(
+                self.client.delete_security_group, GroupId=self.security_group_id
+            )
+
+        for internet_gateway in self.client.describe_internet_gateways(
+            Filters=[{"Name": "attachment.vpc-id", "Values": [self.vpc_id]}]
+        )["InternetGateways"]:
+            internet_gateway_id = internet_gateway["InternetGatewayId"]
+            ignore_missing(
+                self.client.detach_internet_gateway,
+                InternetGatewayId=internet_gateway_id,
+                VpcId=self.vpc_id,
+            )
+            ignore_missing(
+                self.client.delete_internet_gateway,
+                InternetGatewayId=internet_gateway_id,
+            )
+
+        # The main route table goes with the VPC, the others have to be deleted first
+        for route_table in self.client.describe_route_tables(Filters=vpc_filter)[
+            "RouteTables"
+        ]:
+            associations = route_table.get("Associations", [])
+            if any(association.get("Main") for association in associations):
+                continue
+            for association in associations:
+                ignore_missing(
+                    self.client.disassociate_route_table,
+                    AssociationId=association["RouteTableAssociationId"],
+                )
+            ignore_missing(
+                self.client.delete_route_table,
+                RouteTableId=route_table["RouteTableId"],
+            )
+
+        if self.subnet_id:
+            ignore_missing(self.client.delete_subnet, SubnetId=self.subnet_id)
+        ignore_missing(self.client.delete_vpc, VpcId=self.vpc_id)
+
+    @timed_api_call
     def create_vm(
         self,
         vm_name: str,
@@ -172,6 +262,7 @@ class AWS(Provider):
         max_retries: int = 1000,
         retry_interval: int = 10,
         print_output=True,
+        checkpoint=None,
     ):
         """
         Creates an EC2 instance on AWS with public access (reachable from the internet).
@@ -188,6 +279,7 @@ class AWS(Provider):
         :param max_retries: Maximum retries for load (until the VM gets an IP).
         :param retry_interval: Time in seconds between each Public-IP-Test-Retry.
         :param print_output: Print outputs with useful info.
+        :param checkpoint: Called with ("instance_created", {"instance_id": ...}) as soon as the instance exists.
         """
         if ssh_key_path == "EvaluateSelf":
             ssh_key_path = f"~/.ssh/{aws_ssh_key_name}.pem"
@@ -235,6 +327,8 @@ class AWS(Provider):
             print(
                 f"VM '{vm_name}' created. Instance ID: {instance_id}\033[0m"
             ) if print_output else None
+            if checkpoint:
+                checkpoint("instance_created", {"instance_id": instance_id})
 
             # Wait for the instance to be running
             retries = 0
@@ -252,9 +346,7 @@ class AWS(Provider):
                     ) if print_output else None
                     break
                 else:
-                    print(
-                        f"\033[33mInstance '{vm_name}' state: {state}\033[0m"
-                    ) if print_output else None
+                    logger.debug(f"Instance '{vm_name}' state: {state}")
 
                 retries += 1
                 time.sleep(retry_interval)
@@ -287,7 +379,8 @@ class AWS(Provider):
         except ClientError as e:
             raise ValueError(f"Failed to create VM '{vm_name}': {e}")
 
-    def stop_vm(self, vm: VirtualMachine, print_output=True):
+    @timed_api_call
+    def stop_vm(self, vm: VirtualMachine, db=None, print_output=True):
         """Stops an EC2 instance on AWS."""
         instance_name = vm.get_vm_name()
         try:
@@ -299,10 +392,13 @@ class AWS(Provider):
             print(
                 f"Stopping VM '{instance_name}' (ID: {instance_id})."
             ) if print_output else None
+            if db:
+                db.record_vm_transition(vm, "stopped")
         except ClientError as e:
             print(f"Failed to stop VM '{instance_name}': {e}")
 
-    def start_vm(self, vm: VirtualMachine, print_output=True):
+    @timed_api_call
+    def start_vm(self, vm: VirtualMachine, db=None, print_output=True):
         """Stops an EC2 instance on AWS."""
         instance_name = vm.get_vm_name()
         try:
@@ -314,11 +410,14 @@ class AWS(Provider):
             print(
                 f"Starting VM '{instance_name}' (ID: {instance_id})."
             ) if print_output else None
+            if db:
+                db.record_vm_transition(vm, "running")
 
         except ClientError as e:
             print(f"Failed to start VM '{instance_name}': {e}")
 
-    def delete_vm(self, vm: VirtualMachine, db, print_output=True):
+    @timed_api_call
+    def delete_vm(self, vm: VirtualMachine, db=None, print_output=True):
         """Deletes an EC2 instance on AWS."""
         instance_name = vm.get_vm_name()
         try:
@@ -330,10 +429,22 @@ class AWS(Provider):
                 f"VM '{instance_name}' is being terminated."
             ) if print_output else None
             if db:
+                db.record_vm_transition(vm, "deleted")
                 db.delete_vm(vm)
         except ClientError as e:
             print(f"Failed to delete VM '{instance_name}': {e}")
 
+    @timed_api_call
+    def delete_instance(self, instance_id: str, print_output=True):
+        """Terminates an EC2 instance by its ID, e.g. one left behind by an interrupted creation."""
+        try:
+            self.client.terminate_instances(InstanceIds=[instance_id])
+            print(
+                f"Instance '{instance_id}' is being terminated."
+            ) if print_output else None
+        except ClientError as e:
+            raise ValueError(f"Failed to terminate instance '{instance_id}': {e}")
+
     instance_type_to_hourly_rate = {
         "t3.micro": 0.0084,  # Burstable performance (1 vCPU, 1 GB RAM)
         "t3.small": 0.0168,  # Burstable performance (1 vCPU, 2 GB RAM)
@@ -398,6 +509,7 @@ class AWS(Provider):
         "mac1.metal": 1.083,  # macOS dedicated (12 vCPUs, 32 GB RAM)
     }
 
+    @timed_api_call
     def get_vm_hourly_rate(
         self, vm: VirtualMachine, print_output=True
     ) -> float:
@@ -438,6 +550,7 @@ class AWS(Provider):
             print(f"Error describing instance '{instance_name}': {e}")
             return -1
 
+    @timed_api_call
     def get_vm_uptime(self, vm: VirtualMachine, print_output=True):
         """
         Get the uptime of the EC2 VM.
@@ -481,6 +594,7 @@ class AWS(Provider):
                 )
             return None
 
+    @timed_api_call
     def get_vm_cost(self, vm: VirtualMachine, print_output=True) -> float:
         """
         Calculates the total cost of an AWS EC2 instance based on uptime and hourly rate.
@@ -539,6 +653,7 @@ class AWS(Provider):
                 )
             return 0.0
 
+    @timed_api_call
     def get_instance_id_by_name(self, instance_name: str, print_output=True):
         """Gets the instance ID of an EC2 instance by its name, ignoring terminated instances."""
         try:
@@ -564,6 +679,148 @@ class AWS(Provider):
             print(f"Failed to get instance ID for '{instance_name}': {e}")
             return None
 
+    instance_state_to_vm_state = {
+        "pending": "pending",
+        "running": "running",
+        "shutting-down": "stopping",
+        "stopping": "stopping",
+        "stopped": "stopped",
+        "terminated": "deleted",
+    }
+
+    @timed_api_call
+    def get_vm_state(self, vm: VirtualMachine, print_output=True) -> str:
+        """
+        Returns the state of the EC2 instance using a single describe call.
+
+        :param vm: The virtual machine to check.
+        :param print_output: Flag to print errors to console.
+        :return: One of Provider.vm_states.
+        """
+        instance_name = vm.get_vm_name()
+        try:
+            response = self.client.describe_instances(
+                Filters=[{"Name": "tag:Name", "Values": [instance_name]}]
+            )
+            for reservation in response["Reservations"]:
+                for instance in reservation["Instances"]:
+                    state = instance["State"]["Name"]
+                    if state != "terminated":
+                        return self.instance_state_to_vm_state.get(
+                            state, "unknown"
+                        )
+            return "deleted"
+
+        except ClientError as e:
+            print(
+                f"Failed to get the state of VM '{instance_name}': {e}"
+            ) if print_output else None
+            return "unknown"
+
+    # Most values a single DescribeInstances filter accepts
+    filter_values_limit = 200
+
+    @timed_api_call
+    def get_instances_by_names(self, instance_names) -> dict:
+        """
+        Returns the non-terminated EC2 instances of several names, described in batches.
+
+        :param instance_names: Names of the instances.
+        :return: Instance descriptions by name, names without an instance are left out.
+        """
+        instance_names = list(instance_names)
+        instances = {}
+        for i in range(0, len(instance_names), self.filter_values_limit):
+            params = {
+                "Filters": [
+                    {
+                        "Name": "tag:Name",
+                        "Values": instance_names[i : i + self.filter_values_limit],
+                    }
+                ]
+            }
+            while True:
+                response = self.client.describe_instances(**params)
+                for reservation in response["Reservations"]:
+                    for instance in reservation["Instances"]:
+                        if instance["State"]["Name"] == "terminated":
+                            continue
+                        for tag in instance.get("Tags", []):
+                            if tag["Key"] == "Name":
+                                instances.setdefault(tag["Value"], instance)
+                if not response.get("NextToken"):
+                    break
+                params["NextToken"] = response["NextToken"]
+        return instances
+
+    @timed_api_call
+    def get_vm_states(self, vms, print_output=True) -> dict:
+        """Returns the states of several VMs by name, using as few describe calls as possible."""
+        names = [vm.get_vm_name() for vm in vms]
+        try:
+            instances = self.get_instances_by_names(names)
+        except ClientError as e:
+            print(f"Failed to get the state of VMs: {e}") if print_output else None
+            return {name: "unknown" for name in names}
+        return {
+            name: self.instance_state_to_vm_state.get(
+                instances[name]["State"]["Name"], "unknown"
+            )
+            if name in instances
+            else "deleted"
+            for name in names
+        }
+
+    def _act_on_instances(self, operation: str, vms, print_output=True) -> list:
+        """Runs an EC2 operation on the instances of several VMs with a single call.
+
+        Returns the VMs that had an instance, raises ValueError if the operation failed.
+        """
+        instances = self.get_instances_by_names(vm.get_vm_name() for vm in vms)
+        found = [vm for vm in vms if vm.get_vm_name() in instances]
+        for vm in vms:
+            if vm not in found:
+                print(
+                    f"No active instance found with name '{vm.get_vm_name()}'."
+                ) if print_output else None
+        if not found:
+            return found
+        try:
+            getattr(self.client, operation)(
+                InstanceIds=[instances[vm.get_vm_name()]["InstanceId"] for vm in found]
+            )
+        except ClientError as e:
+            raise ValueError(f"Failed to run {operation} on {len(found)} VMs: {e}")
+        return found
+
+    @timed_api_call
+    def stop_vms(self, vms, db=None, print_output=True):
+        """Stops several EC2 instances with a single StopInstances call."""
+        for vm in self._act_on_instances("stop_instances", vms, print_output):
+            print(f"Stopping VM '{vm.get_vm_name()}'.") if print_output else None
+            if db:
+                db.record_vm_transition(vm, "stopped")
+
+    @timed_api_call
+    def start_vms(self, vms, db=None, print_output=True):
+        """Starts several EC2 instances with a single StartInstances call."""
+        for vm in self._act_on_instances("start_instances", vms, print_output):
+            print(f"Starting VM '{vm.get_vm_name()}'.") if print_output else None
+            if db:
+                db.record_vm_transition(vm, "running")
+
+    @timed_api_call
+    def delete_vms(self, vms, db=None, print_output=True):
+        """Terminates several EC2 instances with a single TerminateInstances call."""
+        for vm in self._act_on_instances("terminate_instances", vms, print_output):
+            print(
+                f"VM '{vm.get_vm_name()}' is being terminated."
+            ) if print_output else None
+            if db:
+                db.record_vm_transition(vm, "deleted")
+                db.delete_vm(vm)
+
+    @timed_api_call
     def is_active(self, vm: VirtualMachine) -> bool:
         """
         Checks if the VM is currently running on AWS.
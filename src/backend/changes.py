@@ -0,0 +1,245 @@
+# author: Luka Pacar
+import threading
+import time
+from collections import deque
+
+# Fields of a vm_record() that are compared between updates
+watched_fields = (
+    "public_ip",
+    "state",
+    "hourly_rate",
+    "accrued_cost",
+    "online",
+    "exceeded_by",
+)
+
+
+def diff_records(previous: dict, records, complete: bool = True) -> list:
+    """Compares VM records with the previous ones and returns the per-VM deltas.
+
+    Args:
+        previous (dict): Previous records by VM name.
+        records (list): New records, they may only hold some of the watched fields.
+        complete (bool): Whether records holds every VM. Only then VMs missing from it are removed.
+
+    Returns:
+        list: Deltas with the keys vm_name, change ("added", "changed" or "removed"),
+            fields (the watched fields that changed), record (the merged new record,
+            None once removed) and previous (the record before, None if added).
+    """
+    deltas = []
+    # Records of a VM given more than once are diffed against the one before
+    current = dict(previous)
+    for record in records:
+        vm_name = record["vm_name"]
+        before = current.get(vm_name)
+        merged = dict(before or {})
+        merged.update(record)
+        current[vm_name] = merged
+        fields = [
+            field
+            for field in watched_fields
+            if field in record and (before is None or before.get(field) != record[field])
+        ]
+        if before is not None and not fields:
+            continue
+        deltas.append(
+            {
+                "vm_name": vm_name,
+                "change": "added" if before is None else "changed",
+                "fields": fields,
+                "record": merged,
+                "previous": before,
+            }
+        )
+
+    if complete:
+        seen = {record["vm_name"] for record in records}
+        for vm_name, before in previous.items():
+            if vm_name not in seen:
+                deltas.append(
+                    {
+                        "vm_name": vm_name,
+                        "change": "removed",
+                        "fields": [],
+                        "record": None,
+                        "previous": before,
+                    }
+                )
+    return deltas
+
+
+def ledger_record(vm, entry):
+    """Returns the record of a VM and its cost ledger entry, as given to FleetChanges."""
+    record = {
+        "vm_name": vm.get_vm_name(),
+        "provider": vm.get_provider().get_provider_name(),
+        "public_ip": str(vm.get_public_ip()),
+    }
+    if entry is not None:
+        record.update(
+            {key: entry[key] for key in ("state", "hourly_rate", "accrued_cost")}
+        )
+    return record
+
+
+class FleetChanges:
+    """Turns successive VM records into change events.
+
+    Listeners are called with the list of deltas of every update, in the thread calling update()
+    and in the order the updates were applied.
+    The last deltas are kept, so clients polling with since() only receive what changed.
+
+    Args:
+        history (int): Number of deltas kept for since().
+    """
+
+    def __init__(self, history: int = 1024):
+        self.version = 0
+        self._records = {}
+        # Time each watched field of a VM was last checked with its provider, by VM name
+        self._checked = {}
+        self._log = deque(maxlen=history)
+        self._listeners = []
+        self._lock = threading.Lock()
+        # Held from diffing to notifying, so listeners get the deltas in the order they were applied
+        self._order_lock = threading.RLock()
+
+    def add_listener(self, listener) -> None:
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def get_records(self) -> dict:
+        """Returns a copy of the current records by VM name."""
+        with self._lock:
+            return dict(self._records)
+
+    def get_record(self, vm_name: str) -> dict:
+        """Returns the current record of a VM, an empty dict if there is none."""
+        with self._lock:
+            return self._records.get(vm_name, {})
+
+    def get_age(self, vm_name: str, field: str):
+        """Returns the seconds since a field of a VM was last checked, None if it never was."""
+        with self._lock:
+            checked = self._checked.get(vm_name, {}).get(field)
+        return None if checked is None else time.time() - checked
+
+    def update(self, records, complete: bool = True, checked: bool = True) -> list:
+        """Applies new records, notifies the listeners and returns the deltas (see diff_records()).
+
+        With checked=False the records are not fresh from the provider (e.g. read from the
+        cost ledger) and their age is left as it was.
+        """
+        records = list(records)
+        with self._order_lock:
+            with self._lock:
+                deltas = diff_records(self._records, records, complete)
+                self._apply(deltas)
+                if checked:
+                    now = time.time()
+                    for record in records:
+                        self._checked.setdefault(record["vm_name"], {}).update(
+                            (field, now) for field in watched_fields if field in record
+                        )
+            self._notify(deltas)
+        return deltas
+
+    def remove(self, vm_names) -> list:
+        """Removes the records of VMs, notifies the listeners and returns the deltas."""
+        with self._order_lock:
+            with self._lock:
+                deltas = [
+                    {
+                        "vm_name": vm_name,
+                        "change": "removed",
+                        "fields": [],
+                        "record": None,
+                        "previous": self._records[vm_name],
+                    }
+                    for vm_name in set(vm_names)
+                    if vm_name in self._records
+                ]
+                self._apply(deltas)
+            self._notify(deltas)
+        return deltas
+
+    def _apply(self, deltas):
+        for delta in deltas:
+            if delta["record"] is None:
+                self._records.pop(delta["vm_name"], None)
+                self._checked.pop(delta["vm_name"], None)
+            else:
+                self._records[delta["vm_name"]] = delta["record"]
+            self.version += 1
+            self._log.append((self.version, delta))
+
+    def _notify(self, deltas):
+        if deltas:
+            for listener in list(self._listeners):
+                listener(deltas)
+
+    def since(self, version: int) -> dict:
+        """Returns the last delta of every VM changed after version.
+
+        The result is {"version": ..., "reset": ..., "deltas": [...]}, with the version to ask for next.
+
+        If the deltas after version are no longer kept, reset is True and every VM is returned
+        as added, so the client starts over.
+        """
+        with self._lock:
+            if version == self.version:
+                return {"version": self.version, "reset": False, "deltas": []}
+            if version > self.version or not self._log or self._log[0][0] > version + 1:
+                return {
+                    "version": self.version,
+                    "reset": True,
+                    "deltas": diff_records({}, self._records.values()),
+                }
+            # Only the last delta of every VM is returned, its record is the current one
+            latest = {}
+            for v, delta in self._log:
+                if v > version:
+                    latest.pop(delta["vm_name"], None)
+                    latest[delta["vm_name"]] = delta
+            return {"version": self.version, "reset": False, "deltas": list(latest.values())}
+
+
+class CostTotals:
+    """Accrued cost and hourly rates by provider, patched by deltas instead of recomputed."""
+
+    def __init__(self):
+        # [accrued cost, hourly rates, number of VMs with a ledger entry] by provider name
+        self._totals = {}
+
+    def _add(self, record, sign: int):
+        if record is None or record.get("accrued_cost") is None:
+            return
+        totals = self._totals.setdefault(record.get("provider"), [0, 0, 0])
+        totals[0] += sign * record["accrued_cost"]
+        totals[1] += sign * (record.get("hourly_rate") or 0)
+        totals[2] += sign
+
+    def apply(self, deltas) -> bool:
+        """Applies deltas, returns whether the totals changed."""
+        changed = False
+        for delta in deltas:
+            if delta["change"] == "changed" and not {
+                "accrued_cost",
+                "hourly_rate",
+            }.intersection(delta["fields"]):
+                continue
+            self._add(delta["previous"], -1)
+            self._add(delta["record"], 1)
+            changed = True
+        return changed
+
+    def get_total_cost(self, provider_name: str) -> float:
+        return self._totals.get(provider_name, [0, 0, 0])[0]
+
+    def get_avg_hourly_rate(self, provider_name: str) -> float:
+        _, hourly_rates, count = self._totals.get(provider_name, [0, 0, 0])
+        return hourly_rates / count if count else 0
@@ -0,0 +1,287 @@
+# author: Luka Pacar
+import argparse
+import csv
+import fcntl
+import json
+import os
+import sys
+
+from .daemon import FleetDaemon, query, query_fleet, runtime_file
+from .db import Database
+from .metrics import add_trace_listener, print_operation
+from .reached_cost_limits import iter_reached_cost_limits
+from .server_is_active import iter_reachability
+from .status import iter_vm_status, summarize_status
+from .watch import FleetWatch
+
+# Options of the GUI application that are answered by this CLI instead
+legacy_options = {
+    "-c": "costs",
+    "--costs": "costs",
+    "-o": "online",
+    "--online": "online",
+    "--status": "status",
+}
+formats = ("text", "json", "ndjson", "csv")
+commands = (
+    "costs",
+    "online",
+    "status",
+    "list",
+    "start",
+    "stop",
+    "delete",
+    "jobs",
+    "daemon",
+)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Builds the parser for all CLI subcommands."""
+    parser = argparse.ArgumentParser(
+        prog="cloudsurge",
+        description="Headless CloudSurge commands. Run without arguments to start the GUI.",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Prints every provider operation and the API requests it made to stderr",
+    )
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    for command, description in (
+        ("costs", "Displays all VMs that overrun the cost limit"),
+        ("online", "Shows the count of the currently online VMs"),
+        ("status", "Prints the cost limit overruns and the online count"),
+        ("list", "Lists all VMs"),
+    ):
+        report = subcommands.add_parser(command, help=description)
+        report.add_argument(
+            "--format",
+            choices=formats,
+            default="json" if command == "status" else "text",
+            help="Output format, ndjson prints every VM as soon as it is known",
+        )
+        if command == "status":
+            report.add_argument(
+                "--watch",
+                action="store_true",
+                help="Redraws a table of all VMs whenever they change",
+            )
+    for command, description in (
+        ("start", "Starts a VM"),
+        ("stop", "Stops a VM"),
+        ("delete", "Deletes a VM"),
+    ):
+        subcommand = subcommands.add_parser(command, help=description)
+        subcommand.add_argument("vm_name", help="Name of the VM")
+    subcommands.add_parser(
+        "jobs", help="Resumes interrupted jobs and runs all queued jobs"
+    )
+    daemon = subcommands.add_parser(
+        "daemon", help="Keeps the fleet state warm and serves it to the GUI and the CLI"
+    )
+    daemon.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Also serves OpenMetrics on http://127.0.0.1:PORT/metrics",
+    )
+    return parser
+
+
+def is_cli_invocation(argv) -> bool:
+    """Returns True if the arguments are meant for the CLI and not for the GUI."""
+    argv = [arg for arg in argv if arg != "--trace"]
+    if not argv:
+        return False
+    return argv[0] in legacy_options or argv[0] in commands
+
+
+def lock_gui():
+    """Marks the GUI as running for as long as the returned file descriptor stays open.
+
+    Returns None if another GUI instance already holds the lock.
+    """
+    path = runtime_file("cloudsurge-gui.lock")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock = os.open(path, os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(lock)
+        return None
+    return lock
+
+
+def gui_is_running() -> bool:
+    """Returns True if a GUI instance holds the lock of lock_gui()."""
+    lock = lock_gui()
+    if lock is None:
+        return True
+    os.close(lock)
+    return False
+
+
+def is_answered_by_gui(argv) -> bool:
+    """Returns True if a running GUI should answer the invocation from its loaded state.
+
+    Only the options registered with the GUI application can be forwarded to it.
+    """
+    return len(argv) == 1 and argv[0] in legacy_options and gui_is_running()
+
+
+def find_vm(db: Database, vm_name: str):
+    """Finds a VM by name. Its provider is only constructed once the VM is acted upon."""
+    for vm in db.read_vm(db.read_provider(lazy=True)):
+        if vm.get_vm_name() == vm_name:
+            return vm
+    return None
+
+
+def list_vms(db: Database):
+    """Yields all VMs as report records."""
+    for vm in db.read_vm(db.read_provider(lazy=True)):
+        yield {
+            "account": vm.get_provider().get_account_name(),
+            "provider": vm.get_provider().get_provider_name(),
+            "vm_name": vm.get_vm_name(),
+            "public_ip": str(vm.get_public_ip()),
+        }
+
+
+def write_records(records, output_format: str, fields, out=sys.stdout):
+    """Writes report records in a machine-readable format.
+
+    json writes one array once all records are known, ndjson and csv write (and flush)
+    every record as soon as it is yielded.
+    """
+    records = ({field: record[field] for field in fields} for record in records)
+    if output_format == "json":
+        json.dump(list(records), out)
+        out.write("\n")
+        return
+
+    writer = None
+    if output_format == "csv":
+        writer = csv.DictWriter(out, fieldnames=fields)
+        writer.writeheader()
+    for record in records:
+        if writer is not None:
+            writer.writerow(record)
+        else:
+            out.write(json.dumps(record) + "\n")
+        out.flush()
+
+
+def report(db: Database, command: str, output_format: str):
+    """Prints the report of a command in the requested format.
+
+    A running daemon answers from its warm fleet state, otherwise the VMs are checked here.
+    """
+    fleet = None if command == "list" else query_fleet()
+    if command == "costs":
+        if fleet is not None:
+            records = [r for r in fleet["vms"] if r["exceeded_by"] is not None]
+        else:
+            records = (
+                {
+                    "provider": vm.get_provider().get_provider_name(),
+                    "vm_name": vm.get_vm_name(),
+                    "cost_limit": vm.get_cost_limit(),
+                    "exceeded_by": val,
+                }
+                for vm, val in iter_reached_cost_limits(db)
+            )
+        fields = ("provider", "vm_name", "cost_limit", "exceeded_by")
+    elif command == "online":
+        if fleet is not None:
+            records = fleet["vms"]
+        else:
+            records = (
+                {
+                    "provider": vm.get_provider().get_provider_name(),
+                    "vm_name": vm.get_vm_name(),
+                    "online": reachable,
+                }
+                for vm, reachable in iter_reachability(db)
+            )
+        fields = ("provider", "vm_name", "online")
+    elif command == "status":
+        records = fleet["vms"] if fleet is not None else iter_vm_status(db)
+        fields = ("provider", "vm_name", "cost_limit", "exceeded_by", "online")
+    else:
+        records = list_vms(db)
+        fields = ("account", "provider", "vm_name", "public_ip")
+
+    if command == "status" and output_format in ("text", "json"):
+        # One document with the totals, as read by cloudsurge-job.sh
+        sampled_at = fleet["sampled_at"] if fleet is not None else None
+        print(json.dumps(summarize_status(records, sampled_at)))
+    elif output_format != "text":
+        write_records(records, output_format, fields)
+    elif command == "online":
+        print(sum(1 for record in records if record["online"]))
+    else:
+        for record in records:
+            print(";".join(str(record[field]) for field in fields))
+
+
+def main(argv=None) -> int:
+    """Runs a CLI command and returns the exit status."""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    trace = "--trace" in argv
+    argv = [arg for arg in argv if arg != "--trace"]
+    if argv and argv[0] in legacy_options:
+        argv[0] = legacy_options[argv[0]]
+    args = build_parser().parse_args(argv)
+    if trace:
+        add_trace_listener(print_operation)
+
+    if args.command == "daemon":
+        db = Database(threaded=True)
+        db.init()
+        try:
+            FleetDaemon(db, metrics_port=args.metrics_port).run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            db.close()
+        return 0
+
+    db = Database()
+    db.init()
+    try:
+        if args.command == "status" and args.watch:
+            try:
+                FleetWatch(db).run()
+            except KeyboardInterrupt:
+                pass
+        elif args.command in ("costs", "online", "status", "list"):
+            report(db, args.command, args.format)
+        elif args.command == "jobs":
+            from .jobs import JobQueue
+
+            job_queue = JobQueue(db)
+            job_queue.recover()
+            for job, _ in job_queue.drain():
+                print(f"{job} finished.")
+        else:
+            vm = find_vm(db, args.vm_name)
+            if vm is None:
+                print(f"VM '{args.vm_name}' not found.", file=sys.stderr)
+                return 1
+            if args.command == "start":
+                vm.get_provider().start_vm(vm, db)
+            elif args.command == "stop":
+                vm.get_provider().stop_vm(vm, db)
+            elif args.command == "delete":
+                vm.get_provider().delete_vm(vm, db)
+            # Let a running daemon pick up the change right away
+            query("refresh")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+# author: Luka Pacar
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from .changes import FleetChanges
+from .db import Database
+from .metrics import serve_metrics
+from .fleet import ProviderCache, probe_fleet, refresh_costs
+from .schedule import AdaptiveInterval
+from .snapshot import build_snapshot, save_snapshot
+from .spans import spanned
+
+
+def runtime_file(name: str) -> str:
+    """Returns the path of a file in the user's runtime directory.
+
+    Inside the flatpak sandbox only the app's own runtime directory is shared between instances.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "/tmp")
+    if "FLATPAK_ID" in os.environ:
+        runtime_dir = os.path.join(runtime_dir, "app", os.environ["FLATPAK_ID"])
+    return os.path.join(runtime_dir, name)
+
+
+def socket_file() -> str:
+    """Returns the path of the daemon's socket."""
+    return runtime_file("cloudsurge.sock")
+
+
+def query(command: str, path: str = None, timeout: float = 2, **params):
+    """Sends a command to the daemon and returns its result, or None if no daemon is running."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(path or socket_file())
+            client.sendall(json.dumps(dict(params, command=command)).encode() + b"\n")
+            with client.makefile("rb") as response:
+                answer = json.loads(response.readline())
+    except (OSError, ValueError):
+        return None
+    if "error" in answer:
+        return None
+    return answer["result"]
+
+
+def query_fleet(path: str = None):
+    """Returns the daemon's warm fleet state, or None if there is no daemon or it has not refreshed yet."""
+    fleet = query("fleet", path)
+    if fleet is None or fleet["sampled_at"] is None:
+        return None
+    return fleet
+
+
+def query_changes(since: int, path: str = None):
+    """Returns the daemon's VM deltas after version since (see FleetChanges.since()).
+
+    Returns None if there is no daemon or it has not refreshed yet.
+    """
+    changes = query("changes", path, since=since)
+    if changes is None or changes["version"] == 0:
+        return None
+    return changes
+
+
+class FleetDaemon:
+    """Owns the provider clients and keeps the fleet state warm for any number of clients.
+
+    The fleet is refreshed by a single thread at an adaptive interval, queries are answered
+    from the last refresh and never reach the providers.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        path: str = None,
+        interval: AdaptiveInterval = None,
+        metrics_port: int = None,
+    ):
+        self.db = db
+        self.metrics_port = metrics_port
+        self.path = path or socket_file()
+        self.interval = interval or AdaptiveInterval()
+        self.fleet = {"sampled_at": None, "vms": []}
+        self.changes = FleetChanges()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._providers = ProviderCache()
+        self._hourly_rates = {}
+        self._server = None
+
+    @spanned("daemon.refresh")
+    def refresh(self) -> float:
+        """Refreshes the fleet state and returns the time until the next refresh."""
+        providers = self._providers.read(self.db)
+        vms = self.db.read_vm(providers)
+        accrued_costs = refresh_costs(
+            self.db, vms, self.db.read_accrued_costs(), self._hourly_rates
+        )
+        records = probe_fleet(self.db, vms, accrued_costs)
+
+        with self._lock:
+            self.fleet = {"sampled_at": int(time.time()), "vms": records}
+        deltas = self.changes.update(records)
+        save_snapshot(build_snapshot(providers, vms, accrued_costs))
+        # Costs change on every refresh, only a changed state or reachability counts as activity
+        changed = any(
+            delta["change"] != "changed" or {"state", "online"}.intersection(delta["fields"])
+            for delta in deltas
+        )
+        return self.interval.next(changed, (record["state"] for record in records))
+
+    def handle(self, request: dict):
+        """Answers a client request."""
+        command = request.get("command")
+        if command == "fleet":
+            with self._lock:
+                return self.fleet
+        elif command == "changes":
+            return self.changes.since(int(request.get("since", 0)))
+        elif command == "refresh":
+            self.interval.reset()
+            self._wake.set()
+            return True
+        raise ValueError(f"Unknown command '{command}'")
+
+    def run(self):
+        """Serves clients until stop() is called."""
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    answer = {"result": daemon.handle(json.loads(self.rfile.readline()))}
+                except Exception as e:
+                    answer = {"error": str(e)}
+                self.wfile.write(json.dumps(answer).encode() + b"\n")
+
+        if os.path.exists(self.path):
+            if query("fleet", self.path) is not None:
+                raise RuntimeError(f"A daemon is already listening on {self.path}")
+            os.remove(self.path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"Listening on {self.path}")
+        metrics_server = None
+        if self.metrics_port is not None:
+            # Scrapes read the last refresh, they never reach the providers
+            metrics_server = serve_metrics(
+                lambda: self.handle({"command": "fleet"}), self.metrics_port
+            )
+            print(f"Serving metrics on http://127.0.0.1:{self.metrics_port}/metrics")
+        try:
+            while not self._stop.is_set():
+                try:
+                    delay = self.refresh()
+                except Exception as e:
+                    print(f"Error refreshing the fleet: {e}")
+                    delay = self.interval.maximum
+                self._wake.wait(delay)
+                self._wake.clear()
+        finally:
+            if metrics_server is not None:
+                metrics_server.shutdown()
+                metrics_server.server_close()
+            self._server.shutdown()
+            self._server.server_close()
+            os.remove(self.path)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+if __name__ == "__main__":
+    db = Database(threaded=True)
+    db.init()
+    try:
+        FleetDaemon(db).run()
+    finally:
+        db.close()
@@ -1,16 +1,196 @@
 # author: Luka Pacar 4CN
+import queue
 import sqlite3
+import json
+import threading
+import time
+import weakref
+from concurrent.futures import Future
 from datetime import date
 import re
 import os
 
-from .aws_provider import AWS
 from .no_provider import NoProvider
+from .spans import spanned
+
+
+class _DatabaseWriter(threading.Thread):
+    """Owns the only writing connection and applies queued write operations in batched transactions."""
+
+    max_batch_size = 64
+
+    def __init__(self, db_file: str):
+        super().__init__(name="cloudsurge-db-writer", daemon=True)
+        self.db_file = db_file
+        self.queue = queue.Queue()
+        # Set once the connection is open (or could not be opened)
+        self.ready = threading.Event()
+        # The error that stopped the thread, every write fails with it from then on
+        self.error = None
+        self._error_lock = threading.Lock()
+
+    def start(self):
+        """Starts the thread and waits for its connection, raising the error if it can not be opened."""
+        super().start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, operation) -> Future:
+        """Queues operation(cursor) and returns a future resolving to its result once committed."""
+        future = Future()
+        with self._error_lock:
+            if self.error is not None:
+                future.set_exception(self.error)
+            else:
+                self.queue.put((operation, future))
+        return future
+
+    def _fail(self, error, batch=()):
+        """Fails the writes of batch and all queued ones, as well as every later write."""
+        with self._error_lock:
+            self.error = error
+            items = list(batch)
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+        for item in items:
+            if item is not None and not item[1].done():
+                item[1].set_exception(error)
+
+    def stop(self):
+        """Applies all queued operations and stops the thread."""
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        try:
+            connection = sqlite3.connect(self.db_file, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+        except Exception as e:
+            self._fail(e)
+            return
+        finally:
+            self.ready.set()
+
+        batch = []
+        try:
+            self._apply_batches(connection.cursor(), batch)
+        except Exception as e:
+            self._fail(e, batch)
+        finally:
+            connection.close()
+
+    def _apply_batches(self, cursor, batch):
+        """Applies queued operations until stopped, batch holds the operations in progress."""
+        running = True
+        while running:
+            # Block for the first operation, then take whatever else is already waiting
+            batch[:] = [self.queue.get()]
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            applied = []
+            cursor.execute("BEGIN")
+            for item in batch:
+                if item is None:
+                    running = False
+                    continue
+                operation, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                # A savepoint per operation keeps one failing write from undoing the rest of the batch
+                cursor.execute("SAVEPOINT operation")
+                try:
+                    result = operation(cursor)
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO operation")
+                    cursor.execute("RELEASE operation")
+                    future.set_exception(e)
+                else:
+                    cursor.execute("RELEASE operation")
+                    applied.append((future, result))
+
+            try:
+                cursor.execute("COMMIT")
+            except sqlite3.Error as e:
+                cursor.execute("ROLLBACK")
+                for future, _ in applied:
+                    future.set_exception(e)
+                continue
+
+            for future, result in applied:
+                future.set_result(result)
+
+
+class _ReadConnection:
+    """A reading connection of one thread, closed as soon as the thread ends and drops it."""
+
+    def __init__(self, db_file: str):
+        # Only ever used by its thread, but closed from whichever thread calls Database.close()
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+
+    def close(self):
+        self.connection.close()
+
+    def __del__(self):
+        self.close()
+
+
+class LazyProvider:
+    """Stands in for a stored provider and constructs it on first use.
+
+    Name lookups are answered from the stored information, so commands that only need
+    the database (like cost limits answered by the cost ledger) never import a provider SDK.
+    """
+
+    def __init__(
+        self, account_name: str, connection_date: str, provider_info: str
+    ):
+        self._account_name = account_name
+        self._connection_date = connection_date
+        self._provider_info = provider_info
+        self._provider = None
+        # Concurrent refreshes share providers, they are constructed only once
+        self._load_lock = threading.Lock()
+
+    def get_account_name(self) -> str:
+        return self._account_name
+
+    def get_provider_name(self) -> str:
+        return re.split(r":", self._provider_info)[0]
+
+    def get_provider_info(self) -> str:
+        return self._provider_info
+
+    def load(self):
+        """Returns the real provider, constructing it if necessary."""
+        if self._provider is None:
+            with self._load_lock:
+                if self._provider is None:
+                    self._provider = Database.provider_from_info(
+                        self._account_name, self._connection_date, self._provider_info
+                    )
+        return self._provider
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
 
 
 # author: Luka Pacar
 class Database:
-    """Simulates a SQLite database and provides methods to interact with it."""
+    """Simulates a SQLite database and provides methods to interact with it.
+
+    With threaded=True all writes are funneled through a single writer thread which
+    batches them into transactions, while every thread reading gets its own connection.
+    This makes one Database object safe to share between the GUI and its worker threads.
+    """
 
     _no_provider = NoProvider("No-Provider", date.today())
 
@@ -19,38 +199,82 @@ class Database:
         db_file: str = os.path.expandvars(
             "$XDG_DATA_HOME/cloud_provider_db.sqlite"
         ),
+        threaded: bool = False,
     ):
         self.db_file = db_file
+        self.threaded = threaded
         self.connection = None
         self.cursor = None
+        self._writer = None
+        self._local = threading.local()
+        # Only the thread-local holds them, so they do not outlive their thread
+        self._read_connections = weakref.WeakSet()
+        self._read_connections_lock = threading.Lock()
+        self._last_rollup = 0
 
     # Database Starting-Methods
+    @spanned("db.init")
     def init(self):
         """Initialize the database by creating tables for Provider and VirtualMachine if not exist."""
         try:
-            self.connection = sqlite3.connect(self.db_file)
-            self.cursor = self.connection.cursor()
+            if self.threaded:
+                self._writer = _DatabaseWriter(self.db_file)
+                self._writer.start()
+            else:
+                self.connection = sqlite3.connect(self.db_file)
+                self.cursor = self.connection.cursor()
 
             self.create_table_provider()
             self.create_table_vm()
             self.create_table_zerotier_id()
+            self.create_table_vm_sample()
+            self.create_table_vm_ledger()
+            self.create_table_job()
         except sqlite3.Error as e:
             print(f"Error initializing database: {e}")
         except Exception as e:
             print(f"Unexpected error: {e}")
 
+    def _write(self, operation, wait=True):
+        """Executes operation(cursor) as a committed write.
+
+        In threaded mode the operation is handed to the writer thread. With wait=False the
+        Future is returned instead of blocking until the batch containing it is committed.
+        """
+        if not self.threaded:
+            result = operation(self.cursor)
+            self.connection.commit()
+            return result
+
+        future = self._writer.submit(operation)
+        return future.result() if wait else future
+
+    def _read_cursor(self):
+        """Returns a cursor on a connection owned by the calling thread."""
+        if not self.threaded:
+            return self.cursor
+
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = _ReadConnection(self.db_file)
+            self._local.connection = connection
+            with self._read_connections_lock:
+                self._read_connections.add(connection)
+        return connection.connection.cursor()
+
     # Provider
     def create_table_provider(self):
         """Creates the provider table if not exists, with account_name as PRIMARY KEY."""
         try:
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS provider (
-                    account_name TEXT PRIMARY KEY,
-                    connection_date TEXT NOT NULL,
-                    provider_info TEXT
-                );
-            """)
-            self.connection.commit()
+            self._write(
+                lambda cursor: cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS provider (
+                        account_name TEXT PRIMARY KEY,
+                        connection_date TEXT NOT NULL,
+                        provider_info TEXT
+                    );
+                """)
+            )
         except sqlite3.Error as e:
             print(f"Error creating provider table: {e}")
         except Exception as e:
@@ -59,18 +283,19 @@ class Database:
     def insert_provider(self, provider, print_output=True) -> None:
         """Inserts a provider object into the provider table."""
         try:
-            self.cursor.execute(
-                """
-                INSERT INTO provider (account_name, connection_date, provider_info)
-                VALUES (?, ?, ?);
-            """,
-                (
-                    provider.get_account_name(),
-                    provider.get_connection_date(),
-                    provider.get_provider_info(),
-                ),
+            self._write(
+                lambda cursor: cursor.execute(
+                    """
+                    INSERT INTO provider (account_name, connection_date, provider_info)
+                    VALUES (?, ?, ?);
+                """,
+                    (
+                        provider.get_account_name(),
+                        provider.get_connection_date(),
+                        provider.get_provider_info(),
+                    ),
+                )
             )
-            self.connection.commit()
             print(
                 f"Provider with account_name '{provider.get_account_name()}' inserted successfully."
             ) if print_output else None
@@ -91,29 +316,81 @@ class Database:
         """Deletes a provider from the provider table based on the account name."""
         try:
             # Execute the deletion query
-            self.cursor.execute(
+            self._write(
+                lambda cursor: cursor.execute(
+                    """
+                    DELETE FROM provider
+                    WHERE account_name = ?;
+                """,
+                    (provider.get_account_name(),),
+                )
+            )
+            print(
+                f"Provider with account_name '{provider.get_account_name()}' deleted successfully."
+            ) if print_output else None
+        except sqlite3.Error as e:
+            print(f"Error deleting provider from database: {e}")
+        except Exception as e:
+            print(f"Unexpected error while deleting provider: {e}")
+
+    def delete_provider_and_vms(self, provider, vms, print_output=True) -> None:
+        """Deletes a provider and its virtual machines, with their cost ledger, in one transaction."""
+
+        def delete(cursor):
+            self._delete_vm_rows(cursor, [vm.get_vm_name() for vm in vms])
+            cursor.execute(
                 """
                 DELETE FROM provider
                 WHERE account_name = ?;
             """,
                 (provider.get_account_name(),),
             )
-            self.connection.commit()  # Commit the transaction to the database
+
+        try:
+            self._write(delete)
             print(
-                f"Provider with account_name '{provider.get_account_name()}' deleted successfully."
+                f"Provider '{provider.get_account_name()}' and {len(vms)} virtual machines deleted successfully."
             ) if print_output else None
         except sqlite3.Error as e:
             print(f"Error deleting provider from database: {e}")
         except Exception as e:
             print(f"Unexpected error while deleting provider: {e}")
 
-    def read_provider(self):
-        """Reads and returns all provider information from the database."""
+    @staticmethod
+    def provider_from_info(
+        account_name: str, connection_date: str, provider_info: str
+    ):
+        """Constructs the provider object matching the stored provider information."""
+        # Provider SDKs are slow to import, only load them when constructing providers
+        from .aws_provider import AWS
         from .digitalocean_provider import DigitalOcean
 
+        parts = re.split(r":", provider_info)
+        provider_name = parts[0]
+        if provider_name == "No-Provider":
+            return NoProvider.from_provider_info(
+                account_name, connection_date, provider_info
+            )
+        elif provider_name == "DigitalOcean":
+            return DigitalOcean.from_provider_info(
+                account_name, connection_date, provider_info
+            )
+        elif provider_name == "AWS":
+            return AWS.from_provider_info(
+                account_name, connection_date, provider_info
+            )
+        return None
+
+    @spanned("db.read_provider")
+    def read_provider(self, lazy=False):
+        """Reads and returns all provider information from the database.
+
+        With lazy=True each provider is only constructed once it is actually used.
+        """
         try:
-            self.cursor.execute("SELECT * FROM provider")
-            rows = self.cursor.fetchall()
+            cursor = self._read_cursor()
+            cursor.execute("SELECT * FROM provider")
+            rows = cursor.fetchall()
             providers = []
             for row in rows:
                 provider = {
@@ -122,32 +399,13 @@ class Database:
                     "provider_info": row[2],
                 }
 
-                parts = re.split(r":", provider["provider_info"])
-                provider_name = parts[0]
-                if provider_name == "No-Provider":
-                    providers.append(
-                        NoProvider.from_provider_info(
-                            provider["account_name"],
-                            provider["connection_date"],
-                            provider["provider_info"],
-                        )
-                    )
-                elif provider_name == "DigitalOcean":
-                    providers.append(
-                        DigitalOcean.from_provider_info(
-                            provider["account_name"],
-                            provider["connection_date"],
-                            provider["provider_info"],
-                        )
-                    )
-                elif provider_name == "AWS":
-                    providers.append(
-                        AWS.from_provider_info(
-                            provider["account_name"],
-                            provider["connection_date"],
-                            provider["provider_info"],
-                        )
-                    )
+                if lazy:
+                    providers.append(LazyProvider(**provider))
+                    continue
+
+                provider = self.provider_from_info(**provider)
+                if provider is not None:
+                    providers.append(provider)
 
             return providers
         except sqlite3.Error as e:
@@ -162,21 +420,22 @@ class Database:
     def create_table_vm(self):
         """Creates the virtual machine table if not exists, with vm_name as PRIMARY KEY."""
         try:
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS virtual_machine (
-                    vm_name TEXT PRIMARY KEY,
-                    root_username TEXT,
-                    root_password TEXT,
-                    ssh_key TEXT,
-                    zerotier_network TEXT,
-                    provider_account_name TEXT,
-                    cost_limit INTEGER,
-                    public_ip TEXT,
-                    first_connection_date TEXT,
-                    FOREIGN KEY (provider_account_name) REFERENCES provider (account_name)
-                );
-            """)
-            self.connection.commit()
+            self._write(
+                lambda cursor: cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS virtual_machine (
+                        vm_name TEXT PRIMARY KEY,
+                        root_username TEXT,
+                        root_password TEXT,
+                        ssh_key TEXT,
+                        zerotier_network TEXT,
+                        provider_account_name TEXT,
+                        cost_limit INTEGER,
+                        public_ip TEXT,
+                        first_connection_date TEXT,
+                        FOREIGN KEY (provider_account_name) REFERENCES provider (account_name)
+                    );
+                """)
+            )
         except sqlite3.Error as e:
             print(f"Error creating virtual machine table: {e}")
         except Exception as e:
@@ -193,24 +452,25 @@ class Database:
     def insert_vm(self, vm, print_output=True) -> None:
         """Inserts a virtual machine object into the virtual machine table."""
         try:
-            self.cursor.execute(
-                """
-                INSERT INTO virtual_machine (vm_name,root_username,root_password,ssh_key,zerotier_network, provider_account_name, cost_limit, public_ip, first_connection_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
-            """,
-                (
-                    vm.get_vm_name(),
-                    vm.get_root_username(),
-                    vm.get_password(),
-                    vm.get_ssh_key(),
-                    vm.get_zerotier_network(),
-                    vm.get_provider().get_account_name(),
-                    vm.get_cost_limit(),
-                    str(vm.get_public_ip()),
-                    str(vm.get_first_connection_date()),
-                ),
+            self._write(
+                lambda cursor: cursor.execute(
+                    """
+                    INSERT INTO virtual_machine (vm_name,root_username,root_password,ssh_key,zerotier_network, provider_account_name, cost_limit, public_ip, first_connection_date)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+                """,
+                    (
+                        vm.get_vm_name(),
+                        vm.get_root_username(),
+                        vm.get_password(),
+                        vm.get_ssh_key(),
+                        vm.get_zerotier_network(),
+                        vm.get_provider().get_account_name(),
+                        vm.get_cost_limit(),
+                        str(vm.get_public_ip()),
+                        str(vm.get_first_connection_date()),
+                    ),
+                )
             )
-            self.connection.commit()
             print(
                 f"Virtual machine '{vm.get_vm_name()}' inserted successfully."
             ) if print_output else None
@@ -219,18 +479,20 @@ class Database:
         except Exception as e:
             print(f"Unexpected error while inserting VM: {e}")
 
+    @staticmethod
+    def _delete_vm_rows(cursor, vm_names) -> None:
+        """Deletes VMs together with their cost ledger, transitions and samples.
+
+        A VM created again under the same name starts without the old VM's cost.
+        """
+        rows = [(vm_name,) for vm_name in vm_names]
+        for table in ("virtual_machine", "vm_ledger", "vm_transition", "vm_sample"):
+            cursor.executemany(f"DELETE FROM {table} WHERE vm_name = ?;", rows)
+
     def delete_vm(self, vm, print_output=True) -> None:
-        """Deletes a virtual machine from the virtual machine table based on the VM name."""
+        """Deletes a virtual machine, its cost ledger and history based on the VM name."""
         try:
-            # Execute the deletion query
-            self.cursor.execute(
-                """
-                DELETE FROM virtual_machine
-                WHERE vm_name = ?;
-            """,
-                (vm.get_vm_name(),),
-            )
-            self.connection.commit()  # Commit the transaction to the database
+            self._write(lambda cursor: self._delete_vm_rows(cursor, [vm.get_vm_name()]))
             print(
                 f"Virtual machine '{vm.get_vm_name()}' deleted successfully."
             ) if print_output else None
@@ -239,11 +501,13 @@ class Database:
         except Exception as e:
             print(f"Unexpected error while deleting virtual machine: {e}")
 
+    @spanned("db.read_vm")
     def read_vm(self, available_provider_accounts):
         """Reads and returns all virtual machine information from the database."""
         try:
-            self.cursor.execute("SELECT * FROM virtual_machine")
-            rows = self.cursor.fetchall()
+            cursor = self._read_cursor()
+            cursor.execute("SELECT * FROM virtual_machine")
+            rows = cursor.fetchall()
             vms = []
             for row in rows:
                 vm = {
@@ -291,18 +555,592 @@ class Database:
             print(f"Unexpected error while reading VMs: {e}")
             raise
 
+    # VM History
+
+    # Raw samples are kept for 48 hours, hourly rollups for 90 days, daily rollups forever
+    SAMPLE_RAW = 0
+    SAMPLE_HOURLY = 3600
+    SAMPLE_DAILY = 86400
+    sample_retention = {SAMPLE_RAW: 48 * 3600, SAMPLE_HOURLY: 90 * 86400}
+    rollup_interval = 3600
+
+    def create_table_vm_sample(self):
+        """Creates the time-series table holding state and cost samples per virtual machine."""
+        try:
+            def create(cursor):
+                # The primary key doubles as the index for per-VM range scans
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS vm_sample (
+                        vm_name TEXT NOT NULL,
+                        resolution INTEGER NOT NULL,
+                        sampled_at INTEGER NOT NULL,
+                        state TEXT,
+                        hourly_rate REAL,
+                        accrued_cost REAL,
+                        PRIMARY KEY (vm_name, resolution, sampled_at)
+                    ) WITHOUT ROWID;
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS vm_sample_time
+                    ON vm_sample (sampled_at);
+                """)
+
+            self._write(create)
+        except sqlite3.Error as e:
+            print(f"Error creating VM sample table: {e}")
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+
+    def insert_vm_samples(self, samples, print_output=False) -> None:
+        """Inserts raw samples given as (vm_name, sampled_at, state, hourly_rate, accrued_cost) tuples.
+
+        The write is not waited for, and old samples are rolled up at most once per rollup_interval.
+        """
+        samples = [
+            (vm_name, self.SAMPLE_RAW, int(sampled_at), state, hourly_rate, cost)
+            for vm_name, sampled_at, state, hourly_rate, cost in samples
+        ]
+        try:
+            self._write(
+                lambda cursor: cursor.executemany(
+                    """
+                    INSERT OR REPLACE INTO vm_sample (vm_name, resolution, sampled_at, state, hourly_rate, accrued_cost)
+                    VALUES (?, ?, ?, ?, ?, ?);
+                """,
+                    samples,
+                ),
+                wait=False,
+            )
+            print(
+                f"Inserted {len(samples)} VM samples."
+            ) if print_output else None
+        except sqlite3.Error as e:
+            print(f"Error inserting VM samples into database: {e}")
+        except Exception as e:
+            print(f"Unexpected error while inserting VM samples: {e}")
+
+        if time.time() - self._last_rollup >= self.rollup_interval:
+            self.rollup_vm_samples(print_output=print_output)
+
+    def insert_vm_sample(
+        self, vm, state: str, hourly_rate: float, accrued_cost: float
+    ) -> None:
+        """Inserts a raw sample for a virtual machine taken right now."""
+        self.insert_vm_samples(
+            [(vm.get_vm_name(), time.time(), state, hourly_rate, accrued_cost)]
+        )
+
+    def rollup_vm_samples(self, now=None, print_output=False) -> None:
+        """Downsamples expired raw samples into hourly and expired hourly samples into daily buckets.
+
+        A bucket keeps the last sample taken inside it, which is exact for the accrued cost.
+        """
+        now = int(now if now is not None else time.time())
+        self._last_rollup = now
+
+        def rollup(cursor):
+            for source, target in (
+                (self.SAMPLE_RAW, self.SAMPLE_HOURLY),
+                (self.SAMPLE_HOURLY, self.SAMPLE_DAILY),
+            ):
+                # Only roll up buckets that can not receive any further samples
+                cutoff = (now - self.sample_retention[source]) // target * target
+                cursor.execute(
+                    """
+                    INSERT OR REPLACE INTO vm_sample (vm_name, resolution, sampled_at, state, hourly_rate, accrued_cost)
+                    SELECT vm_name, ?, sampled_at / ? * ?, state, hourly_rate, accrued_cost
+                    FROM (
+                        SELECT vm_name, MAX(sampled_at) AS sampled_at, state, hourly_rate, accrued_cost
+                        FROM vm_sample
+                        WHERE resolution = ? AND sampled_at < ?
+                        GROUP BY vm_name, sampled_at / ?
+                    );
+                """,
+                    (target, target, target, source, cutoff, target),
+                )
+                cursor.execute(
+                    """
+                    DELETE FROM vm_sample
+                    WHERE resolution = ? AND sampled_at < ?;
+                """,
+                    (source, cutoff),
+                )
+
+        try:
+            self._write(rollup, wait=False)
+            print("VM samples rolled up.") if print_output else None
+        except sqlite3.Error as e:
+            print(f"Error rolling up VM samples: {e}")
+        except Exception as e:
+            print(f"Unexpected error while rolling up VM samples: {e}")
+
+    def read_vm_samples(self, vm_name=None, start=0, end=None):
+        """Returns samples taken between start and end (unix timestamps), oldest first.
+
+        Without a vm_name, samples of all virtual machines are returned. Rolled up buckets
+        never overlap the finer samples they replaced, so all resolutions are merged.
+        """
+        end = int(end if end is not None else time.time())
+        try:
+            cursor = self._read_cursor()
+            if vm_name is None:
+                cursor.execute(
+                    """
+                    SELECT vm_name, resolution, sampled_at, state, hourly_rate, accrued_cost
+                    FROM vm_sample
+                    WHERE sampled_at BETWEEN ? AND ?
+                    ORDER BY sampled_at;
+                """,
+                    (int(start), end),
+                )
+            else:
+                cursor.execute(
+                    """
+                    SELECT vm_name, resolution, sampled_at, state, hourly_rate, accrued_cost
+                    FROM vm_sample
+                    WHERE vm_name = ? AND resolution IN (?, ?, ?)
+                      AND sampled_at BETWEEN ? AND ?
+                    ORDER BY sampled_at;
+                """,
+                    (
+                        vm_name,
+                        self.SAMPLE_RAW,
+                        self.SAMPLE_HOURLY,
+                        self.SAMPLE_DAILY,
+                        int(start),
+                        end,
+                    ),
+                )
+
+            return [
+                {
+                    "vm_name": row[0],
+                    "resolution": row[1],
+                    "sampled_at": row[2],
+                    "state": row[3],
+                    "hourly_rate": row[4],
+                    "accrued_cost": row[5],
+                }
+                for row in cursor.fetchall()
+            ]
+        except sqlite3.Error as e:
+            print(f"Error reading VM samples: {e}")
+            raise
+        except Exception as e:
+            print(f"Unexpected error while reading VM samples: {e}")
+            raise
+
+    # Cost Ledger
+
+    def create_table_vm_ledger(self):
+        """Creates the cost ledger: an append-only transition log and the accrued cost per VM."""
+        try:
+
+            def create(cursor):
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS vm_transition (
+                        vm_name TEXT NOT NULL,
+                        occurred_at INTEGER NOT NULL,
+                        state TEXT NOT NULL,
+                        hourly_rate REAL NOT NULL,
+                        source TEXT NOT NULL
+                    );
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS vm_transition_vm
+                    ON vm_transition (vm_name, occurred_at);
+                """)
+                # accrued_cost is the cost up to 'since', the time of the last transition
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS vm_ledger (
+                        vm_name TEXT PRIMARY KEY,
+                        state TEXT NOT NULL,
+                        hourly_rate REAL NOT NULL,
+                        billable INTEGER NOT NULL,
+                        since INTEGER NOT NULL,
+                        accrued_cost REAL NOT NULL
+                    );
+                """)
+
+            self._write(create)
+        except sqlite3.Error as e:
+            print(f"Error creating cost ledger tables: {e}")
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+
+    @staticmethod
+    def _accrued_cost(row, now: int) -> float:
+        """Computes the accrued cost of a ledger row (state, hourly_rate, billable, since, accrued_cost)."""
+        _, hourly_rate, billable, since, accrued_cost = row
+        if billable:
+            accrued_cost += max(now - since, 0) / 3600 * hourly_rate
+        return accrued_cost
+
+    @staticmethod
+    def _rate_is_known(hourly_rate) -> bool:
+        """Providers report 0 when they fail to look the rate up, so only positive rates are known."""
+        return hourly_rate is not None and hourly_rate > 0
+
+    def _apply_transition(
+        self, cursor, vm, state, hourly_rate, source, now, seed_cost=None
+    ) -> float:
+        """Moves a VM's ledger entry to a new state and returns its accrued cost."""
+        cursor.execute(
+            """
+            SELECT state, hourly_rate, billable, since, accrued_cost
+            FROM vm_ledger
+            WHERE vm_name = ?;
+        """,
+            (vm.get_vm_name(),),
+        )
+        row = cursor.fetchone()
+        if not self._rate_is_known(hourly_rate):
+            hourly_rate = None
+        if row is None:
+            accrued_cost = seed_cost or 0.0
+        else:
+            accrued_cost = self._accrued_cost(row, now)
+            if hourly_rate is None:
+                hourly_rate = row[1]
+        if hourly_rate is None or hourly_rate < 0:
+            hourly_rate = 0.0
+
+        billable = state in vm.get_provider().billable_states
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO vm_ledger (vm_name, state, hourly_rate, billable, since, accrued_cost)
+            VALUES (?, ?, ?, ?, ?, ?);
+        """,
+            (vm.get_vm_name(), state, hourly_rate, billable, now, accrued_cost),
+        )
+        cursor.execute(
+            """
+            INSERT INTO vm_transition (vm_name, occurred_at, state, hourly_rate, source)
+            VALUES (?, ?, ?, ?, ?);
+        """,
+            (vm.get_vm_name(), now, state, hourly_rate, source),
+        )
+        return accrued_cost
+
+    def record_vm_transition(
+        self, vm, state: str, hourly_rate=None, print_output=False
+    ) -> None:
+        """Records a state transition caused by CloudSurge itself (create, start, stop, delete).
+
+        Without an hourly_rate the last known rate of the VM is kept.
+        """
+        now = int(time.time())
+        try:
+            self._write(
+                lambda cursor: self._apply_transition(
+                    cursor, vm, state, hourly_rate, "action", now
+                ),
+                wait=False,
+            )
+            print(
+                f"Virtual machine '{vm.get_vm_name()}' is now {state}."
+            ) if print_output else None
+        except sqlite3.Error as e:
+            print(f"Error recording VM transition: {e}")
+        except Exception as e:
+            print(f"Unexpected error while recording VM transition: {e}")
+
+    def reconcile_vm_state(
+        self, vm, state: str, hourly_rate: float, provider_cost=None
+    ):
+        """Reconciles the ledger with a state observed at the provider and returns the accrued cost.
+
+        A transition is only recorded if the state or rate differs from the ledger. A rate of 0
+        or less is unknown and keeps the previous rate. VMs not in the ledger yet are seeded
+        with provider_cost, the cost the provider reports so far. Returns None if the state is
+        unknown.
+        """
+        if state == "unknown":
+            return None
+        now = int(time.time())
+
+        def reconcile(cursor):
+            cursor.execute(
+                """
+                SELECT state, hourly_rate, billable, since, accrued_cost
+                FROM vm_ledger
+                WHERE vm_name = ?;
+            """,
+                (vm.get_vm_name(),),
+            )
+            row = cursor.fetchone()
+            if row is not None and row[0] == state and (
+                not self._rate_is_known(hourly_rate) or row[1] == hourly_rate
+            ):
+                return self._accrued_cost(row, now)
+            return self._apply_transition(
+                cursor, vm, state, hourly_rate, "observed", now, provider_cost
+            )
+
+        try:
+            return self._write(reconcile)
+        except sqlite3.Error as e:
+            print(f"Error reconciling VM state: {e}")
+        except Exception as e:
+            print(f"Unexpected error while reconciling VM state: {e}")
+
+    def read_accrued_costs(self, now=None) -> dict:
+        """Returns the ledger of all VMs as {vm_name: {"state", "hourly_rate", "accrued_cost"}}."""
+        now = int(now if now is not None else time.time())
+        try:
+            cursor = self._read_cursor()
+            cursor.execute("""
+                SELECT vm_name, state, hourly_rate, billable, since, accrued_cost
+                FROM vm_ledger;
+            """)
+            return {
+                row[0]: {
+                    "state": row[1],
+                    "hourly_rate": row[2],
+                    "accrued_cost": self._accrued_cost(row[1:], now),
+                }
+                for row in cursor.fetchall()
+            }
+        except sqlite3.Error as e:
+            print(f"Error reading cost ledger: {e}")
+            raise
+        except Exception as e:
+            print(f"Unexpected error while reading cost ledger: {e}")
+            raise
+
+    # Jobs
+
+    def create_table_job(self):
+        """Creates the job queue and the append-only journal of the steps each job completed."""
+        try:
+
+            def create(cursor):
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS job (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        kind TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        created_at INTEGER NOT NULL,
+                        updated_at INTEGER NOT NULL,
+                        error TEXT
+                    );
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS job_status
+                    ON job (status);
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS job_journal (
+                        job_id INTEGER NOT NULL,
+                        logged_at INTEGER NOT NULL,
+                        step TEXT NOT NULL,
+                        data TEXT,
+                        FOREIGN KEY (job_id) REFERENCES job (id)
+                    );
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS job_journal_job
+                    ON job_journal (job_id);
+                """)
+
+            self._write(create)
+        except sqlite3.Error as e:
+            print(f"Error creating job tables: {e}")
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+
+    def insert_job(
+        self, kind: str, payload: dict, status="queued", print_output=False
+    ):
+        """Inserts a job and returns its id."""
+        now = int(time.time())
+        try:
+            job_id = self._write(
+                lambda cursor: cursor.execute(
+                    """
+                    INSERT INTO job (kind, payload, status, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?);
+                """,
+                    (kind, json.dumps(payload), status, now, now),
+                ).lastrowid
+            )
+            print(
+                f"Job {job_id} ({kind}) enqueued successfully."
+            ) if print_output else None
+            return job_id
+        except sqlite3.Error as e:
+            print(f"Error inserting job into database: {e}")
+            raise
+        except Exception as e:
+            print(f"Unexpected error while inserting job: {e}")
+            raise
+
+    def update_job_status(self, job_id: int, status: str, error=None) -> None:
+        """Sets the status (queued, running, done, failed, rolled_back) of a job."""
+        try:
+            self._write(
+                lambda cursor: cursor.execute(
+                    """
+                    UPDATE job
+                    SET status = ?, error = ?, updated_at = ?
+                    WHERE id = ?;
+                """,
+                    (status, error, int(time.time()), job_id),
+                )
+            )
+        except sqlite3.Error as e:
+            print(f"Error updating job status: {e}")
+        except Exception as e:
+            print(f"Unexpected error while updating job status: {e}")
+
+    def claim_job(self, job_id: int, from_status: str, to_status: str) -> bool:
+        """Moves a job from one status to another, returns False if it was no longer in from_status.
+
+        The check and the update are a single statement, so of several processes claiming
+        the same job only one succeeds.
+        """
+        try:
+            return (
+                self._write(
+                    lambda cursor: cursor.execute(
+                        """
+                        UPDATE job
+                        SET status = ?, updated_at = ?
+                        WHERE id = ? AND status = ?;
+                    """,
+                        (to_status, int(time.time()), job_id, from_status),
+                    ).rowcount
+                )
+                == 1
+            )
+        except sqlite3.Error as e:
+            print(f"Error claiming job: {e}")
+            raise
+        except Exception as e:
+            print(f"Unexpected error while claiming job: {e}")
+            raise
+
+    def append_job_journal(self, job_id: int, step: str, data=None) -> None:
+        """Appends a completed step to the journal of a job, returning once it is committed.
+
+        A step is only done once it is journaled, otherwise an interruption right after it
+        would leave it (e.g. a created instance) unknown to recovery.
+        """
+        try:
+            self._write(
+                lambda cursor: cursor.execute(
+                    """
+                    INSERT INTO job_journal (job_id, logged_at, step, data)
+                    VALUES (?, ?, ?, ?);
+                """,
+                    (job_id, int(time.time()), step, json.dumps(data)),
+                )
+            )
+        except sqlite3.Error as e:
+            print(f"Error appending to job journal: {e}")
+            raise
+        except Exception as e:
+            print(f"Unexpected error while appending to job journal: {e}")
+            raise
+
+    def read_jobs(self, statuses=("queued", "running")):
+        """Reads all jobs with one of the given statuses, oldest first."""
+        try:
+            cursor = self._read_cursor()
+            cursor.execute(
+                f"""
+                SELECT id, kind, payload, status, created_at, updated_at, error
+                FROM job
+                WHERE status IN ({", ".join("?" for _ in statuses)})
+                ORDER BY id;
+            """,
+                tuple(statuses),
+            )
+            return [
+                {
+                    "id": row[0],
+                    "kind": row[1],
+                    "payload": json.loads(row[2]),
+                    "status": row[3],
+                    "created_at": row[4],
+                    "updated_at": row[5],
+                    "error": row[6],
+                }
+                for row in cursor.fetchall()
+            ]
+        except sqlite3.Error as e:
+            print(f"Error reading jobs: {e}")
+            raise
+        except Exception as e:
+            print(f"Unexpected error while reading jobs: {e}")
+            raise
+
+    def read_job(self, job_id: int):
+        """Reads a single job like read_jobs(), None if it does not exist."""
+        try:
+            cursor = self._read_cursor()
+            cursor.execute(
+                """
+                SELECT id, kind, payload, status, created_at, updated_at, error
+                FROM job
+                WHERE id = ?;
+            """,
+                (job_id,),
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return {
+                "id": row[0],
+                "kind": row[1],
+                "payload": json.loads(row[2]),
+                "status": row[3],
+                "created_at": row[4],
+                "updated_at": row[5],
+                "error": row[6],
+            }
+        except sqlite3.Error as e:
+            print(f"Error reading job: {e}")
+            raise
+        except Exception as e:
+            print(f"Unexpected error while reading job: {e}")
+            raise
+
+    def read_job_journal(self, job_id: int):
+        """Reads the journal of a job as a list of (step, data) tuples in the order they were logged."""
+        try:
+            cursor = self._read_cursor()
+            cursor.execute(
+                """
+                SELECT step, data
+                FROM job_journal
+                WHERE job_id = ?
+                ORDER BY rowid;
+            """,
+                (job_id,),
+            )
+            return [(row[0], json.loads(row[1])) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error reading job journal: {e}")
+            raise
+        except Exception as e:
+            print(f"Unexpected error while reading job journal: {e}")
+            raise
+
     # ZeroTier ID Methods
 
     def create_table_zerotier_id(self):
         """Creates the ZeroTier ID table with one entry."""
         try:
-            self.cursor.execute("""
-                   CREATE TABLE IF NOT EXISTS zerotier_id (
-                       id INTEGER PRIMARY KEY AUTOINCREMENT,
-                       zerotier_id TEXT NOT NULL
-                   );
-               """)
-            self.connection.commit()
+            self._write(
+                lambda cursor: cursor.execute("""
+                       CREATE TABLE IF NOT EXISTS zerotier_id (
+                           id INTEGER PRIMARY KEY AUTOINCREMENT,
+                           zerotier_id TEXT NOT NULL
+                       );
+                   """)
+            )
         except sqlite3.Error as e:
             print(f"Error creating ZeroTier ID table: {e}")
         except Exception as e:
@@ -310,14 +1148,13 @@ class Database:
 
     def insert_zerotier_id(self, zerotier_id: str, print_output=True) -> None:
         """Inserts or updates the ZeroTier ID in the zerotier_id table."""
-        try:
-            # Check if there is already an entry in the table
-            self.cursor.execute("SELECT id FROM zerotier_id LIMIT 1")
-            result = self.cursor.fetchone()
 
-            if result:
+        def upsert(cursor) -> bool:
+            # Check if there is already an entry in the table
+            cursor.execute("SELECT id FROM zerotier_id LIMIT 1")
+            if cursor.fetchone():
                 # Update the existing ZeroTier ID
-                self.cursor.execute(
+                cursor.execute(
                     """
                     UPDATE zerotier_id
                     SET zerotier_id = ?
@@ -325,25 +1162,27 @@ class Database:
                     """,
                     (zerotier_id,),
                 )
-                if print_output:
-                    print(
-                        f"ZeroTier ID updated to '{zerotier_id}'"
-                    ) if print_output else None
-            else:
-                # Insert the new ZeroTier ID if the table is empty
-                self.cursor.execute(
-                    """
-                    INSERT INTO zerotier_id (zerotier_id)
-                    VALUES (?);
-                    """,
-                    (zerotier_id,),
-                )
-                if print_output:
-                    print(
-                        f"ZeroTier ID '{zerotier_id}' inserted successfully."
-                    ) if print_output else None
+                return True
 
-            self.connection.commit()
+            # Insert the new ZeroTier ID if the table is empty
+            cursor.execute(
+                """
+                INSERT INTO zerotier_id (zerotier_id)
+                VALUES (?);
+                """,
+                (zerotier_id,),
+            )
+            return False
+
+        try:
+            if self._write(upsert):
+                print(
+                    f"ZeroTier ID updated to '{zerotier_id}'"
+                ) if print_output else None
+            else:
+                print(
+                    f"ZeroTier ID '{zerotier_id}' inserted successfully."
+                ) if print_output else None
         except sqlite3.Error as e:
             print(f"Error inserting or updating ZeroTier ID: {e}")
         except Exception as e:
@@ -354,8 +1193,9 @@ class Database:
     def retrieve_zerotier_id(self):
         """Retrieves the ZeroTier ID from the database."""
         try:
-            self.cursor.execute("SELECT zerotier_id FROM zerotier_id LIMIT 1")
-            result = self.cursor.fetchone()
+            cursor = self._read_cursor()
+            cursor.execute("SELECT zerotier_id FROM zerotier_id LIMIT 1")
+            result = cursor.fetchone()
             if result:
                 return result[0]
             else:
@@ -383,6 +1223,14 @@ class Database:
 
     def close(self):
         """Closes the database connection and saves all changes."""
+        if self._writer:
+            self._writer.stop()
+            self._writer = None
+        with self._read_connections_lock:
+            for connection in list(self._read_connections):
+                connection.close()
+            self._read_connections.clear()
+        self._local = threading.local()
         if self.connection:
             self.connection.close()
 
@@ -1,23 +1,31 @@
 # author: Luka Pacar
 import time
+import uuid
 import digitalocean  # From python-digitalocean
 from datetime import date, datetime, timedelta, timezone
 
 from .db import Database
+from .metrics import timed_api_call, traced_session
+from .spans import logger
 from .vm import VirtualMachine, Provider
 
 
 class DigitalOcean(Provider):
     """DigitalOcean cloud provider implementation."""
 
+    # Powered off droplets are still billed
+    billable_states = ("pending", "running", "stopping", "stopped")
+
     def __init__(self, account_name: str, connection_date: date, token: str):
         super().__init__(account_name, connection_date)
         self.provider_info_string = (
             self.get_provider_name() + self.starting_character + f"{token}"
         )
         self.token = token
+        # All droplet objects share this session, so their requests are traced
+        self.session = traced_session(self.get_provider_name())
         self.client = digitalocean.Manager(
-            token=self.token
+            token=self.token, _session=self.session
         )  # Initialize the PyDo Client with the token
         self.provider_info_string = (
             self.get_provider_name() + self.starting_character + f"{self.token}"
@@ -39,6 +47,7 @@ class DigitalOcean(Provider):
         """Returns information about the provider (token)."""
         return self.provider_info_string
 
+    @timed_api_call
     def connection_is_alive(self, print_output=True) -> bool:
         """Verifies if the DigitalOcean authentication works."""
         try:
@@ -59,6 +68,7 @@ class DigitalOcean(Provider):
             print(f"Authentication failed: {e}") if print_output else None
             return False
 
+    @timed_api_call
     def create_vm(
         self,
         vm_name: str,
@@ -73,6 +83,7 @@ class DigitalOcean(Provider):
         max_retries: int = 10,  # Maximum retries for load
         retry_interval: int = 10,  # Time in seconds between each retry
         print_output=True,
+        checkpoint=None,
     ):
         """Creates a Droplet (VM) on DigitalOcean.
 
@@ -89,6 +100,7 @@ class DigitalOcean(Provider):
             max_retries (int): Maximum retries for load (until the VM gets an IP).
             retry_interval (int): Time in seconds between each Public-IP-Test-Retry.
             print_output (bool): Print outputs with useful info.
+            checkpoint (callable): Called with ("instance_created", {"instance_id": ...}) as soon as the droplet exists.
         """
         try:
             req = {
@@ -101,6 +113,7 @@ class DigitalOcean(Provider):
                 "backups": False,
                 "ipv6": False,
                 "monitoring": False,
+                "_session": self.session,
             }
 
             if not self.token:
@@ -117,6 +130,8 @@ class DigitalOcean(Provider):
             print(
                 f"\033[32mVM '{vm_name}' has been created.\033[0m"
             ) if print_output else None
+            if checkpoint:
+                checkpoint("instance_created", {"instance_id": droplet.id})
             # Retry mechanism to wait until the droplet is fully created and has an IP address
             retries = 0
             while retries < max_retries:
@@ -131,9 +146,7 @@ class DigitalOcean(Provider):
                         ) if print_output else None
                         break
                     else:
-                        print(
-                            "\033[33mVM IP not available yet...\033[0m"
-                        ) if print_output else None
+                        logger.debug(f"IP of droplet '{vm_name}' not available yet")
                 except Exception as e:
                     print(f"\033[31mError loading droplet: {e}\033[0m")
 
@@ -163,7 +176,8 @@ class DigitalOcean(Provider):
         except Exception as e:  # General exception to catch all errors
             raise ValueError(f"Failed to create VM '{vm_name}': {e}")
 
-    def stop_vm(self, vm: VirtualMachine, print_output=True):
+    @timed_api_call
+    def stop_vm(self, vm: VirtualMachine, db=None, print_output=True):
         """Stops (powers off) a VM on DigitalOcean."""
         try:
             droplet = self._get_droplet(vm)
@@ -171,10 +185,13 @@ class DigitalOcean(Provider):
             print(
                 f"VM '{vm.get_vm_name()}' has been powered off."
             ) if print_output else None
+            if db:
+                db.record_vm_transition(vm, "stopped")
         except Exception as e:
             print(f"Failed to stop VM '{vm.get_vm_name()}': {e}")
 
-    def start_vm(self, vm: VirtualMachine, print_output=True):
+    @timed_api_call
+    def start_vm(self, vm: VirtualMachine, db=None, print_output=True):
         """Starts (powers on) a VM on DigitalOcean."""
         try:
             droplet = self._get_droplet(vm)
@@ -182,10 +199,15 @@ class DigitalOcean(Provider):
             print(
                 f"VM '{vm.get_vm_name()}' has been powered on."
             ) if print_output else None
+            if db:
+                db.record_vm_transition(vm, "running")
         except Exception as e:
             print(f"Failed to start VM '{vm.get_vm_name()}': {e}")
 
-    def delete_vm(self, vm: VirtualMachine, db: Database, print_output=True):
+    @timed_api_call
+    def delete_vm(
+        self, vm: VirtualMachine, db: Database = None, print_output=True
+    ):
         """Deletes a VM on DigitalOcean."""
         try:
             droplet = self._get_droplet(vm)
@@ -194,10 +216,25 @@ class DigitalOcean(Provider):
                 f"VM '{vm.get_vm_name()}' has been deleted."
             ) if print_output else None
             if db:
+                db.record_vm_transition(vm, "deleted")
                 db.delete_vm(vm)
         except Exception as e:
             print(f"Failed to delete VM '{vm.get_vm_name()}': {e}")
 
+    @timed_api_call
+    def delete_instance(self, instance_id: int, print_output=True):
+        """Destroys a droplet by its ID, e.g. one left behind by an interrupted creation."""
+        try:
+            digitalocean.Droplet(
+                token=self.token, id=instance_id, _session=self.session
+            ).destroy()
+            print(
+                f"Droplet '{instance_id}' has been deleted."
+            ) if print_output else None
+        except Exception as e:
+            raise ValueError(f"Failed to delete droplet '{instance_id}': {e}")
+
+    @timed_api_call
     def get_vm_hourly_rate(
         self, vm: VirtualMachine, print_output=True
     ) -> float:
@@ -236,6 +273,7 @@ class DigitalOcean(Provider):
             )
             return 0.0
 
+    @timed_api_call
     def get_vm_uptime(self, vm: VirtualMachine, print_output=True) -> timedelta:
         """
         Retrieves the total uptime of the specified VM (Droplet).
@@ -271,6 +309,7 @@ class DigitalOcean(Provider):
             print(f"Failed to retrieve uptime for VM '{vm.get_vm_name()}': {e}")
             return timedelta(0)
 
+    @timed_api_call
     def get_vm_cost(self, vm: VirtualMachine, print_output=True) -> float:
         """
         Retrieves the total cost incurred by the specified VM (Droplet).
@@ -302,6 +341,28 @@ class DigitalOcean(Provider):
             print(f"Failed to retrieve cost for VM '{vm.get_vm_name()}': {e}")
             return 0.0
 
+    droplet_status_to_vm_state = {
+        "new": "pending",
+        "active": "running",
+        "off": "stopped",
+        "archive": "deleted",
+    }
+
+    @timed_api_call
+    def get_vm_state(self, vm: VirtualMachine, print_output=True) -> str:
+        """Returns the state of the droplet (one of Provider.vm_states)."""
+        try:
+            droplet = self._get_droplet(vm)
+            return self.droplet_status_to_vm_state.get(droplet.status, "unknown")
+        except ValueError:
+            return "deleted"
+        except Exception as e:
+            print(
+                f"Error while getting the state of VM '{vm.get_vm_name()}': {e}"
+            ) if print_output else None
+            return "unknown"
+
+    @timed_api_call
     def is_active(self, vm: VirtualMachine) -> bool:
         """Checks if the VM (droplet) is currently active (powered on)."""
         try:
@@ -318,10 +379,100 @@ class DigitalOcean(Provider):
             )
             return False
 
+    @timed_api_call
+    def get_vm_states(self, vms, print_output=True) -> dict:
+        """Returns the states of several VMs by name from a single droplet listing."""
+        names = [vm.get_vm_name() for vm in vms]
+        try:
+            droplets = {droplet.name: droplet for droplet in self.client.get_all_droplets()}
+        except Exception as e:
+            print(f"Error while getting the state of VMs: {e}") if print_output else None
+            return {name: "unknown" for name in names}
+        return {
+            name: self.droplet_status_to_vm_state.get(droplets[name].status, "unknown")
+            if name in droplets
+            else "deleted"
+            for name in names
+        }
+
+    def _act_on_droplets(self, vms, action_type: str = None, print_output=True) -> list:
+        """Runs a droplet action on the droplets of several VMs through a temporary tag.
+
+        The droplets are tagged in one request, then a single request acts on the tag. Without
+        action_type the tagged droplets are destroyed. Returns the VMs that had a droplet,
+        raises ValueError if the action failed.
+        """
+        droplets = {droplet.name: droplet for droplet in self.client.get_all_droplets()}
+        found = [vm for vm in vms if vm.get_vm_name() in droplets]
+        for vm in vms:
+            if vm not in found:
+                print(
+                    f"Droplet '{vm.get_vm_name()}' not found."
+                ) if print_output else None
+        if not found:
+            return found
+
+        tag = digitalocean.Tag(
+            token=self.token,
+            name=f"cloudsurge-bulk-{uuid.uuid4().hex[:12]}",
+            _session=self.session,
+        )
+        try:
+            tag.create()
+            tag.add_droplets([droplets[vm.get_vm_name()].id for vm in found])
+            if action_type is None:
+                self.client.get_data(
+                    f"droplets?tag_name={tag.name}", type=digitalocean.baseapi.DELETE
+                )
+            else:
+                self.client.get_data(
+                    f"droplets/actions?tag_name={tag.name}",
+                    type=digitalocean.baseapi.POST,
+                    params={"type": action_type},
+                )
+        except Exception as e:
+            raise ValueError(f"Failed to run {action_type or 'destroy'} on {len(found)} droplets: {e}")
+        finally:
+            try:
+                tag.delete()
+            except Exception:
+                pass
+        return found
+
+    @timed_api_call
+    def stop_vms(self, vms, db=None, print_output=True):
+        """Powers off several droplets with a single tag action."""
+        for vm in self._act_on_droplets(vms, "power_off", print_output):
+            print(
+                f"VM '{vm.get_vm_name()}' has been powered off."
+            ) if print_output else None
+            if db:
+                db.record_vm_transition(vm, "stopped")
+
+    @timed_api_call
+    def start_vms(self, vms, db=None, print_output=True):
+        """Powers on several droplets with a single tag action."""
+        for vm in self._act_on_droplets(vms, "power_on", print_output):
+            print(
+                f"VM '{vm.get_vm_name()}' has been powered on."
+            ) if print_output else None
+            if db:
+                db.record_vm_transition(vm, "running")
+
+    @timed_api_call
+    def delete_vms(self, vms, db: Database = None, print_output=True):
+        """Destroys several droplets with a single request on a tag."""
+        for vm in self._act_on_droplets(vms, None, print_output):
+            print(f"VM '{vm.get_vm_name()}' has been deleted.") if print_output else None
+            if db:
+                db.record_vm_transition(vm, "deleted")
+                db.delete_vm(vm)
+
     def _get_droplet(self, vm: VirtualMachine):
         """Finds and returns the droplet information."""
         droplets = self.client.get_all_droplets()
         for droplet in droplets:
             if droplet.name == vm.get_vm_name():
+                droplet._session = self.session
                 return droplet
         raise ValueError(f"Droplet '{vm.get_vm_name()}' not found.")
@@ -0,0 +1,201 @@
+# author: Luka Pacar
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .db import Database
+from .reached_cost_limits import reached_cost_limit
+from .server_is_active import is_reachable
+from .spans import spanned
+
+
+# VMs refreshed at once, most of the time is spent waiting for the providers' APIs
+refresh_workers = 8
+
+
+class ProviderCache:
+    """Keeps provider clients across reads of the database, as long as a provider does not change."""
+
+    def __init__(self):
+        # Providers by (account name, provider info)
+        self._providers = {}
+
+    def read(self, db: Database):
+        """Reads the providers, reusing the clients of providers that did not change."""
+        providers = {}
+        for provider in db.read_provider(lazy=True):
+            key = (provider.get_account_name(), provider.get_provider_info())
+            providers[key] = self._providers.get(key, provider)
+        self._providers = providers
+        return list(providers.values())
+
+
+def refresh_vm_cost(db: Database, vm, accrued_costs: dict, hourly_rates=None):
+    """Reconciles the cost ledger with the provider's view of a single VM.
+
+    Args:
+        db (Database): Database holding the cost ledger.
+        vm (VirtualMachine): Virtual machine to refresh.
+        accrued_costs (dict): Ledger entries as returned by Database.read_accrued_costs(), only read.
+        hourly_rates (dict): Optional cache of hourly rates by VM name, see refresh_costs().
+
+    Returns:
+        dict: The new ledger entry of the VM, or None if its provider does not bill it.
+    """
+    provider = vm.get_provider()
+    if provider.get_provider_name() not in ("AWS", "DigitalOcean"):
+        return None
+
+    vm_state = provider.get_vm_state(vm)
+    previous = accrued_costs.get(vm.get_vm_name())
+    if (
+        hourly_rates is not None
+        and vm.get_vm_name() in hourly_rates
+        and previous is not None
+        and previous["state"] == vm_state
+    ):
+        vm_hourly_rate = hourly_rates[vm.get_vm_name()]
+    else:
+        vm_hourly_rate = provider.get_vm_hourly_rate(vm)
+    if not vm_hourly_rate or vm_hourly_rate < 0:
+        # The lookup failed, the ledger keeps the last known rate and it is asked again next time
+        vm_hourly_rate = previous["hourly_rate"] if previous is not None else None
+    elif hourly_rates is not None:
+        hourly_rates[vm.get_vm_name()] = vm_hourly_rate
+    # The provider's own estimate is only needed to seed VMs the ledger does not know yet
+    provider_cost = None
+    if previous is None:
+        provider_cost = provider.get_vm_cost(vm)
+
+    vm_cost = db.reconcile_vm_state(vm, vm_state, vm_hourly_rate, provider_cost)
+    if vm_cost is None:
+        return None
+    return {"state": vm_state, "hourly_rate": vm_hourly_rate, "accrued_cost": vm_cost}
+
+
+@spanned("cost.refresh")
+def refresh_costs(
+    db: Database,
+    vms,
+    accrued_costs: dict,
+    hourly_rates=None,
+    on_result=None,
+    cancelled=None,
+    workers=None,
+) -> dict:
+    """Reconciles the cost ledger with the providers' view of every VM and records a sample.
+
+    With a threaded database the VMs are refreshed concurrently, so a refresh takes about as
+    long as its slowest VM instead of the sum of all of them.
+
+    Args:
+        db (Database): Database holding the cost ledger.
+        vms (list): Virtual machines to refresh.
+        accrued_costs (dict): Ledger entries as returned by Database.read_accrued_costs(), updated in place.
+        hourly_rates (dict): Optional cache of hourly rates by VM name, kept across refreshes. A cached
+            rate is only fetched again once the state of its VM changes.
+        on_result (callable): Called with (vm, entry) in the calling thread as every VM is refreshed,
+            after accrued_costs was updated.
+        cancelled (threading.Event): Stops the refresh once set, VMs not refreshed yet are skipped.
+        workers (int): Number of VMs refreshed at once. Defaults to refresh_workers for a threaded
+            database and 1 otherwise, as a plain sqlite connection can not be shared between threads.
+
+    Returns:
+        dict: The updated accrued_costs.
+    """
+    if workers is None:
+        workers = refresh_workers if db.threaded else 1
+
+    # Workers only read the ledger as it was, the results are merged in this thread
+    previous = dict(accrued_costs)
+    samples = []
+
+    def merge(vm, entry):
+        if entry is None:
+            return
+        accrued_costs[vm.get_vm_name()] = entry
+        samples.append(
+            (
+                vm.get_vm_name(),
+                time.time(),
+                entry["state"],
+                entry["hourly_rate"],
+                entry["accrued_cost"],
+            )
+        )
+        on_result(vm, entry) if on_result else None
+
+    if workers <= 1:
+        for vm in vms:
+            if cancelled is not None and cancelled.is_set():
+                break
+            merge(vm, refresh_vm_cost(db, vm, previous, hourly_rates))
+    else:
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="cost-refresh"
+        ) as executor:
+            # Every task runs in a copy of this context, so its spans and traced API
+            # calls are attributed to this refresh
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run,
+                    refresh_vm_cost,
+                    db,
+                    vm,
+                    previous,
+                    hourly_rates,
+                ): vm
+                for vm in vms
+            }
+            for future in as_completed(futures):
+                if cancelled is not None and cancelled.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                merge(futures[future], future.result())
+
+    db.insert_vm_samples(samples)
+    return accrued_costs
+
+
+def vm_record(vm, accrued_costs: dict, online: bool) -> dict:
+    """Returns the JSON serializable status of a VM, as served by the daemon."""
+    entry = accrued_costs.get(vm.get_vm_name(), {})
+    try:
+        val = reached_cost_limit(vm, accrued_costs)
+    except Exception:
+        val = None
+    return {
+        "account": vm.get_provider().get_account_name(),
+        "provider": vm.get_provider().get_provider_name(),
+        "vm_name": vm.get_vm_name(),
+        "public_ip": str(vm.get_public_ip()),
+        "cost_limit": vm.get_cost_limit(),
+        "state": entry.get("state"),
+        "hourly_rate": entry.get("hourly_rate"),
+        "accrued_cost": entry.get("accrued_cost"),
+        "exceeded_by": val if val is not None and val > 0 else None,
+        "online": online,
+        "time_to_limit": time_to_limit(vm, entry),
+    }
+
+
+def time_to_limit(vm, entry: dict):
+    """Returns the hours until a VM reaches its cost limit at its current rate.
+
+    Returns 0 if the limit is already reached and None if the VM does not accrue cost.
+    """
+    if entry.get("state") is None or entry.get("accrued_cost") is None:
+        return None
+    if entry["accrued_cost"] >= vm.get_cost_limit():
+        return 0
+    # The state is only known once the provider was asked, so this never constructs a provider
+    if entry["state"] not in vm.get_provider().billable_states or not entry["hourly_rate"]:
+        return None
+    return (vm.get_cost_limit() - entry["accrued_cost"]) / entry["hourly_rate"]
+
+
+@spanned("fleet.probe")
+def probe_fleet(db: Database, vms, accrued_costs: dict) -> list:
+    """Checks the reachability of every VM and returns their vm_record()s."""
+    return [vm_record(vm, accrued_costs, bool(is_reachable(vm))) for vm in vms]
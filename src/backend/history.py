@@ -0,0 +1,197 @@
+# author: Luka Pacar
+import heapq
+import time
+from datetime import datetime
+
+from .db import Database
+from .spans import spanned
+
+# Points a series is cut down to before it is handed to the GUI, which thins it out to its width
+max_series_points = 2048
+
+
+def lttb(points, threshold: int) -> list:
+    """Downsamples (x, y) points sorted by x with Largest-Triangle-Three-Buckets.
+
+    The first and last point are kept. In between, every bucket keeps the point spanning
+    the largest triangle with the point kept before and the average of the next bucket,
+    which preserves peaks and the overall shape far better than taking every n-th point.
+
+    Args:
+        points (list): (x, y) tuples sorted by x.
+        threshold (int): Most points returned.
+
+    Returns:
+        list: At most threshold of the points, in order.
+    """
+    points = list(points)
+    if threshold >= len(points):
+        return points
+    if threshold < 3:
+        return [points[0], points[-1]]
+
+    sampled = [points[0]]
+    # The points between the first and the last are split into threshold - 2 buckets
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        next_start = end
+        next_end = min(int((i + 2) * bucket_size) + 1, len(points))
+        next_bucket = points[next_start:next_end] or points[-1:]
+        avg_x = sum(p[0] for p in next_bucket) / len(next_bucket)
+        avg_y = sum(p[1] for p in next_bucket) / len(next_bucket)
+
+        ax, ay = points[a]
+        best, best_area = start, -1
+        for j in range(start, end):
+            x, y = points[j]
+            # Twice the triangle's area, the factor does not change the maximum
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def cost_series(samples) -> dict:
+    """Returns the accrued cost over time by VM name, as (sampled_at, accrued_cost) points.
+
+    Args:
+        samples (list): Samples as returned by Database.read_vm_samples(), oldest first.
+    """
+    series = {}
+    for sample in samples:
+        if sample["accrued_cost"] is not None:
+            series.setdefault(sample["vm_name"], []).append(
+                (sample["sampled_at"], sample["accrued_cost"])
+            )
+    return series
+
+
+def sum_series(series) -> list:
+    """Adds up cost series sampled at different times.
+
+    Between its samples every series keeps its last value, so the total changes at every
+    sample of any series.
+    """
+    def tagged(i, points):
+        return ((x, i, y) for x, y in points)
+
+    latest = {}
+    total = 0.0
+    points = []
+    for x, i, y in heapq.merge(*(tagged(i, s) for i, s in enumerate(series))):
+        total += y - latest.get(i, 0.0)
+        latest[i] = y
+        if points and points[-1][0] == x:
+            points[-1] = (x, total)
+        else:
+            points.append((x, total))
+    return points
+
+
+def value_at(points, x: float) -> float:
+    """Returns the last value of a series at or before x, 0 if it starts later."""
+    value = 0.0
+    for px, py in points:
+        if px > x:
+            break
+        value = py
+    return value
+
+
+def month_start(now: float) -> float:
+    """Returns the unix timestamp the month of now started at, in local time."""
+    return datetime.fromtimestamp(now).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    ).timestamp()
+
+
+def month_end(now: float) -> float:
+    """Returns the unix timestamp the month of now ends at, in local time."""
+    start = datetime.fromtimestamp(month_start(now))
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1).timestamp()
+    return start.replace(month=start.month + 1).timestamp()
+
+
+def project_month_end(points, hourly_rate: float, now: float = None) -> float:
+    """Projects the cost of the current month, the cost so far plus the rest at hourly_rate.
+
+    Args:
+        points (list): The accrued cost over time, see cost_series().
+        hourly_rate (float): The rate currently billed.
+    """
+    now = now if now is not None else time.time()
+    so_far = value_at(points, now) - value_at(points, month_start(now))
+    return max(so_far, 0.0) + hourly_rate * max(month_end(now) - now, 0) / 3600
+
+
+@spanned("history.read")
+def read_cost_history(db: Database, vms, start: float, now: float = None) -> dict:
+    """Reads the cost history of vms since start, for the charts of the cost page.
+
+    The series begin at the month start at the latest, so the month-end projections are
+    exact even for shorter ranges, and are cut down to max_series_points.
+
+    Returns:
+        dict: {"vms": {vm_name: points}, "providers": {provider name: points},
+            "projected": {provider name: month-end cost}, "projected_vms": {vm_name: month-end cost},
+            "start": start, "now": now}
+    """
+    vms = list(vms)
+    now = now if now is not None else time.time()
+    samples = db.read_vm_samples(
+        # A single VM is read with its own index range
+        vm_name=vms[0].get_vm_name() if len(vms) == 1 else None,
+        start=min(start, month_start(now)),
+        end=now,
+    )
+    accrued_costs = db.read_accrued_costs(now)
+
+    series = cost_series(samples)
+    by_provider = {}
+    rates = {}
+    projected = {}
+    for vm in vms:
+        provider_name = vm.get_provider().get_provider_name()
+        points = series.get(vm.get_vm_name(), [])
+        entry = accrued_costs.get(vm.get_vm_name())
+        rate = 0.0
+        if entry is not None:
+            # The ledger is always newer than the last sample
+            points.append((now, entry["accrued_cost"]))
+            if entry["state"] in vm.get_provider().billable_states:
+                rate = entry["hourly_rate"] or 0.0
+        rates[provider_name] = rates.get(provider_name, 0.0) + rate
+        projected[vm.get_vm_name()] = project_month_end(points, rate, now)
+        series[vm.get_vm_name()] = points
+        by_provider.setdefault(provider_name, []).append(points)
+
+    providers = {name: sum_series(group) for name, group in by_provider.items()}
+    return {
+        "vms": {
+            vm.get_vm_name(): lttb(
+                [p for p in series[vm.get_vm_name()] if p[0] >= start],
+                max_series_points,
+            )
+            for vm in vms
+        },
+        "providers": {
+            name: lttb([p for p in points if p[0] >= start], max_series_points)
+            for name, points in providers.items()
+        },
+        "projected": {
+            name: project_month_end(points, rates[name], now)
+            for name, points in providers.items()
+        },
+        "projected_vms": projected,
+        "start": start,
+        "now": now,
+    }
@@ -0,0 +1,346 @@
+# author: Luka Pacar
+import fcntl
+import os
+import time
+from time import sleep
+
+from .db import Database
+from .lifecycle import perform_bulk_action
+from .spans import span, spanned
+from .vm import VirtualMachine
+
+
+class Job:
+    """A persisted job together with the steps it already completed.
+
+    Args:
+        on_progress (callable): Called with (job, message, done, total) as the job progresses,
+            from the thread running it.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        job_id: int,
+        kind: str,
+        payload: dict,
+        journal=(),
+        on_progress=None,
+    ):
+        self.db = db
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.steps = dict(journal)
+        self.on_progress = on_progress
+
+    def report(self, message: str, done: int = 0, total: int = 0):
+        """Reports the progress of the job to its on_progress callback, if any."""
+        self.on_progress(self, message, done, total) if self.on_progress else None
+
+    def checkpoint(self, step: str, data=None):
+        """Journals a completed step so an interrupted job can continue after it."""
+        self.steps[step] = data
+        self.db.append_job_journal(self.id, step, data)
+
+    def __str__(self):
+        return f"Job {self.id} ({self.kind})"
+
+
+class JobQueue:
+    """Runs long operations as persisted jobs so an interruption can be resumed or rolled back.
+
+    Every job that is being run holds a lock file, which the operating system releases
+    when the process dies. A running job without a held lock was therefore interrupted.
+    Queued jobs are claimed with a conditional update of their status, so every job runs
+    in one process only, however the lock files are taken.
+    """
+
+    # Jobs younger than this are never treated as interrupted, they might not have locked yet
+    recovery_grace_period = 60
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.lock_dir = os.path.join(
+            os.path.dirname(os.path.abspath(db.db_file)), "cloudsurge-jobs"
+        )
+        self._runners = {
+            "create_vm": self._run_create_vm,
+            "provision_vm": self._run_provision_vm,
+            "delete_provider": self._run_delete_provider,
+        }
+
+    def enqueue(self, kind: str, payload: dict) -> int:
+        """Enqueues a job to be run by drain(), possibly in another process."""
+        return self.db.insert_job(kind, payload)
+
+    def submit(self, kind: str, payload: dict, on_progress=None):
+        """Persists a job and runs it right away in the calling thread, returning its result.
+
+        on_progress is called as the job progresses, see Job.
+        """
+        job_id = self.db.insert_job(kind, payload, status="running")
+        job = Job(self.db, job_id, kind, payload, on_progress=on_progress)
+        lock = self._acquire(job_id)
+        return self._run(job, lock)
+
+    def drain(self):
+        """Runs all queued jobs and returns (job, result) pairs of the successful ones."""
+        results = []
+        for record in self.db.read_jobs(("queued",)):
+            lock = self._acquire(record["id"])
+            if lock is None:
+                # Another process is already running it
+                continue
+            if not self.db.claim_job(record["id"], "queued", "running"):
+                # Another process ran it between reading and locking
+                self._release(lock)
+                continue
+            # The journal is only read once the job is ours
+            job = self._job(record)
+            try:
+                results.append((job, self._run(job, lock)))
+            except Exception as e:
+                print(f"{job} failed: {e}")
+        return results
+
+    def recover(self, print_output=True):
+        """Queues interrupted jobs that can be resumed and rolls back the others."""
+        for record in self.db.read_jobs(("running",)):
+            if time.time() - record["updated_at"] < self.recovery_grace_period:
+                continue
+            lock = self._acquire(record["id"])
+            if lock is None:
+                continue
+            # It may have been finished or recovered by another process since it was read
+            record = self.db.read_job(record["id"])
+            if (
+                record is None
+                or record["status"] != "running"
+                or time.time() - record["updated_at"] < self.recovery_grace_period
+            ):
+                self._release(lock)
+                continue
+            job = self._job(record)
+            try:
+                if self._resumable(job):
+                    if self.db.claim_job(job.id, "running", "queued"):
+                        print(f"{job} will be resumed.") if print_output else None
+                else:
+                    self._rollback(job)
+                    self.db.update_job_status(
+                        job.id, "rolled_back", "interrupted"
+                    )
+                    print(f"{job} was rolled back.") if print_output else None
+            except Exception as e:
+                self.db.update_job_status(job.id, "failed", str(e))
+                print(f"Could not recover {job}: {e}")
+            finally:
+                self._release(lock)
+
+    def _job(self, record) -> Job:
+        return Job(
+            self.db,
+            record["id"],
+            record["kind"],
+            record["payload"],
+            self.db.read_job_journal(record["id"]),
+        )
+
+    def _acquire(self, job_id: int):
+        """Locks a job for this process, returns None if another process holds the lock."""
+        os.makedirs(self.lock_dir, exist_ok=True)
+        lock = os.open(
+            os.path.join(self.lock_dir, f"{job_id}.lock"),
+            os.O_RDWR | os.O_CREAT,
+        )
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock)
+            return None
+        return lock
+
+    def _release(self, lock):
+        # The lock file is kept: removing it while locked would let another process lock a new
+        # file of the same name while this one still holds the old one
+        os.close(lock)
+
+    def _run(self, job: Job, lock):
+        try:
+            self.db.update_job_status(job.id, "running")
+            try:
+                with span(f"job.{job.kind}", job=job.id):
+                    result = self._runners[job.kind](job)
+            except Exception as e:
+                try:
+                    self._rollback(job)
+                    self.db.update_job_status(job.id, "rolled_back", str(e))
+                except Exception as rollback_error:
+                    self.db.update_job_status(
+                        job.id, "failed", f"{e} (rollback: {rollback_error})"
+                    )
+                raise
+            self.db.update_job_status(job.id, "done")
+            return result
+        finally:
+            self._release(lock)
+
+    def _resumable(self, job: Job) -> bool:
+        if job.kind == "create_vm":
+            # Without a reachable VM there is nothing worth continuing
+            return "vm_ready" in job.steps
+        return True
+
+    def _rollback(self, job: Job):
+        """Undoes the completed steps of a job that can not be finished."""
+        if job.kind != "create_vm" or "inserted" in job.steps:
+            return
+        if "instance_created" not in job.steps:
+            return
+
+        provider = self._provider(job.payload["provider"])
+        provider.delete_instance(job.steps["instance_created"]["instance_id"])
+        if "vm_ready" in job.steps:
+            vm = vm_from_record(job.steps["vm_ready"], provider)
+            self.db.record_vm_transition(vm, "deleted")
+
+    def _provider(self, account_name: str):
+        for provider in self.db.read_provider():
+            if provider.get_account_name() == account_name:
+                return provider
+        return None
+
+    # Runners
+
+    def _run_create_vm(self, job: Job) -> VirtualMachine:
+        provider = self._provider(job.payload["provider"])
+        if provider is None:
+            raise ValueError(f"Provider '{job.payload['provider']}' not found.")
+
+        if "vm_ready" in job.steps:
+            vm = vm_from_record(job.steps["vm_ready"], provider)
+        else:
+            provider_info = provider.get_provider_info()
+            vm = provider.create_vm(
+                **job.payload["create_args"], checkpoint=job.checkpoint
+            )
+            # Keep networking resources created for the first VM of an account
+            if provider.get_provider_info() != provider_info:
+                self.db.reload_provider(provider, False)
+            job.checkpoint("vm_ready", vm_to_record(vm))
+            # Billing starts with the creation, not after provisioning
+            self.db.record_vm_transition(
+                vm, "running", provider.get_vm_hourly_rate(vm)
+            )
+        return self._provision(job, vm)
+
+    def _run_provision_vm(self, job: Job) -> VirtualMachine:
+        vm = vm_from_record(job.payload, self.db.no_provider)
+        return self._provision(job, vm)
+
+    def _provision(self, job: Job, vm: VirtualMachine) -> VirtualMachine:
+        if "provisioned" not in job.steps:
+            provision_vm(vm)
+            job.checkpoint("provisioned")
+        if "inserted" not in job.steps:
+            self.db.insert_vm(vm)
+            job.checkpoint("inserted")
+        return vm
+
+    def _run_delete_provider(self, job: Job):
+        provider = self._provider(job.payload["provider"])
+        if provider is None:
+            # Already deleted before the job was interrupted
+            return None
+
+        vms = self.db.read_vm([provider])
+        if "instances_deleted" not in job.steps:
+            # One batched delete for all VMs, their final states are awaited together
+            done = []
+
+            def on_progress(vm, error):
+                done.append(vm)
+                job.report(
+                    f"Deleted VM '{vm.get_vm_name()}'"
+                    if error is None
+                    else f"Could not delete VM '{vm.get_vm_name()}'",
+                    len(done),
+                    len(vms),
+                )
+
+            job.report(f"Deleting {len(vms)} VMs", 0, len(vms))
+            errors = perform_bulk_action("delete", vms, on_progress=on_progress)
+            if errors:
+                raise ValueError(
+                    f"Could not delete {len(errors)} VMs: " + "; ".join(errors.values())
+                )
+            job.checkpoint("instances_deleted")
+
+        if "resources_deleted" not in job.steps:
+            job.report("Deleting network resources", len(vms), len(vms))
+            provider.delete_resources()
+            job.checkpoint("resources_deleted")
+
+        job.report("Removing the provider", len(vms), len(vms))
+        self.db.delete_provider_and_vms(provider, vms)
+        job.checkpoint("provider_deleted")
+        return provider
+
+
+def vm_to_record(vm: VirtualMachine) -> dict:
+    """Returns everything needed to rebuild the virtual machine as a JSON serializable dict."""
+    return {
+        "vm_name": vm.get_vm_name(),
+        "cost_limit": vm.get_cost_limit(),
+        "public_ip": str(vm.get_public_ip()),
+        "first_connection_date": str(vm.get_first_connection_date()),
+        "root_username": vm.get_root_username(),
+        "password": vm.get_password(),
+        "zerotier_network": vm.get_zerotier_network(),
+        "ssh_key": vm.get_ssh_key(),
+    }
+
+
+def vm_from_record(record: dict, provider) -> VirtualMachine:
+    """Rebuilds a virtual machine from vm_to_record() without probing it."""
+    return VirtualMachine(
+        record["vm_name"],
+        provider,
+        record["cost_limit"],
+        record["public_ip"],
+        record["first_connection_date"],
+        record["root_username"],
+        record["password"],
+        record["zerotier_network"],
+        record["ssh_key"],
+        False,
+    )
+
+
+@spanned("provision")
+def provision_vm(vm: VirtualMachine, attempts: int = 10, retry_interval: int = 2):
+    """Waits for the virtual machine to be reachable, then installs and configures CloudSurge on it."""
+    for i in range(attempts):
+        if i == attempts - 1:
+            raise ValueError("Could not reach VM")
+        elif vm.is_reachable():
+            print("Starting Install..")
+            vm.install_vm()
+            print("Starting Configuring..")
+            vm.configure_vm()
+            print("Finished Configuring")
+            return
+        else:
+            sleep(retry_interval)
+
+
+if __name__ == "__main__":
+    db = Database()
+    db.init()
+
+    queue = JobQueue(db)
+    queue.recover()
+    for finished_job, _ in queue.drain():
+        print(f"{finished_job} finished.")
+    db.close()
@@ -0,0 +1,180 @@
+# author: Luka Pacar
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .db import Database
+from .schedule import AdaptiveInterval
+from .spans import span
+from .vm import VirtualMachine
+
+# The state a VM ends up in after an action, and the state it is shown in meanwhile
+lifecycle_actions = {
+    "start": ("running", "pending"),
+    "stop": ("stopped", "stopping"),
+    "delete": ("deleted", "stopping"),
+}
+
+# Bulk actions, besides the lifecycle actions VMs can be reconfigured over SSH
+bulk_actions = tuple(lifecycle_actions) + ("configure",)
+
+# VMs reconfigured at once
+configure_workers = 4
+
+
+def perform_action(action: str, vm: VirtualMachine, db: Database = None, timeout: float = 300):
+    """Runs a lifecycle action on a VM and waits until its provider confirms the final state.
+
+    Args:
+        action (str): One of lifecycle_actions.
+        vm (VirtualMachine): The VM to act on.
+        db (Database): Database the transition is recorded in.
+        timeout (float): Seconds to wait for the final state.
+
+    Returns:
+        str: The final state, None for VMs without a provider that could confirm it.
+
+    Raises:
+        TimeoutError: If the VM does not reach the final state within timeout.
+    """
+    provider = vm.get_provider()
+    with span(f"lifecycle.{action}", vm=vm.get_vm_name()):
+        getattr(provider, f"{action}_vm")(vm, db)
+        if provider.get_provider_name() not in ("AWS", "DigitalOcean"):
+            return None
+        return wait_for_state(vm, lifecycle_actions[action][0], timeout)
+
+
+def wait_for_state(
+    vm: VirtualMachine, state: str, timeout: float = 300, interval: AdaptiveInterval = None
+) -> str:
+    """Polls the state of a VM until it is state.
+
+    The providers only report errors of an action by printing them, so a VM that never
+    reaches the state is how a failed action shows.
+
+    Raises:
+        TimeoutError: If the VM is not in state after timeout seconds.
+    """
+    pending = wait_for_states(vm.get_provider(), [vm], state, timeout, interval)
+    if pending:
+        raise TimeoutError(pending[vm.get_vm_name()])
+    return state
+
+
+def wait_for_states(
+    provider,
+    vms,
+    state: str,
+    timeout: float = 300,
+    interval: AdaptiveInterval = None,
+    on_confirmed=None,
+) -> dict:
+    """Polls the states of VMs of one provider, with one batched call per poll, until all are in state.
+
+    Args:
+        on_confirmed (callable): Called with every VM once it is in state.
+
+    Returns:
+        dict: An error message by VM name for the VMs not in state after timeout seconds.
+    """
+    interval = interval or AdaptiveInterval(minimum=2, maximum=15, factor=1.5)
+    deadline = time.monotonic() + timeout
+    pending = list(vms)
+    while True:
+        states = provider.get_vm_states(pending)
+        for vm in [vm for vm in pending if states.get(vm.get_vm_name()) == state]:
+            pending.remove(vm)
+            on_confirmed(vm) if on_confirmed else None
+        if not pending:
+            return {}
+        if time.monotonic() >= deadline:
+            return {
+                vm.get_vm_name(): f"VM '{vm.get_vm_name()}' is "
+                f"{states.get(vm.get_vm_name())} instead of {state}"
+                for vm in pending
+            }
+        time.sleep(min(interval.next(False), max(0, deadline - time.monotonic())))
+
+
+def group_by_account(vms) -> list:
+    """Groups VMs by provider account and region, returns (provider, VMs) pairs."""
+    groups = {}
+    for vm in vms:
+        provider = vm.get_provider()
+        key = (provider.get_account_name(), getattr(provider, "region", None))
+        groups.setdefault(key, (provider, []))[1].append(vm)
+    return list(groups.values())
+
+
+def perform_bulk_action(
+    action: str, vms, db: Database = None, on_progress=None, timeout: float = 300
+) -> dict:
+    """Runs an action on many VMs with one batched provider call per account and region.
+
+    The accounts are handled concurrently. The lifecycle actions wait until the providers
+    confirm the final state of every VM, "configure" reconfigures the VMs over SSH.
+
+    Args:
+        action (str): One of bulk_actions.
+        vms (list): The VMs to act on.
+        db (Database): Database the transitions are recorded in.
+        on_progress (callable): Called with (vm, error) as every VM is done, error is None on
+            success. The calls never overlap, but come from worker threads.
+        timeout (float): Seconds to wait for the final states.
+
+    Returns:
+        dict: An error message by VM name for the VMs the action failed on.
+    """
+    errors = {}
+    lock = threading.Lock()
+
+    def done(vm, error=None):
+        with lock:
+            if error is not None:
+                errors[vm.get_vm_name()] = error
+            on_progress(vm, error) if on_progress else None
+
+    def configure(vm):
+        try:
+            if not vm.is_reachable():
+                done(vm, f"VM '{vm.get_vm_name()}' is not reachable")
+                return
+            vm.configure_vm()
+            done(vm)
+        except Exception as e:
+            done(vm, str(e))
+
+    def act(provider, group):
+        with span(
+            f"lifecycle.bulk_{action}", account=provider.get_account_name(), vms=len(group)
+        ):
+            try:
+                getattr(provider, f"{action}_vms")(group, db)
+            except Exception as e:
+                for vm in group:
+                    done(vm, str(e))
+                return
+            if provider.get_provider_name() not in ("AWS", "DigitalOcean"):
+                for vm in group:
+                    done(vm)
+                return
+            pending = wait_for_states(
+                provider, group, lifecycle_actions[action][0], timeout, on_confirmed=done
+            )
+            for vm in group:
+                if vm.get_vm_name() in pending:
+                    done(vm, pending[vm.get_vm_name()])
+
+    if action == "configure":
+        with ThreadPoolExecutor(
+            configure_workers, thread_name_prefix="configure"
+        ) as executor:
+            list(executor.map(configure, vms))
+    else:
+        groups = group_by_account(vms)
+        with ThreadPoolExecutor(
+            max(1, len(groups)), thread_name_prefix=f"bulk-{action}"
+        ) as executor:
+            list(executor.map(lambda group: act(*group), groups))
+    return errors
@@ -0,0 +1,402 @@
+# author: Luka Pacar
+import contextlib
+import contextvars
+import functools
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode, urlparse
+
+from .spans import span
+
+# Upper bounds (seconds) of the API call duration histogram buckets
+duration_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class ApiMetrics:
+    """Counts and times the calls made to the provider APIs, per provider and method."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (provider, method, outcome) -> count
+        self.calls = {}
+        # (provider, method) -> [bucket counts..., sum, count]
+        self.durations = {}
+        # (provider, service, operation) -> [requests, retries, request bytes, response bytes]
+        self.requests = {}
+
+    def observe(self, provider: str, method: str, outcome: str, duration: float):
+        with self._lock:
+            key = (provider, method, outcome)
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+            histogram = self.durations.setdefault(
+                (provider, method), [0] * len(duration_buckets) + [0.0, 0]
+            )
+            for i, bound in enumerate(duration_buckets):
+                if duration <= bound:
+                    histogram[i] += 1
+            histogram[-2] += duration
+            histogram[-1] += 1
+
+    def observe_request(self, provider: str, request: dict):
+        with self._lock:
+            key = (provider, request["service"], request["operation"])
+            totals = self.requests.setdefault(key, [0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += request["retries"]
+            totals[2] += request["request_bytes"]
+            totals[3] += request["response_bytes"]
+
+    def copy(self):
+        """Returns a consistent copy of (calls, durations, requests)."""
+        with self._lock:
+            return (
+                dict(self.calls),
+                {k: list(v) for k, v in self.durations.items()},
+                {k: list(v) for k, v in self.requests.items()},
+            )
+
+
+# Shared by all providers of this process
+api_metrics = ApiMetrics()
+
+
+class ApiOperation:
+    """A high-level CloudSurge operation (a provider method) and the HTTP requests it made."""
+
+    def __init__(self, provider: str, method: str):
+        self.provider = provider
+        self.method = method
+        self.started = time.time()
+        self.duration = None
+        self.outcome = None
+        self.requests = []
+
+    def to_dict(self) -> dict:
+        return {
+            "provider": self.provider,
+            "method": self.method,
+            "started": self.started,
+            "duration": self.duration,
+            "outcome": self.outcome,
+            "requests": self.requests,
+        }
+
+    def __str__(self):
+        lines = [
+            f"{self.provider}.{self.method} {self.duration * 1000:.0f}ms {self.outcome}, {len(self.requests)} requests"
+        ]
+        for request in self.requests:
+            lines.append(
+                f"    {request['service']}.{request['operation']} {request['duration'] * 1000:.0f}ms"
+                f" status={request['status']} retries={request['retries']}"
+                f" sent={request['request_bytes']}B received={request['response_bytes']}B"
+            )
+        return "\n".join(lines)
+
+
+# The outermost operation of the current thread, requests made by nested methods belong to it
+_current_operation = contextvars.ContextVar("cloudsurge_api_operation", default=None)
+_trace_listeners = []
+
+
+def add_trace_listener(listener):
+    """Calls listener(operation) with every finished ApiOperation of this process."""
+    _trace_listeners.append(listener)
+
+
+def remove_trace_listener(listener):
+    _trace_listeners.remove(listener)
+
+
+@contextlib.contextmanager
+def traced():
+    """Collects the ApiOperations finished within the block, e.g. to check the API fan-out of an action."""
+    operations = []
+    add_trace_listener(operations.append)
+    try:
+        yield operations
+    finally:
+        remove_trace_listener(operations.append)
+
+
+def print_operation(operation: ApiOperation):
+    """Trace listener printing every operation to stderr, used by the --trace option."""
+    print(f"[trace] {operation}", file=sys.stderr)
+
+
+def timed_api_call(method):
+    """Records every call of a provider method in api_metrics and traces its requests."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        operation = None
+        token = None
+        if _current_operation.get() is None:
+            operation = ApiOperation(self.get_provider_name(), method.__name__)
+            token = _current_operation.set(operation)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            with span(f"{self.get_provider_name()}.{method.__name__}"):
+                result = method(self, *args, **kwargs)
+            outcome = "success"
+            return result
+        finally:
+            duration = time.perf_counter() - start
+            api_metrics.observe(
+                self.get_provider_name(), method.__name__, outcome, duration
+            )
+            if operation is not None:
+                _current_operation.reset(token)
+                operation.duration = duration
+                operation.outcome = outcome
+                for listener in list(_trace_listeners):
+                    listener(operation)
+
+    return wrapper
+
+
+def record_api_request(
+    provider: str,
+    service: str,
+    operation: str,
+    duration: float,
+    status,
+    retries: int = 0,
+    request_bytes: int = 0,
+    response_bytes: int = 0,
+):
+    """Records a single HTTP request made to a provider API."""
+    request = {
+        "service": service,
+        "operation": operation,
+        "duration": duration,
+        "status": status,
+        "retries": retries,
+        "request_bytes": request_bytes,
+        "response_bytes": response_bytes,
+    }
+    api_metrics.observe_request(provider, request)
+    current = _current_operation.get()
+    if current is not None:
+        current.requests.append(request)
+
+
+def instrument_boto3_client(client, provider: str):
+    """Records every request of a boto3 client through botocore's event hooks."""
+
+    def before_call(model, params, context, **kwargs):
+        body = params.get("body") or b""
+        if isinstance(body, dict):
+            body = urlencode(body, doseq=True)
+        context["cloudsurge_operation"] = model.name
+        context["cloudsurge_started"] = time.perf_counter()
+        context["cloudsurge_request_bytes"] = len(body)
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        record_api_request(
+            provider,
+            model.service_model.service_name,
+            model.name,
+            time.perf_counter() - context.get("cloudsurge_started", time.perf_counter()),
+            http_response.status_code,
+            parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+            context.get("cloudsurge_request_bytes", 0),
+            len(http_response.content or b""),
+        )
+
+    def after_call_error(context, exception, **kwargs):
+        record_api_request(
+            provider,
+            client.meta.service_model.service_name,
+            context.get("cloudsurge_operation", "unknown"),
+            time.perf_counter() - context.get("cloudsurge_started", time.perf_counter()),
+            type(exception).__name__,
+            0,
+            context.get("cloudsurge_request_bytes", 0),
+        )
+
+    client.meta.events.register("before-call", before_call)
+    client.meta.events.register("after-call", after_call)
+    client.meta.events.register("after-call-error", after_call_error)
+    return client
+
+
+def traced_session(provider: str):
+    """Returns a requests session recording every request, for the python-digitalocean objects."""
+    import requests
+
+    def on_response(response, *args, **kwargs):
+        url = urlparse(response.request.url)
+        # IDs in the path would make every droplet its own operation
+        path = re.sub(r"/\d+", "/{id}", url.path)
+        record_api_request(
+            provider,
+            url.netloc,
+            f"{response.request.method} {path}",
+            response.elapsed.total_seconds(),
+            response.status_code,
+            0,
+            len(response.request.body or b""),
+            len(response.content or b""),
+        )
+
+    session = requests.Session()
+    session.hooks["response"].append(on_response)
+    return session
+
+
+def _labels(**labels) -> str:
+    def escape(value) -> str:
+        return (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def render_openmetrics(fleet: dict, metrics: ApiMetrics = api_metrics) -> str:
+    """Renders the fleet state (as served by the daemon) and the API metrics in the OpenMetrics text format."""
+    lines = []
+
+    def family(name, metric_type, description, unit=None):
+        lines.append(f"# TYPE {name} {metric_type}")
+        if unit:
+            lines.append(f"# UNIT {name} {unit}")
+        lines.append(f"# HELP {name} {description}")
+
+    vm_gauges = (
+        (
+            "cloudsurge_vm_accrued_cost_dollars",
+            "Cost accrued by the VM",
+            "dollars",
+            lambda r: r["accrued_cost"],
+        ),
+        (
+            "cloudsurge_vm_hourly_rate_dollars",
+            "Current hourly rate of the VM",
+            "dollars",
+            lambda r: r["hourly_rate"],
+        ),
+        (
+            "cloudsurge_vm_cost_limit_headroom_dollars",
+            "Cost left until the VM reaches its cost limit",
+            "dollars",
+            lambda r: None
+            if r["accrued_cost"] is None
+            else r["cost_limit"] - r["accrued_cost"],
+        ),
+        (
+            "cloudsurge_vm_reachable",
+            "Whether the VM is reachable",
+            None,
+            lambda r: None if r["online"] is None else int(r["online"]),
+        ),
+        (
+            "cloudsurge_vm_running",
+            "Whether the provider reports the VM as running",
+            None,
+            lambda r: None if r["state"] is None else int(r["state"] == "running"),
+        ),
+    )
+    for name, description, unit, value in vm_gauges:
+        family(name, "gauge", description, unit)
+        for record in fleet["vms"]:
+            sample = value(record)
+            if sample is None:
+                continue
+            labels = _labels(
+                vm=record["vm_name"],
+                account=record["account"],
+                provider=record["provider"],
+            )
+            lines.append(f"{name}{labels} {sample}")
+
+    if fleet["sampled_at"] is not None:
+        family(
+            "cloudsurge_fleet_sampled_at_seconds",
+            "gauge",
+            "Unix time of the last fleet refresh",
+            "seconds",
+        )
+        lines.append(f"cloudsurge_fleet_sampled_at_seconds {fleet['sampled_at']}")
+
+    calls, durations, requests = metrics.copy()
+    family("cloudsurge_provider_api_calls", "counter", "Calls made to the provider APIs")
+    for (provider, method, outcome), count in sorted(calls.items()):
+        labels = _labels(provider=provider, method=method, outcome=outcome)
+        lines.append(f"cloudsurge_provider_api_calls_total{labels} {count}")
+
+    name = "cloudsurge_provider_api_call_duration_seconds"
+    family(name, "histogram", "Duration of the calls made to the provider APIs", "seconds")
+    for (provider, method), histogram in sorted(durations.items()):
+        for bound, count in zip(duration_buckets, histogram):
+            labels = _labels(provider=provider, method=method, le=bound)
+            lines.append(f"{name}_bucket{labels} {count}")
+        labels = _labels(provider=provider, method=method, le="+Inf")
+        lines.append(f"{name}_bucket{labels} {histogram[-1]}")
+        labels = _labels(provider=provider, method=method)
+        lines.append(f"{name}_sum{labels} {histogram[-2]}")
+        lines.append(f"{name}_count{labels} {histogram[-1]}")
+
+    request_counters = (
+        (
+            "cloudsurge_provider_api_requests",
+            "HTTP requests made to the provider APIs",
+            None,
+        ),
+        (
+            "cloudsurge_provider_api_request_retries",
+            "Retries of HTTP requests to the provider APIs",
+            None,
+        ),
+        (
+            "cloudsurge_provider_api_request_bytes",
+            "Bytes sent to the provider APIs",
+            "bytes",
+        ),
+        (
+            "cloudsurge_provider_api_response_bytes",
+            "Bytes received from the provider APIs",
+            "bytes",
+        ),
+    )
+    for i, (name, description, unit) in enumerate(request_counters):
+        family(name, "counter", description, unit)
+        for (provider, service, operation), totals in sorted(requests.items()):
+            labels = _labels(provider=provider, service=service, operation=operation)
+            lines.append(f"{name}_total{labels} {totals[i]}")
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(get_fleet, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serves /metrics in a background thread. Scrapes are answered from get_fleet() only."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render_openmetrics(get_fleet()).encode()
+            self.send_response(200)
+            self.send_header(
+                "Content-Type",
+                "application/openmetrics-text; version=1.0.0; charset=utf-8",
+            )
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
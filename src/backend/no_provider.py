@@ -36,13 +36,13 @@ class NoProvider(Provider):
     def create_vm(self):
         """Does Nothing."""
 
-    def start_vm(self, virtual_machine) -> None:
+    def start_vm(self, virtual_machine, db=None) -> None:
         """Does Nothing."""
 
-    def stop_vm(self, virtual_machine) -> None:
+    def stop_vm(self, virtual_machine, db=None) -> None:
         """Does Nothing."""
 
-    def delete_vm(self, virtual_machine) -> None:
+    def delete_vm(self, virtual_machine, db=None) -> None:
         """Does Nothing."""
 
     def is_active(self, vm):
@@ -61,5 +61,9 @@ class NoProvider(Provider):
         """Get the hourly rate of the virtual machine."""
         return 0
 
+    def get_vm_state(self, vm):
+        """Get the state of the virtual machine."""
+        return "unknown"
+
     def __str__(self):
         return "\n  No-Provider"
\ No newline at end of file
@@ -3,26 +3,42 @@ from .vm import VirtualMachine
 from .db import Database
 
 
-def get_reached_cost_limits():
+def get_reached_cost_limits(db: Database = None):
     """Prints a list of virtual machines that have reached their cost limits."""
-    db = Database()
-    db.init()
+    for vm, val in iter_reached_cost_limits(db):
+        print_cost_limits(vm, val)
 
-    providers = db.read_provider()
+
+def iter_reached_cost_limits(db: Database = None):
+    """Yields (vm, exceeded_by) for every virtual machine over its cost limit, as soon as it is known."""
+    if db is None:
+        db = Database()
+        db.init()
+
+    # Providers are only constructed for VMs the cost ledger does not know yet
+    providers = db.read_provider(lazy=True)
     vms = db.read_vm(providers)
+    accrued_costs = db.read_accrued_costs()
 
     for vm in vms:
         try:
-            val = reached_cost_limit(vm)
-            if val > 0:
-                print_cost_limits(vm, val)
+            val = reached_cost_limit(vm, accrued_costs)
         except Exception:
-            pass
+            continue
+        if val > 0:
+            yield vm, val
+
 
+def reached_cost_limit(vm: VirtualMachine, accrued_costs=None):
+    """Check if the virtual machine has reached its cost limit.
 
-def reached_cost_limit(vm: VirtualMachine):
-    """Check if the virtual machine has reached its cost limit."""
-    return vm.get_provider().get_vm_cost(vm) - vm.get_cost_limit()
+    The cost is taken from the local cost ledger if it knows the VM, otherwise the provider is asked.
+    """
+    if accrued_costs and vm.get_vm_name() in accrued_costs:
+        cost = accrued_costs[vm.get_vm_name()]["accrued_cost"]
+    else:
+        cost = vm.get_provider().get_vm_cost(vm)
+    return cost - vm.get_cost_limit()
 
 
 def print_cost_limits(vm: VirtualMachine, val: int):
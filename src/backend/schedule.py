@@ -0,0 +1,109 @@
+# author: Luka Pacar
+import threading
+import time
+
+from .fleet import time_to_limit
+
+# States a VM only passes through, while one is in such a state polling stays fast
+transitional_states = ("pending", "stopping")
+
+
+class AdaptiveInterval:
+    """A polling interval that is short while the fleet changes and backs off while it is idle."""
+
+    def __init__(self, minimum: float = 15, maximum: float = 300, factor: float = 2):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.current = minimum
+
+    def next(self, changed: bool, states=()) -> float:
+        """Returns the time until the next poll.
+
+        Args:
+            changed (bool): Whether the last poll saw any change.
+            states (iterable): VM states seen by the last poll.
+        """
+        if changed or any(state in transitional_states for state in states):
+            self.current = self.minimum
+        else:
+            self.current = min(self.current * self.factor, self.maximum)
+        return self.current
+
+    def reset(self):
+        """Polls at the shortest interval again, e.g. after the user acted on a VM."""
+        self.current = self.minimum
+
+
+class FleetSchedule:
+    """Decides when every VM is polled next.
+
+    VMs in a transitional state or close to their cost limit are polled at the minimum interval,
+    stopped VMs at the maximum and all others back off while they do not change.
+
+    Args:
+        minimum (float): Shortest interval in seconds.
+        maximum (float): Longest interval in seconds.
+        near_limit_hours (float): VMs reaching their cost limit within this many hours count as close to it.
+    """
+
+    def __init__(
+        self, minimum: float = 15, maximum: float = 300, near_limit_hours: float = 24
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.near_limit_hours = near_limit_hours
+        # AdaptiveInterval and monotonic time of the next poll by VM name
+        self._intervals = {}
+        self._due = {}
+        self._lock = threading.Lock()
+
+    def interval(self, vm, record: dict, changed: bool) -> float:
+        """Returns the time until the next poll of a VM after a poll returned record."""
+        state = record.get("state")
+        with self._lock:
+            interval = self._intervals.setdefault(
+                vm.get_vm_name(), AdaptiveInterval(self.minimum, self.maximum)
+            )
+            hours = time_to_limit(vm, record)
+            if state in transitional_states or (
+                hours is not None and hours < self.near_limit_hours
+            ):
+                interval.reset()
+                return self.minimum
+            if state is not None and state not in vm.get_provider().billable_states:
+                # A stopped VM only changes when someone acts on it
+                interval.current = self.maximum
+                return self.maximum
+            return interval.next(changed)
+
+    def polled(self, vm, record: dict, changed: bool, now: float = None) -> None:
+        """Schedules the next poll of a VM that was just polled."""
+        delay = self.interval(vm, record, changed)
+        with self._lock:
+            self._due[vm.get_vm_name()] = (now or time.monotonic()) + delay
+
+    def poll_soon(self, vm_names) -> None:
+        """Makes VMs due at once, e.g. after the user acted on them."""
+        with self._lock:
+            for vm_name in vm_names:
+                self._due[vm_name] = 0
+                self._intervals.pop(vm_name, None)
+
+    def due(self, vms, now: float = None) -> dict:
+        """Returns the VMs due for a poll by account name, VMs never polled are due."""
+        now = now or time.monotonic()
+        accounts = {}
+        with self._lock:
+            for vm in vms:
+                if self._due.get(vm.get_vm_name(), 0) <= now:
+                    account_name = vm.get_provider().get_account_name()
+                    accounts.setdefault(account_name, []).append(vm)
+        return accounts
+
+    def next_due(self, vms, now: float = None) -> float:
+        """Returns the seconds until the next VM is due, the maximum interval if there are no VMs."""
+        now = now or time.monotonic()
+        with self._lock:
+            due = [self._due.get(vm.get_vm_name(), 0) for vm in vms]
+        return max(0, min(due, default=now + self.maximum) - now)
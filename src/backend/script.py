@@ -0,0 +1,147 @@
+# author: Luka Pacar
+import hashlib
+import json
+import os
+import tempfile
+
+script_url = "https://raw.githubusercontent.com/TechTowers/CloudSurge/refs/heads/main/scripts/cloudsurge.sh"
+
+# Seconds to connect to and read from GitHub, the bundled script is used if it takes longer
+fetch_timeout = 10
+
+
+def script_path() -> str:
+    """Returns where the CloudSurge script run on the VMs is stored."""
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(data_home, "cloudsurge.sh")
+
+
+def bundled_script_path():
+    """Returns the script installed with the application (or of the source tree), None if missing."""
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for path in (
+        # Installed next to the package in pkgdatadir
+        os.path.join(package_dir, "cloudsurge.sh"),
+        os.path.join(package_dir, "..", "scripts", "cloudsurge.sh"),
+    ):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _sha256(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _write_atomically(path: str, content: bytes, mode: int = 0o644, sync: bool = True):
+    """Replaces path with content, readers see either the old or the new file.
+
+    Without sync the content is not flushed to disk, after a crash the file may be empty.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".cloudsurge-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def read_script_info(path: str = None) -> dict:
+    """Returns the stored ETag, Last-Modified and SHA-256 of the script, verified against the file.
+
+    An empty dict means there is no intact script, e.g. it is missing or was changed locally.
+    """
+    path = path or script_path()
+    try:
+        with open(path + ".json") as f:
+            info = json.load(f)
+        with open(path, "rb") as f:
+            content = f.read()
+    except (OSError, ValueError):
+        return {}
+    return info if info.get("sha256") == _sha256(content) else {}
+
+
+def store_script(content: bytes, info: dict, path: str = None):
+    """Atomically stores an executable script and its sidecar with info and the content hash.
+
+    Only the script is synced to disk. A sidecar lost in a crash does not match the script
+    anymore, which read_script_info() treats as no intact script, so it is downloaded again.
+    """
+    path = path or script_path()
+    _write_atomically(path, content, 0o755)
+    info = dict(info, sha256=_sha256(content))
+    _write_atomically(path + ".json", json.dumps(info).encode(), sync=False)
+
+
+def fetch_script(path: str = None, timeout: float = fetch_timeout, print_output=True) -> bool:
+    """Updates the CloudSurge script from GitHub, only downloading it if it changed.
+
+    The stored ETag and Last-Modified are sent along, an unchanged script is answered with
+    304 Not Modified. If GitHub can not be reached and there is no intact script yet, the
+    bundled script is installed instead.
+
+    Args:
+        path (str): Where the script is stored, script_path() by default.
+        timeout (float): Seconds to connect and to wait for data.
+
+    Returns:
+        bool: Whether an intact script is in place afterwards.
+    """
+    # Only imported here, the VMs look the script up without loading requests
+    import requests
+
+    path = path or script_path()
+    info = read_script_info(path)
+    headers = {}
+    if info.get("etag"):
+        headers["If-None-Match"] = info["etag"]
+    if info.get("last_modified"):
+        headers["If-Modified-Since"] = info["last_modified"]
+
+    try:
+        r = requests.get(script_url, headers=headers, timeout=timeout)
+        if r.status_code == 304:
+            print("CloudSurge script is up to date.") if print_output else None
+            return True
+        if r.ok:
+            store_script(
+                r.content,
+                {
+                    "etag": r.headers.get("ETag"),
+                    "last_modified": r.headers.get("Last-Modified"),
+                    "source": script_url,
+                },
+                path,
+            )
+            print("CloudSurge script updated.") if print_output else None
+            return True
+        # HTTP status code 4XX/5XX
+        print(f"Download failed: status code {r.status_code}") if print_output else None
+    except (requests.RequestException, OSError) as e:
+        print(f"Download failed: {e}") if print_output else None
+
+    if info:
+        return True
+    return install_bundled_script(path, print_output)
+
+
+def install_bundled_script(path: str = None, print_output=True) -> bool:
+    """Installs the bundled script, without validators so the next fetch downloads it in full."""
+    bundled = bundled_script_path()
+    if bundled is None:
+        print("No bundled CloudSurge script found.") if print_output else None
+        return False
+    with open(bundled, "rb") as f:
+        store_script(f.read(), {"source": bundled}, path)
+    print("Installed the bundled CloudSurge script.") if print_output else None
+    return True
@@ -3,21 +3,28 @@ from subprocess import TimeoutExpired
 from .vm import VirtualMachine
 from .db import Database
 
-def get_active_servers():
-    """Returns a list of virtual machines that have reached their cost limits."""
-    db = Database()
-    db.init()
-
-    providers = db.read_provider()
-    vms = db.read_vm(providers)
-
+def get_active_servers(db: Database = None):
+    """Prints the amount of virtual machines that are reachable."""
     amount_reachable = 0
-    for vm in vms:
-        if is_reachable(vm):
+    for _, reachable in iter_reachability(db):
+        if reachable:
             amount_reachable += 1
 
     print(amount_reachable)
 
+def iter_reachability(db: Database = None):
+    """Yields (vm, reachable) for every virtual machine, as soon as it was checked."""
+    if db is None:
+        db = Database()
+        db.init()
+
+    # Providers are only constructed if a VM has to be checked through its provider
+    providers = db.read_provider(lazy=True)
+    vms = db.read_vm(providers)
+
+    for vm in vms:
+        yield vm, bool(is_reachable(vm))
+
 def is_reachable(vm: VirtualMachine):
     """Check if the virtual machine is reachable."""
     try:
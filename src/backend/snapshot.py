@@ -0,0 +1,75 @@
+# author: Luka Pacar
+import json
+import os
+import tempfile
+import time
+
+# The last known view of the fleet, small enough to be read before anything else is loaded
+snapshot_file = os.path.expandvars("$XDG_CACHE_HOME/cloudsurge/fleet.json")
+
+
+def build_snapshot(providers, vms, accrued_costs) -> dict:
+    """Builds a snapshot of the fleet from the loaded providers, VMs and the cost ledger.
+
+    Args:
+        providers (list): Provider accounts.
+        vms (list): Virtual machines.
+        accrued_costs (dict): Ledger entries as returned by Database.read_accrued_costs().
+
+    Returns:
+        dict: JSON serializable snapshot.
+    """
+    now = int(time.time())
+    snapshot_vms = []
+    for vm in vms:
+        entry = accrued_costs.get(vm.get_vm_name(), {})
+        snapshot_vms.append(
+            {
+                "vm_name": vm.get_vm_name(),
+                "provider": vm.get_provider().get_account_name(),
+                "provider_name": vm.get_provider().get_provider_name(),
+                "public_ip": str(vm.get_public_ip()),
+                "cost_limit": vm.get_cost_limit(),
+                "state": entry.get("state"),
+                "hourly_rate": entry.get("hourly_rate"),
+                "accrued_cost": entry.get("accrued_cost"),
+                "sampled_at": now,
+            }
+        )
+    return {
+        "sampled_at": now,
+        "providers": [
+            {
+                "account_name": provider.get_account_name(),
+                "provider_name": provider.get_provider_name(),
+            }
+            for provider in providers
+        ],
+        "vms": snapshot_vms,
+    }
+
+
+def load_snapshot(path: str = snapshot_file) -> dict:
+    """Loads the last saved snapshot, or an empty one if there is none (or it is unreadable)."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"sampled_at": None, "providers": [], "vms": []}
+
+
+def save_snapshot(snapshot: dict, path: str = snapshot_file):
+    """Atomically replaces the saved snapshot, so a reader never sees a partial file."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        print(f"Error saving fleet snapshot: {e}")
@@ -0,0 +1,187 @@
+# author: Luka Pacar
+import contextvars
+import cProfile
+import functools
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Timed spans and structured logs, written as JSON lines. Enabled by environment variables,
+# nothing is recorded otherwise:
+#
+#   CLOUDSURGE_SPANS=stderr|<file>  write spans and log records as JSON lines
+#   CLOUDSURGE_PROFILE=<names>|*    also run these (comma separated) spans under cProfile,
+#                                   the stats are saved next to the output file
+#
+# Only one span in the process is profiled at a time, spans starting meanwhile (nested or in
+# other threads) are only timed. Before Python 3.12 a profile only covers the thread that
+# started it, e.g. cost.refresh profiles waiting for its workers and not the workers.
+
+logger = logging.getLogger("cloudsurge")
+
+_output = os.environ.get("CLOUDSURGE_SPANS")
+enabled = bool(_output)
+_profiled = {
+    name.strip()
+    for name in os.environ.get("CLOUDSURGE_PROFILE", "").split(",")
+    if name.strip()
+}
+
+_current_span = contextvars.ContextVar("cloudsurge_span", default=None)
+_ids = itertools.count(1)
+_write_lock = threading.Lock()
+# Held by the span running under cProfile, there is only one profiler per process
+_profile_lock = threading.Lock()
+_stream = None
+
+
+def _write(record: dict):
+    global _stream
+    with _write_lock:
+        if _stream is None:
+            _stream = sys.stderr if _output == "stderr" else open(_output, "a")
+        _stream.write(json.dumps(record, default=str) + "\n")
+        _stream.flush()
+
+
+def _profile_dir() -> str:
+    if _output == "stderr":
+        return tempfile.gettempdir()
+    return os.path.dirname(os.path.abspath(_output))
+
+
+class Span:
+    """A timed operation, nested in the span that was current when it started."""
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.id = next(_ids)
+        self.parent = _current_span.get()
+        self.profile = None
+        self._token = None
+
+    def _start_profile(self):
+        """Profiles the span if it is to be profiled and no other span holds the profiler."""
+        if not ("*" in _profiled or self.name in _profiled):
+            return
+        if not _profile_lock.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiling tool is active, e.g. a debugger, the span is only timed
+            _profile_lock.release()
+            return
+        self.profile = profile
+
+    def __enter__(self):
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._start_profile()
+        self._token = _current_span.set(self)
+        return self
+
+    def set(self, **attrs):
+        """Adds attributes known only while the span runs."""
+        self.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.profile is not None:
+            self.profile.disable()
+            _profile_lock.release()
+        duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+
+        record = {
+            "type": "span",
+            "name": self.name,
+            "id": self.id,
+            "parent": self.parent.id if self.parent else None,
+            "thread": threading.current_thread().name,
+            "start": self.started,
+            "duration": duration,
+            "attrs": self.attrs,
+        }
+        if exc is not None:
+            record["error"] = repr(exc)
+        if self.profile is not None:
+            path = os.path.join(
+                _profile_dir(), f"cloudsurge-{self.name}-{self.id}.prof"
+            )
+            self.profile.dump_stats(path)
+            record["profile"] = path
+        _write(record)
+        return False
+
+
+class _NoSpan:
+    """Stands in for Span while spans are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_no_span = _NoSpan()
+
+
+def span(name: str, **attrs):
+    """Returns a context manager timing the enclosed block as a span."""
+    if not enabled:
+        return _no_span
+    return Span(name, attrs)
+
+
+def spanned(name: str):
+    """Decorates a function to run as a span. Returns the function unchanged while disabled."""
+
+    def decorator(function):
+        if not enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Span(name, {}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class JsonLinesHandler(logging.Handler):
+    """Writes log records as JSON lines, tagged with the span they were logged in."""
+
+    def emit(self, record: logging.LogRecord):
+        current = _current_span.get()
+        _write(
+            {
+                "type": "log",
+                "time": record.created,
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+                "span": current.id if current else None,
+                "thread": record.threadName,
+            }
+        )
+
+
+if enabled:
+    logger.addHandler(JsonLinesHandler())
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+else:
+    logger.addHandler(logging.NullHandler())
@@ -0,0 +1,76 @@
+# author: Luka Pacar
+import json
+import time
+
+from .db import Database
+from .reached_cost_limits import reached_cost_limit
+from .server_is_active import is_reachable
+
+
+def get_status(db: Database = None) -> dict:
+    """Returns the cost limit overruns and the amount of reachable virtual machines in one pass.
+
+    Returns:
+        dict: {"sampled_at": int, "online": int, "exceeded": [{"provider", "vm_name", "cost_limit", "exceeded_by"}]}
+    """
+    return summarize_status(iter_vm_status(db))
+
+
+def summarize_status(records, sampled_at=None) -> dict:
+    """Summarizes VM status records (see iter_vm_status()) into the get_status() document."""
+    online = 0
+    exceeded = []
+    for record in records:
+        if record["online"]:
+            online += 1
+        if record["exceeded_by"] is not None:
+            exceeded.append(
+                {
+                    key: record[key]
+                    for key in ("provider", "vm_name", "cost_limit", "exceeded_by")
+                }
+            )
+
+    return {
+        "sampled_at": sampled_at if sampled_at is not None else int(time.time()),
+        "online": online,
+        "exceeded": exceeded,
+    }
+
+
+def iter_vm_status(db: Database = None):
+    """Yields the status of every virtual machine as soon as it is known.
+
+    Yields:
+        dict: {"provider", "vm_name", "cost_limit", "exceeded_by", "online"}, exceeded_by is None
+        if the VM is within its cost limit.
+    """
+    if db is None:
+        db = Database()
+        db.init()
+
+    providers = db.read_provider(lazy=True)
+    vms = db.read_vm(providers)
+    accrued_costs = db.read_accrued_costs()
+
+    for vm in vms:
+        try:
+            val = reached_cost_limit(vm, accrued_costs)
+        except Exception:
+            val = None
+        yield {
+            "provider": vm.get_provider().get_provider_name(),
+            "vm_name": vm.get_vm_name(),
+            "cost_limit": vm.get_cost_limit(),
+            "exceeded_by": val if val is not None and val > 0 else None,
+            "online": bool(is_reachable(vm)),
+        }
+
+
+def print_status(db: Database = None):
+    """Prints get_status() as a single JSON document."""
+    print(json.dumps(get_status(db)))
+
+
+if __name__ == "__main__":
+    print_status()
@@ -1,5 +1,4 @@
 # author: Luka Pacar
-import os
 from abc import abstractmethod, ABC
 from time import sleep
 from datetime import date
@@ -7,6 +6,9 @@ from ipaddress import IPv4Address
 
 import subprocess
 
+from .script import script_path
+from .spans import spanned
+
 
 class Provider(ABC):
     """Represents a Connection with no Provider. Typically skipping the vm-creation step and using ssh"""
@@ -14,6 +16,11 @@ class Provider(ABC):
     delimiter = ",,,"
     starting_character = ":"
 
+    # Provider independent VM states as returned by get_vm_state
+    vm_states = ("pending", "running", "stopping", "stopped", "deleted", "unknown")
+    # States the provider charges for
+    billable_states = ("pending", "running", "stopping")
+
     def __init__(self, account_name: str, connection_date: date):
         self._account_name = account_name
         self._connection_date = connection_date
@@ -66,21 +73,48 @@ class Provider(ABC):
     def get_vm_hourly_rate(self, vm):
         """Get the hourly rate of the virtual machine."""
 
+    @abstractmethod
+    def get_vm_state(self, vm) -> str:
+        """Get the state of the virtual machine (one of Provider.vm_states)."""
+
     @abstractmethod
     def create_vm(self, *args, **kwargs):
         """Create a virtual machine."""
 
     @abstractmethod
-    def stop_vm(self, virtual_machine) -> None:
-        """Stop the virtual machine."""
+    def stop_vm(self, virtual_machine, db=None) -> None:
+        """Stop the virtual machine. The transition is recorded in the cost ledger of db."""
 
     @abstractmethod
-    def delete_vm(self, virtual_machine, db) -> None:
-        """Delete the virtual machine."""
+    def delete_vm(self, virtual_machine, db=None) -> None:
+        """Delete the virtual machine and remove it from db."""
 
     @abstractmethod
-    def start_vm(self, virtual_machine) -> None:
-        """Start the virtual machine."""
+    def start_vm(self, virtual_machine, db=None) -> None:
+        """Start the virtual machine. The transition is recorded in the cost ledger of db."""
+
+    # Batched lifecycle actions, providers with batch APIs override these
+    def start_vms(self, virtual_machines, db=None) -> None:
+        """Start several virtual machines of this provider."""
+        for virtual_machine in virtual_machines:
+            self.start_vm(virtual_machine, db)
+
+    def stop_vms(self, virtual_machines, db=None) -> None:
+        """Stop several virtual machines of this provider."""
+        for virtual_machine in virtual_machines:
+            self.stop_vm(virtual_machine, db)
+
+    def delete_vms(self, virtual_machines, db=None) -> None:
+        """Delete several virtual machines of this provider and remove them from db."""
+        for virtual_machine in virtual_machines:
+            self.delete_vm(virtual_machine, db)
+
+    def get_vm_states(self, virtual_machines) -> dict:
+        """Get the states of several virtual machines by VM name."""
+        return {vm.get_vm_name(): self.get_vm_state(vm) for vm in virtual_machines}
+
+    def delete_resources(self, print_output=True) -> None:
+        """Delete the resources created for the virtual machines of this account, once they are gone."""
 
     def __str__(self):
         return f"Account Name: {self._account_name}, Connection Date: {self._connection_date}"
@@ -128,6 +162,7 @@ class VirtualMachine:
                 else:
                     sleep(2)
 
+    @spanned("vm.is_reachable")
     def is_reachable(self):
         """Check if the virtual machine is reachable."""
         process = subprocess.call(
@@ -150,13 +185,14 @@ class VirtualMachine:
 
         return process == 0
 
+    @spanned("vm.install")
     def install_vm(self):
         """Installs CloudSurge specific data on the virtual machine."""
         proc = subprocess.run(
             [
                 "flatpak-spawn",
                 "--host",
-                os.path.expandvars("$XDG_DATA_HOME/cloudsurge.sh"),
+                script_path(),
                 "-s",
                 f"{self.get_root_username()}@{str(self.get_public_ip())}",
                 "-k",
@@ -171,13 +207,14 @@ class VirtualMachine:
         )
         print(proc.stdout)
 
+    @spanned("vm.configure")
     def configure_vm(self):
         """Configures the virtual machine using the cloudsurge-script."""
         proc = subprocess.run(
             [
                 "flatpak-spawn",
                 "--host",
-                os.path.expandvars("$XDG_DATA_HOME/cloudsurge.sh"),
+                script_path(),
                 "-s",
                 f"{self.get_root_username()}@{str(self.get_public_ip())}",
                 "-k",
@@ -0,0 +1,119 @@
+# author: Luka Pacar
+import sys
+import time
+
+from .daemon import query_fleet
+from .db import Database
+from .fleet import ProviderCache, probe_fleet, refresh_costs, vm_record
+from .schedule import FleetSchedule
+
+columns = (
+    ("VM", "vm_name", 20),
+    ("PROVIDER", "provider", 12),
+    ("STATE", "state", 9),
+    ("ONLINE", "online", 6),
+    ("COST", "accrued_cost", 9),
+    ("RATE", "hourly_rate", 9),
+    ("TO LIMIT", "time_to_limit", 9),
+)
+
+
+def format_value(key: str, value) -> str:
+    """Formats a record value for a table cell."""
+    if value is None:
+        return "-"
+    if key == "online":
+        return "yes" if value else "no"
+    if key == "accrued_cost":
+        return f"{value:.2f}$"
+    if key == "hourly_rate":
+        return f"{value:.4f}$/h"
+    if key == "time_to_limit":
+        return "reached" if value == 0 else f"{value:.1f}h"
+    return str(value)
+
+
+def render_row(record: dict) -> str:
+    return " ".join(
+        format_value(key, record[key])[:width].ljust(width) for _, key, width in columns
+    )
+
+
+def render_header() -> str:
+    return " ".join(title.ljust(width) for title, _, width in columns)
+
+
+class FleetWatch:
+    """Redraws a table of the fleet in the terminal, rewriting only the rows that changed.
+
+    A running daemon is read instead of the providers. Otherwise only the VMs due according
+    to the FleetSchedule are asked for their state and probed for reachability, rates are
+    fetched again once a state changes and the accrued costs of all VMs come from the local
+    cost ledger.
+    """
+
+    def __init__(self, db: Database, out=sys.stdout, schedule: FleetSchedule = None):
+        self.db = db
+        self.out = out
+        self.schedule = schedule or FleetSchedule(minimum=5, maximum=60)
+        self._providers = ProviderCache()
+        self._hourly_rates = {}
+        # (state, online) of every VM as of its last poll
+        self._polled = {}
+        self._vms = []
+        self._lines = None
+
+    def fetch(self) -> list:
+        """Returns the current vm_record()s of the fleet, refreshing only the VMs that are due."""
+        fleet = query_fleet()
+        if fleet is not None:
+            self._vms = []
+            return fleet["vms"]
+        self._vms = self.db.read_vm(self._providers.read(self.db))
+        due = [vm for vms in self.schedule.due(self._vms).values() for vm in vms]
+        accrued_costs = refresh_costs(
+            self.db, due, self.db.read_accrued_costs(), self._hourly_rates
+        )
+        for vm, record in zip(due, probe_fleet(self.db, due, accrued_costs)):
+            seen = (record["state"], record["online"])
+            changed = self._polled.get(vm.get_vm_name()) != seen
+            self._polled[vm.get_vm_name()] = seen
+            self.schedule.polled(vm, record, changed)
+        return [
+            vm_record(
+                vm, accrued_costs, self._polled.get(vm.get_vm_name(), (None, False))[1]
+            )
+            for vm in self._vms
+        ]
+
+    def draw(self, records: list):
+        """Draws the table, rewriting only the rows that changed since the last draw."""
+        lines = [render_header()] + [render_row(record) for record in records]
+        if not self.out.isatty():
+            # Without a terminal only the changed rows are appended
+            changed = [
+                line
+                for i, line in enumerate(lines)
+                if self._lines is None or i >= len(self._lines) or self._lines[i] != line
+            ]
+            self.out.write("".join(line + "\n" for line in changed))
+        elif self._lines is None or len(lines) != len(self._lines):
+            # Clear the screen and draw the whole table
+            self.out.write("\x1b[H\x1b[2J" + "".join(line + "\n" for line in lines))
+        else:
+            for i, line in enumerate(lines):
+                if line != self._lines[i]:
+                    # Move to the row, clear it and rewrite it
+                    self.out.write(f"\x1b[{i + 1};1H\x1b[2K{line}")
+            self.out.write(f"\x1b[{len(lines) + 1};1H")
+        self.out.flush()
+        self._lines = lines
+
+    def run(self):
+        """Refreshes and redraws until interrupted."""
+        while True:
+            self.draw(self.fetch())
+            # Costs are extrapolated from the ledger, so the table is redrawn at least this often
+            time.sleep(
+                max(1, min(self.schedule.next_due(self._vms), self.schedule.minimum))
+            )
@@ -0,0 +1,100 @@
+# cost_chart.py
+#
+# Copyright 2024 Benedikt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from gi.repository import Gtk
+
+from .history import lttb
+
+# Points drawn per pixel of width, more are not visible anyway
+points_per_pixel = 0.5
+
+
+class CostChart(Gtk.DrawingArea):
+    """Draws the accrued cost over time as a line.
+
+    The series is downsampled to the chart's width once per width and series, so drawing
+    does not depend on how long the history is.
+    """
+
+    __gtype_name__ = "CloudsurgeCostChart"
+
+    def __init__(self, height: int = 120, **kwargs):
+        super().__init__(**kwargs)
+        self.set_content_height(height)
+        self.set_hexpand(True)
+        self.set_margin_top(6)
+        self.set_margin_bottom(6)
+        self.set_margin_start(12)
+        self.set_margin_end(12)
+        self.points = []
+        self.start = None
+        self.end = None
+        # (width, downsampled points) of the last draw
+        self._sampled = None
+        self.set_draw_func(self.draw)
+
+    def set_series(self, points, start=None, end=None):
+        """Shows points, (unix timestamp, cost) tuples, between start and end."""
+        self.points = points
+        self.start = start
+        self.end = end
+        self._sampled = None
+        self.queue_draw()
+
+    def get_sampled(self, width: int) -> list:
+        if self._sampled is None or self._sampled[0] != width:
+            self._sampled = (
+                width,
+                lttb(self.points, max(2, int(width * points_per_pixel))),
+            )
+        return self._sampled[1]
+
+    def draw(self, _, cr, width, height):
+        color = self.get_color()
+        cr.set_source_rgba(color.red, color.green, color.blue, 0.3)
+        cr.set_line_width(1)
+        cr.move_to(0, height - 0.5)
+        cr.line_to(width, height - 0.5)
+        cr.stroke()
+
+        points = self.get_sampled(width)
+        if len(points) < 2:
+            return
+        start = self.start if self.start is not None else points[0][0]
+        end = self.end if self.end is not None else points[-1][0]
+        low = min(y for _, y in points)
+        high = max(y for _, y in points)
+        x_scale = width / max(end - start, 1)
+        y_scale = (height - 16) / max(high - low, 1e-9)
+
+        cr.set_source_rgba(color.red, color.green, color.blue, 1)
+        cr.set_line_width(2)
+        for i, (x, y) in enumerate(points):
+            px = (x - start) * x_scale
+            py = height - 1 - (y - low) * y_scale
+            if i:
+                cr.line_to(px, py)
+            else:
+                cr.move_to(px, py)
+        cr.stroke()
+
+        cr.set_source_rgba(color.red, color.green, color.blue, 0.6)
+        cr.set_font_size(11)
+        cr.move_to(2, 11)
+        cr.show_text(f"{high:.2f}$")
@@ -0,0 +1,196 @@
+# fleet_list.py
+#
+# Copyright 2024 Benedikt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from gi.repository import Adw
+from gi.repository import Gio
+from gi.repository import GObject
+from gi.repository import Gtk
+
+
+class FleetItem(GObject.Object):
+    """A row of the machines or providers list, identified by its name."""
+
+    __gtype_name__ = "CloudsurgeFleetItem"
+
+    name = GObject.Property(type=str, default="")
+    subtitle = GObject.Property(type=str, default="")
+
+    def __init__(self, name, subtitle):
+        super().__init__(name=name, subtitle=subtitle)
+
+
+class VmItem(FleetItem):
+    """A VM of the machines list. The row follows its subtitle while it is bound."""
+
+    __gtype_name__ = "CloudsurgeVmItem"
+
+    def __init__(self, vm_name, public_ip):
+        super().__init__(vm_name, public_ip)
+        self.public_ip = public_ip
+        self.state = None
+        self.accrued_cost = None
+        self.online = None
+
+    def update(self, public_ip, state=None, accrued_cost=None, online=None):
+        self.public_ip = public_ip
+        self.state = state
+        self.accrued_cost = accrued_cost
+        self.online = online
+        subtitle = public_ip
+        if state:
+            subtitle += f" · {state}"
+        if accrued_cost is not None:
+            subtitle += f" · {accrued_cost:.2f}$"
+        if online is not None:
+            subtitle += " · online" if online else " · unreachable"
+        # Only a changed subtitle notifies the bound row
+        if subtitle != self.subtitle:
+            self.subtitle = subtitle
+
+
+class ProviderItem(FleetItem):
+    """A provider account of the providers list."""
+
+    __gtype_name__ = "CloudsurgeProviderItem"
+
+
+class FleetStore:
+    """A Gio.ListStore of FleetItems with lookups by name.
+
+    Args:
+        item_type (type): FleetItem subclass stored.
+    """
+
+    def __init__(self, item_type):
+        self.model = Gio.ListStore.new(item_type)
+        self._items = {}
+        # Names in the order of the model and the position of every name in it
+        self._order = []
+        self._positions = {}
+
+    def __contains__(self, name):
+        return name in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, name):
+        """Returns the item called name, or None."""
+        return self._items.get(name)
+
+    def names(self) -> list:
+        return list(self._items)
+
+    def add(self, items) -> None:
+        """Appends the items not stored yet, with a single change of the model."""
+        new_items = []
+        for item in items:
+            if item.name not in self._items:
+                self._items[item.name] = item
+                self._positions[item.name] = len(self._order)
+                self._order.append(item.name)
+                new_items.append(item)
+        if new_items:
+            self.model.splice(self.model.get_n_items(), 0, new_items)
+
+    def remove(self, name):
+        """Removes the item called name, returns it or None."""
+        item = self._items.get(name)
+        if item is not None:
+            self.remove_all([name])
+        return item
+
+    def remove_all(self, names) -> None:
+        """Removes the items called names, with one change of the model per run of adjacent items."""
+        positions = sorted(
+            self._positions[name] for name in set(names) if name in self._items
+        )
+        if not positions:
+            return
+        # Runs of adjacent positions as [start, end), removed from the back so the
+        # positions in front stay valid
+        runs = []
+        for position in positions:
+            if runs and runs[-1][1] == position:
+                runs[-1][1] = position + 1
+            else:
+                runs.append([position, position + 1])
+        for start, end in reversed(runs):
+            self.model.splice(start, end - start, [])
+            for name in self._order[start:end]:
+                del self._items[name]
+                del self._positions[name]
+            del self._order[start:end]
+        # Only the items behind the first removed one moved
+        for position in range(positions[0], len(self._order)):
+            self._positions[self._order[position]] = position
+
+
+def fleet_list_factory(on_settings_clicked) -> Gtk.ListItemFactory:
+    """Returns a factory of recycled rows for FleetItems.
+
+    Args:
+        on_settings_clicked (callable): Called with (button, item name) when the settings button
+            of a row is clicked.
+    """
+    factory = Gtk.SignalListItemFactory()
+    # Property bindings by row, released when a row is recycled for another item
+    bindings = {}
+
+    def setup(_, list_item):
+        row = Adw.ActionRow()
+
+        # Create the button and add the desired child elements
+        button = Gtk.Button()
+        button.connect(
+            "clicked",
+            lambda button: on_settings_clicked(button, list_item.get_item().name),
+        )
+
+        # Define the Box to hold the child widget, with appropriate spacing
+        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        box.append(Gtk.Image(icon_name="applications-system-symbolic"))
+        button.set_child(box)
+
+        row.add_suffix(button)
+        list_item.set_child(row)
+        list_item.set_activatable(False)
+
+    def bind(_, list_item):
+        item = list_item.get_item()
+        row = list_item.get_child()
+        bindings[row] = [
+            item.bind_property("name", row, "title", GObject.BindingFlags.SYNC_CREATE),
+            item.bind_property(
+                "subtitle", row, "subtitle", GObject.BindingFlags.SYNC_CREATE
+            ),
+        ]
+
+    def unbind(_, list_item):
+        for binding in bindings.pop(list_item.get_child(), []):
+            binding.unbind()
+
+    def teardown(_, list_item):
+        bindings.pop(list_item.get_child(), None)
+
+    factory.connect("setup", setup)
+    factory.connect("bind", bind)
+    factory.connect("unbind", unbind)
+    factory.connect("teardown", teardown)
+    return factory
@@ -0,0 +1,185 @@
+# fleet_poller.py
+#
+# Copyright 2024 Benedikt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import threading
+
+from gi.repository import GLib
+
+from .changes import ledger_record
+from .fleet import refresh_costs
+from .schedule import FleetSchedule
+
+# Seconds a VM's reachability stays fresh enough not to probe it again
+reachability_ttl = 60
+
+
+class FleetPoller:
+    """Polls the fleet in the background while the window is shown and focused.
+
+    A single GLib timeout fires when the next VM is due (see FleetSchedule). The due VMs are
+    polled by account, each account has at most one poll in flight.
+    """
+
+    def __init__(self, window, schedule: FleetSchedule = None):
+        self.window = window
+        self.schedule = schedule or FleetSchedule()
+        self._source = None
+        # Accounts with a poll in flight, only touched in the main loop
+        self._in_flight = set()
+        # VMs with a refresh (refresh_vm()) in flight
+        self._vms_in_flight = set()
+
+        for prop in ("is-active", "visible", "suspended"):
+            window.connect(f"notify::{prop}", self.on_window_state)
+
+    def is_active(self) -> bool:
+        return (
+            self.window.get_visible()
+            and self.window.is_active()
+            and not self.window.is_suspended()
+        )
+
+    def on_window_state(self, *_):
+        if self.is_active():
+            # Whatever became due while paused is polled at once
+            self.arm(0)
+        else:
+            self.disarm()
+
+    def arm(self, delay: float):
+        self.disarm()
+        self._source = GLib.timeout_add(int(delay * 1000), self.tick)
+
+    def disarm(self):
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
+
+    def poll_soon(self, vm_names):
+        """Polls VMs as soon as possible, e.g. after the user acted on them."""
+        self.schedule.poll_soon(vm_names)
+        if self.is_active():
+            self.arm(0)
+
+    def tick(self):
+        self._source = None
+        if not self.is_active():
+            return GLib.SOURCE_REMOVE
+
+        fleet = list(self.window.vms)
+        # VMs busy with a lifecycle action are confirmed by its waiter
+        idle = [
+            vm for vm in fleet if vm.get_vm_name() not in self.window.lifecycle_actions
+        ]
+        # A refresh of the cost page already covers every account
+        if self.window.cost_refresh is None:
+            for account_name, vms in self.schedule.due(idle).items():
+                if account_name in self._in_flight:
+                    continue
+                self._in_flight.add(account_name)
+                thread = threading.Thread(
+                    target=self.poll, args=(account_name, vms, fleet), daemon=True
+                )
+                thread.start()
+
+        # Accounts still in flight are due again, they are retried once their poll is done
+        waiting = [
+            vm
+            for vm in idle
+            if vm.get_provider().get_account_name() not in self._in_flight
+        ]
+        self.arm(max(1, self.schedule.next_due(waiting)))
+        return GLib.SOURCE_REMOVE
+
+    def on_result(self, vm, entry):
+        """Publishes the refreshed ledger entry of a VM and schedules its next poll.
+
+        Called in worker threads, by polls as well as by refreshes of the cost page.
+        """
+        deltas = self.window.fleet_changes.update(
+            [ledger_record(vm, entry)], complete=False
+        )
+        changed = any({"state", "online"}.intersection(d["fields"]) for d in deltas)
+        self.schedule.polled(
+            vm, self.window.fleet_changes.get_record(vm.get_vm_name()), changed
+        )
+
+    def poll(self, account_name, vms, fleet):
+        """Polls the VMs of an account in a worker thread, fleet are all VMs of the window."""
+        try:
+            if not self.window.apply_daemon_changes(fleet):
+                refresh_costs(
+                    self.window.db,
+                    vms,
+                    self.window.db.read_accrued_costs(),
+                    self.window.hourly_rates,
+                    on_result=self.on_result,
+                )
+        except Exception as e:
+            print(f"Error polling '{account_name}': {e}")
+        finally:
+            # VMs without a result (no billing provider, an error or a daemon) back off as well
+            for vm in vms:
+                if self.schedule.next_due([vm]) == 0:
+                    self.schedule.polled(
+                        vm, self.window.fleet_changes.get_record(vm.get_vm_name()), False
+                    )
+            GLib.idle_add(self.on_polled, account_name)
+
+    def on_polled(self, account_name):
+        self._in_flight.discard(account_name)
+        if self.is_active():
+            self.arm(max(1, self.schedule.next_due(self.window.vms)))
+
+    def refresh_vm(self, vm):
+        """Refreshes the status of a single VM in the background, e.g. for its settings dialog.
+
+        Refreshes of the same VM are coalesced and its reachability is only probed again once
+        the last probe is older than reachability_ttl.
+        """
+        if vm.get_vm_name() in self._vms_in_flight:
+            return
+        self._vms_in_flight.add(vm.get_vm_name())
+        thread = threading.Thread(target=self.poll_vm, args=(vm,), daemon=True)
+        thread.start()
+
+    def poll_vm(self, vm):
+        try:
+            age = self.window.fleet_changes.get_age(vm.get_vm_name(), "online")
+            if age is None or age > reachability_ttl:
+                self.window.fleet_changes.update(
+                    [dict(ledger_record(vm, None), online=bool(vm.is_reachable()))],
+                    complete=False,
+                )
+            # The state is as fresh as the fastest poll, or a refresh of the cost page covers it
+            age = self.window.fleet_changes.get_age(vm.get_vm_name(), "state")
+            if self.window.cost_refresh is None and (
+                age is None or age > self.schedule.minimum
+            ):
+                refresh_costs(
+                    self.window.db,
+                    [vm],
+                    self.window.db.read_accrued_costs(),
+                    self.window.hourly_rates,
+                    on_result=self.on_result,
+                )
+        except Exception as e:
+            print(f"Error refreshing '{vm.get_vm_name()}': {e}")
+        finally:
+            GLib.idle_add(self._vms_in_flight.discard, vm.get_vm_name())
@@ -17,15 +17,24 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
-import os
+import json
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import gi
-import requests
-import subprocess
 
 from .reached_cost_limits import get_reached_cost_limits
-from .server_is_active import get_active_servers
+from .server_is_active import get_active_servers, is_reachable
+from .status import print_status, summarize_status
+from .cli import lock_gui
+from .daemon import query_fleet
+from .fleet import refresh_workers, vm_record
+from .changes import ledger_record
+from .spans import span
 from .db import Database
+from .jobs import JobQueue
+from .script import fetch_script
+from .snapshot import build_snapshot, load_snapshot, save_snapshot
 import webbrowser
 
 gi.require_version("Gtk", "4.0")
@@ -33,6 +42,7 @@ gi.require_version("Adw", "1")
 
 from gi.repository import Gtk, Gio, Adw, GLib
 from .window import CloudsurgeWindow
+from .fleet_poller import reachability_ttl
 from .new import NewView
 
 
@@ -53,13 +63,18 @@ class CloudsurgeApplication(Adw.Application):
             flags=Gio.ApplicationFlags.HANDLES_COMMAND_LINE,
         )
 
-        get_cloudsurge_script()
-
-        self.db = Database()
+        # Shared with the window's worker threads, so writes go through the writer thread
+        self.db = Database(threaded=True)
         self.db.init()
+        self.connect("shutdown", lambda *_: self.db.close())
 
-        self.providers = self.db.read_provider()
-        self.vms = self.db.read_vm(self.providers)
+        # Filled in place by load_backend(), the window holds the same lists
+        self.providers = []
+        self.vms = []
+        self.backend_loaded = threading.Event()
+        # Set once the CloudSurge script is in place (or could not be), jobs provisioning VMs need it
+        self.script_ready = threading.Event()
+        self.gui_lock = None
 
         # prov = self.db.read_provider()
         # vm = self.db.read_vm(prov)
@@ -93,19 +108,116 @@ class CloudsurgeApplication(Adw.Application):
             ("Shows the count of the currently online VMs"),
             None,
         )
+        self.add_main_option(
+            "status",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.NONE,
+            ("Prints the cost limit overruns and the online count as one JSON document"),
+            None,
+        )
 
     def do_command_line(self, command):
         commands = command.get_options_dict()
-        if commands.contains("costs"):
-            get_reached_cost_limits()
-            quit()
-        if commands.contains("online"):
-            get_active_servers()
+        for report in ("costs", "online", "status"):
+            if not commands.contains(report):
+                continue
+            if command.get_is_remote():
+                # Answered by this (primary) instance, which already has everything loaded
+                self.answer_command_line(command, report)
+                return 0
+            if report == "costs":
+                get_reached_cost_limits(self.db)
+            elif report == "online":
+                get_active_servers(self.db)
+            else:
+                print_status(self.db)
             quit()
 
         self.do_activate()
         return 0
 
+    def answer_command_line(self, command, report):
+        """Answers a report of a remote invocation from the loaded providers and VMs.
+
+        The report is built in a worker thread, the remote invocation waits until the
+        command line object is done. It always finishes, with exit status 1 on errors.
+        """
+
+        def build_report():
+            output, status = "", 1
+            try:
+                output, status = render_report(), 0
+            except Exception as e:
+                print(f"Could not answer '--{report}': {e}")
+            finally:
+                GLib.idle_add(finish, output, status)
+
+        def get_reachability(vms) -> dict:
+            """Returns whether each VM is online, from the freshest data there is."""
+            window = getattr(self, "main_window", None)
+            # A running daemon knows the whole fleet
+            fleet = query_fleet()
+            if fleet:
+                online = {r["vm_name"]: r["online"] for r in fleet["vms"]}
+            else:
+                online = {}
+                # What the window checked recently is still good
+                for vm in vms if window else ():
+                    age = window.fleet_changes.get_age(vm.get_vm_name(), "online")
+                    if age is not None and age <= reachability_ttl:
+                        online[vm.get_vm_name()] = window.fleet_changes.get_record(
+                            vm.get_vm_name()
+                        ).get("online")
+
+            # Only the rest is probed, in parallel, and shown by the window as well
+            stale = [vm for vm in vms if online.get(vm.get_vm_name()) is None]
+            if stale:
+                with ThreadPoolExecutor(refresh_workers) as executor:
+                    for vm, reachable in zip(stale, executor.map(is_reachable, stale)):
+                        online[vm.get_vm_name()] = bool(reachable)
+                if window:
+                    window.fleet_changes.update(
+                        [
+                            dict(ledger_record(vm, None), online=online[vm.get_vm_name()])
+                            for vm in stale
+                        ],
+                        complete=False,
+                    )
+            return online
+
+        def render_report() -> str:
+            self.backend_loaded.wait(60)
+            accrued_costs = self.db.read_accrued_costs()
+            vms = list(self.vms)
+            online = get_reachability(vms) if report != "costs" else {}
+            records = [
+                vm_record(vm, accrued_costs, online.get(vm.get_vm_name()))
+                for vm in vms
+            ]
+
+            if report == "costs":
+                output = "".join(
+                    f"{r['provider']};{r['vm_name']};{r['cost_limit']};{r['exceeded_by']}\n"
+                    for r in records
+                    if r["exceeded_by"] is not None
+                )
+            elif report == "online":
+                output = f"{sum(1 for r in records if r['online'])}\n"
+            else:
+                output = json.dumps(summarize_status(records)) + "\n"
+            return output
+
+        def finish(output, status):
+            command.print_literal(output)
+            command.set_exit_status(status)
+            command.done()
+            self.release()
+
+        # Keep the application alive while the report is built
+        self.hold()
+        threading.Thread(target=build_report, daemon=True).start()
+
     def do_activate(self):
         """Called when the application is activated.
 
@@ -114,12 +226,21 @@ class CloudsurgeApplication(Adw.Application):
         """
         win = self.props.active_window
         if not win:
+            # Render the last known fleet right away, the backend is loaded in the background
             win = CloudsurgeWindow(
-                self.db, self.vms, self.providers, application=self
+                self.db,
+                self.vms,
+                self.providers,
+                snapshot=load_snapshot(),
+                application=self,
             )
             self.main_listbox = (
                 win.get_content().get_content().get_first_child()
             )
+            threading.Thread(target=self.load_backend, daemon=True).start()
+            threading.Thread(target=self.update_script, daemon=True).start()
+            # Lets cloudsurge -c/-o/--status be forwarded to this instance
+            self.gui_lock = lock_gui()
         win.present()
         self.main_window = win
         self.main_window.app = self
@@ -128,6 +249,42 @@ class CloudsurgeApplication(Adw.Application):
         if zerotier_id:
             self.main_window.zerotier_id.set_title("current: " + zerotier_id)
 
+    def update_script(self):
+        """Updates the CloudSurge script in the background, falling back to the bundled one."""
+        try:
+            with span("script.fetch"):
+                fetch_script()
+        except Exception as e:
+            print(f"Could not update the CloudSurge script: {e}")
+        finally:
+            self.script_ready.set()
+
+    def load_backend(self):
+        """Constructs all provider clients without blocking the window."""
+        with span("backend.load"):
+            providers = self.db.read_provider()
+            vms = self.db.read_vm(providers)
+            accrued_costs = self.db.read_accrued_costs()
+        GLib.idle_add(self.on_backend_loaded, providers, vms, accrued_costs)
+
+        self.resume_jobs()
+
+    def on_backend_loaded(self, providers, vms, accrued_costs):
+        self.providers[:] = providers
+        self.vms[:] = vms
+        self.backend_loaded.set()
+        self.main_window.sync_with_backend(accrued_costs)
+        save_snapshot(build_snapshot(providers, vms, accrued_costs))
+
+    def resume_jobs(self):
+        """Rolls back or resumes jobs interrupted by a previous run, then runs all queued jobs."""
+        job_queue = JobQueue(self.db)
+        job_queue.recover()
+        # Resumed jobs may install the script on a VM, fetch_script() gives up on its own timeout
+        self.script_ready.wait()
+        for job, result in job_queue.drain():
+            GLib.idle_add(self.main_window.on_job_finished, job, result)
+
     def on_about_action(self, *args):
         """Callback for the app.about action."""
         about = Adw.AboutDialog(
@@ -191,27 +348,6 @@ class CloudsurgeApplication(Adw.Application):
         webbrowser.open_new_tab("https://github.com/TechTowers")
 
 
-def get_cloudsurge_script():
-    """Retrieves the CloudSurge script from the GitHub repository and saves it to the local filesystem."""
-    file_path = os.path.expandvars("$XDG_DATA_HOME/cloudsurge.sh")
-    url = "https://raw.githubusercontent.com/TechTowers/CloudSurge/refs/heads/main/scripts/cloudsurge.sh"
-
-    r = requests.get(url, stream=True)
-    if r.ok:
-        with open(file_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 8):
-                if chunk:
-                    f.write(chunk)
-                    f.flush()
-                    os.fsync(f.fileno())
-    else:  # HTTP status code 4XX/5XX
-        print(
-            "Download failed: status code {}\n{}".format(r.status_code, r.text)
-        )
-
-    _ = subprocess.call(["chmod", "+x", file_path])
-
-
 def main(version):
     """The application's entry point."""
     app = CloudsurgeApplication()
@@ -20,15 +20,12 @@ from gi.repository import Adw
 from gi.repository import Gtk
 
 from datetime import date
-from time import sleep
 
 from .error_window import ErrorWindow
 from .vm import VirtualMachine
 from .no_provider import NoProvider
-from .db import Database
-from .aws_provider import AWS
-from .digitalocean_provider import DigitalOcean
 from .wait_popup_window import WaitPopupWindow
+from .jobs import JobQueue, vm_to_record
 
 
 @Gtk.Template(resource_path="/org/techtowers/CloudSurge/blueprints/new.ui")
@@ -173,8 +170,10 @@ class NewView(Adw.Window):
         self.show_popup_window(submit_block)
 
     def process_provider_input(self, pop_up_window) -> bool:
-        db = Database()
-        db.init()
+        from .aws_provider import AWS
+        from .digitalocean_provider import DigitalOcean
+
+        db = self.db
         provider: str = self.provider_dropdown.get_selected_item().get_string()
         acc_name = self.account_name.get_text()
         all_providers = db.read_provider()
@@ -235,26 +234,14 @@ class NewView(Adw.Window):
         dialog.app = self.app
         dialog.present()
 
-    def add_vm(self, vm, db):
+    def add_vm(self, vm):
+        """Shows a VM that was created and provisioned by a job."""
         if vm is None:
             print("Error Creating VM")
             return
-        for i in range(10):
-            if i == 9:
-                raise ValueError("Could not reach VM")
-            elif vm.is_reachable():
-                print("Starting Install..")
-                vm.install_vm()
-                print("Starting Configuring..")
-                vm.configure_vm()
-                print("Finished Configuring")
-                break
-            else:
-                sleep(2)
 
         self.window.add_vm_to_gui(vm)
         self.vms.append(vm)
-        db.insert_vm(vm)
         self.close()
 
     def show_error_window(self, exception, pop_up_window):
@@ -268,8 +255,7 @@ class NewView(Adw.Window):
         print("showing error")
 
     def process_machine_input(self, pop_up_window):
-        db = Database()
-        db.init()
+        db = self.db
         selected_provider = (
             self.vm_provider_dropdown.get_selected_item().get_string()
         )
@@ -311,11 +297,10 @@ class NewView(Adw.Window):
                     zerotier_network=zerotier_network,
                     ssh_key=ssh_key,
                 )
-                self.add_vm(vm, db)
+                vm = JobQueue(db).submit("provision_vm", vm_to_record(vm))
+                self.add_vm(vm)
             except Exception as e:
                 self.show_error_window(e, pop_up_window)
-                if vm:
-                    vm.get_provider().delete_vm(vm)
         else:
             found_provider = None
             for prov_connection in self.providers:
@@ -335,33 +320,26 @@ class NewView(Adw.Window):
                         ValueError("ZeroTier-ID not set"), pop_up_window
                     )
                     return False
+                create_args = {
+                    "vm_name": vm_name,
+                    "aws_ssh_key_name": aws_ssh_key_name,
+                    "zerotier_network": zerotier_network,
+                    "cost_limit": cost_limit,
+                }
                 if len(ssh_key) != 0:
-                    try:
-                        vm = found_provider.create_vm(
-                            vm_name=vm_name,
-                            aws_ssh_key_name=aws_ssh_key_name,
-                            zerotier_network=zerotier_network,
-                            cost_limit=cost_limit,
-                            ssh_key_path=ssh_key,
-                        )
-                        self.add_vm(vm, db)
-                    except Exception as e:
-                        self.show_error_window(e, pop_up_window)
-                        if vm:
-                            vm.get_provider().delete_vm(vm)
-                else:
-                    try:
-                        vm = found_provider.create_vm(
-                            vm_name=vm_name,
-                            aws_ssh_key_name=aws_ssh_key_name,
-                            zerotier_network=zerotier_network,
-                            cost_limit=cost_limit,
-                        )
-                        self.add_vm(vm, db)
-                    except Exception as e:
-                        self.show_error_window(e, pop_up_window)
-                        if vm:
-                            vm.get_provider().delete_vm(vm)
+                    create_args["ssh_key_path"] = ssh_key
+                # An instance left behind by a failed creation is terminated by the job
+                try:
+                    vm = JobQueue(db).submit(
+                        "create_vm",
+                        {
+                            "provider": found_provider.get_account_name(),
+                            "create_args": create_args,
+                        },
+                    )
+                    self.add_vm(vm)
+                except Exception as e:
+                    self.show_error_window(e, pop_up_window)
 
             elif found_provider.get_provider_name() == "DigitalOcean":
                 print("Creating VM using DigitalOcean")
@@ -374,13 +352,19 @@ class NewView(Adw.Window):
                     return False
 
                 try:
-                    vm = found_provider.create_vm(
-                        vm_name=vm_name,
-                        ssh_key_ids=ssh_key_ids,
-                        zerotier_network=zerotier_network,
-                        cost_limit=cost_limit,
-                        ssh_key_path=ssh_key,
+                    vm = JobQueue(db).submit(
+                        "create_vm",
+                        {
+                            "provider": found_provider.get_account_name(),
+                            "create_args": {
+                                "vm_name": vm_name,
+                                "ssh_key_ids": ssh_key_ids,
+                                "zerotier_network": zerotier_network,
+                                "cost_limit": cost_limit,
+                                "ssh_key_path": ssh_key,
+                            },
+                        },
                     )
-                    self.add_vm(vm, db)
+                    self.add_vm(vm)
                 except Exception as e:
                     self.show_error_window(e, pop_up_window)
@@ -17,10 +17,17 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import threading
+
 from gi.repository import Adw
+from gi.repository import GLib
 from gi.repository import Gtk
 
+from .changes import ledger_record
 from .db import Database
+from .error_window import ErrorWindow
+from .jobs import JobQueue
+from .lifecycle import lifecycle_actions
 
 # import backend.db
 from .vm import Provider
@@ -32,12 +39,14 @@ from .vm import Provider
 class ProviderSettingsWindow(Adw.Window):
     __gtype_name__ = "ProviderSettingsWindow"
     delete_machine = Gtk.Template.Child()
+    delete_progress_row = Gtk.Template.Child()
+    delete_progress = Gtk.Template.Child()
 
 
-    def __init__(self, provider: Provider, provider_gui_widget, db: Database, window, all_vms, providers, **kwargs):
+    def __init__(self, provider: Provider, provider_item, db: Database, window, all_vms, providers, **kwargs):
         self.provider = provider
         self.providers = providers
-        self.provider_gui_widget = provider_gui_widget
+        self.provider_item = provider_item
         self.db = db
         self.window = window
         self.all_vms = all_vms
@@ -46,22 +55,64 @@ class ProviderSettingsWindow(Adw.Window):
         self.delete_machine.connect("activated", self.delete_provider)
 
     def delete_provider(self, _):
-        self.db.delete_provider(self.provider)
-        self.window.providers_list.remove(self.provider_gui_widget)
-        self.providers.remove(self.provider)
-        print("Deleted provider " + self.provider.get_account_name())
+        print("Trying to delete provider and associated VMs:")
+        self.delete_machine.set_sensitive(False)
+        self.delete_progress_row.set_visible(True)
+
+        # The rows show the teardown and are left alone by the poller meanwhile
+        vms = [
+            vm
+            for vm in self.all_vms
+            if vm.get_provider().get_account_name() == self.provider.get_account_name()
+        ]
+        for vm in vms:
+            self.window.lifecycle_actions[vm.get_vm_name()] = "delete"
+        self.window.fleet_changes.update(
+            [
+                dict(ledger_record(vm, None), state=lifecycle_actions["delete"][1])
+                for vm in vms
+            ],
+            complete=False,
+            checked=False,
+        )
+
+        thread = threading.Thread(target=self.run_teardown, args=(vms,), daemon=True)
+        thread.start()
 
-        print("Trying to delete associated VMs:")
-        for vm in self.all_vms:
-            print(vm.get_provider().get_account_name())
-            if vm.get_provider().get_account_name() == self.provider.get_account_name():
-                # VM Found
-                try:
-                    vm.get_provider().delete_vm(vm, self.db)
-                    self.all_vms.remove(vm)
-                    for gui_vm in self.window.machines_list:
-                        if gui_vm.get_title() == vm.get_vm_name():
-                            self.window.machines_list.remove(gui_vm)
-                except Exception as e:
-                    print("VM Could not be deleted:" + f'{e}')
+    def run_teardown(self, vms):
+        """Runs the teardown job in a worker thread."""
+        try:
+            # The job resumes the teardown on the next start if it gets interrupted
+            JobQueue(self.db).submit(
+                "delete_provider",
+                {"provider": self.provider.get_account_name()},
+                on_progress=lambda job, message, done, total: GLib.idle_add(
+                    self.on_teardown_progress, message, done, total
+                ),
+            )
+        except Exception as e:
+            print("Provider Could not be deleted:" + f"{e}")
+            GLib.idle_add(self.on_teardown_finished, vms, str(e))
+            return
+        GLib.idle_add(self.on_teardown_finished, vms, None)
+
+    def on_teardown_progress(self, message, done, total):
+        self.delete_progress_row.set_subtitle(message)
+        self.delete_progress.set_fraction(done / total if total else 0)
+
+    def on_teardown_finished(self, vms, error):
+        for vm in vms:
+            self.window.lifecycle_actions.pop(vm.get_vm_name(), None)
+        if error is not None:
+            self.delete_machine.set_sensitive(True)
+            self.delete_progress_row.set_visible(False)
+            self.window.poller.poll_soon([vm.get_vm_name() for vm in vms])
+            dialog = ErrorWindow(
+                f"Could not delete provider '{self.provider.get_account_name()}': {error}",
+                self.window,
+            )
+            dialog.present()
+            return
+        self.window.remove_provider_from_gui(self.provider)
+        print("Deleted provider " + self.provider.get_account_name())
         self.close()
\ No newline at end of file
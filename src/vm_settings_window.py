@@ -17,10 +17,15 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import threading
+import time
+
 from gi.repository import Adw
+from gi.repository import GLib
 from gi.repository import Gtk
+from .cost_chart import CostChart
+from .history import read_cost_history
 from .wait_popup_window import WaitPopupWindow
-import threading
 
 
 # import backend.db
@@ -39,11 +44,15 @@ class VmSettingsWindow(Adw.Window):
     curr_cost = Gtk.Template.Child()
     cost_limit = Gtk.Template.Child()
     provider_acc = Gtk.Template.Child()
+    cost_history = Gtk.Template.Child()
 
-    def __init__(self, vm, vm_gui_widget, db, window, all_vms, **kwargs):
+    # Seconds of cost history shown
+    history_range = 30 * 86400
+
+    def __init__(self, vm, vm_item, db, window, all_vms, **kwargs):
         self.vm = vm
         self.all_vms = all_vms
-        self.vm_gui_widget = vm_gui_widget
+        self.vm_item = vm_item
         self.db = db
         self.window = window
         super().__init__(**kwargs)
@@ -53,40 +62,77 @@ class VmSettingsWindow(Adw.Window):
         self.delete_machine.connect("activated", self.delete_vm)
         self.update_machine.connect("activated", self.update_vm)
 
-        thread_values = threading.Thread(
-            target=self.update_vm_value, args=(vm,)
-        )
-        thread_values.start()
-
-        thread_running = threading.Thread(target=self.update_state, args=(vm,))
-        thread_running.start()
-
-    def update_state(self, vm):
-        if vm.is_reachable():
-            self.set_title("Running")
-        else:
-            self.set_title("Unreachable")
-
-    def update_vm_value(self, vm):
         self.provider_acc.set_title(vm.get_provider().get_account_name())
         self.provider_acc.set_subtitle("Linked Provider Account")
         self.cost_limit.set_title(f"{vm.get_cost_limit()}$")
         self.cost_limit.set_subtitle("Cost Limit")
-        self.curr_cost.set_title(f"{vm.get_provider().get_vm_cost(vm):.2f}$")
-        self.curr_cost.set_subtitle("Current Cost")
+
+        # Shown at once from the window's latest status, then kept up to date while open
+        self.render_status()
+        self.window.fleet_changes.add_listener(self.on_fleet_changes)
+        self.connect("close-request", self.on_close_request)
+        self.window.poller.refresh_vm(vm)
+
+        self.cost_chart = CostChart()
+        self.cost_history.add_row(self.cost_chart)
+        thread = threading.Thread(target=self.load_history, daemon=True)
+        thread.start()
+
+    def load_history(self):
+        try:
+            history = read_cost_history(
+                self.db, [self.vm], time.time() - self.history_range
+            )
+        except Exception as e:
+            print(f"Error reading the cost history: {e}")
+            return
+        GLib.idle_add(self.show_history, history)
+
+    def show_history(self, history):
+        self.cost_chart.set_series(
+            history["vms"].get(self.vm.get_vm_name(), []),
+            history["start"],
+            history["now"],
+        )
+        projected = history["projected_vms"].get(self.vm.get_vm_name(), 0)
+        self.cost_history.set_subtitle(f"Projected month-end cost: {projected:.2f}$")
+
+    def on_fleet_changes(self, deltas):
+        if any(delta["vm_name"] == self.vm.get_vm_name() for delta in deltas):
+            GLib.idle_add(self.render_status)
+
+    def on_close_request(self, _):
+        self.window.fleet_changes.remove_listener(self.on_fleet_changes)
+        return False
+
+    def render_status(self):
+        fleet_changes = self.window.fleet_changes
+        record = fleet_changes.get_record(self.vm.get_vm_name())
+
+        online = record.get("online")
+        if online is not None:
+            title = "Running" if online else "Unreachable"
+            age = fleet_changes.get_age(self.vm.get_vm_name(), "online")
+            self.set_title(f"{title} ({format_age(age)})" if age is not None else title)
+
+        cost = record.get("accrued_cost")
+        if cost is not None:
+            self.curr_cost.set_title(f"{cost:.2f}$")
+            age = fleet_changes.get_age(self.vm.get_vm_name(), "accrued_cost")
+            self.curr_cost.set_subtitle(
+                f"Current Cost · {format_age(age)}" if age is not None else "Current Cost"
+            )
 
     def start_vm(self, _):
-        self.vm.get_provider().start_vm(self.vm)
+        self.window.run_lifecycle_action(self.vm, "start")
         self.close()
 
     def stop_vm(self, _):
-        self.vm.get_provider().stop_vm(self.vm)
+        self.window.run_lifecycle_action(self.vm, "stop")
         self.close()
 
     def delete_vm(self, _):
-        self.vm.get_provider().delete_vm(self.vm, self.db)
-        self.all_vms.remove(self.vm)
-        self.window.machines_list.remove(self.vm_gui_widget)
+        self.window.run_lifecycle_action(self.vm, "delete")
         self.close()
 
     def update_vm(self, _):
@@ -101,3 +147,12 @@ class VmSettingsWindow(Adw.Window):
         dialog = WaitPopupWindow(action)
         dialog.app = self.app
         dialog.present()
+
+
+def format_age(seconds) -> str:
+    """Returns how long ago something was checked, e.g. "2 min ago"."""
+    if seconds < 60:
+        return "just now"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} min ago"
+    return f"{int(seconds // 3600)} h ago"
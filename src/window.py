@@ -18,17 +18,33 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import threading
+import time
 
 from gi.repository import Adw
+from gi.repository import GLib
 from gi.repository import Gtk
 
+from .changes import CostTotals, FleetChanges, ledger_record
+from .cost_chart import CostChart
+from .daemon import query_changes
 from .db import Database
+from .error_window import ErrorWindow
+from .fleet import refresh_costs
+from .fleet_list import FleetStore, ProviderItem, VmItem, fleet_list_factory
+from .fleet_poller import FleetPoller
+from .history import read_cost_history
+from .lifecycle import lifecycle_actions, perform_action, perform_bulk_action
+from .snapshot import build_snapshot, save_snapshot
 
 # import backend.db
 from .vm_settings_window import VmSettingsWindow
 from .provider_settings_window import ProviderSettingsWindow
 
 
+# Seconds shown by the history charts, by entry of the range selector (None for all)
+cost_ranges = (86400, 7 * 86400, 30 * 86400, 90 * 86400, None)
+
+
 @Gtk.Template(resource_path="/org/techtowers/CloudSurge/blueprints/window.ui")
 class CloudsurgeWindow(Adw.ApplicationWindow):
     __gtype_name__ = "CloudsurgeWindow"
@@ -51,6 +67,12 @@ class CloudsurgeWindow(Adw.ApplicationWindow):
     providers_window = Gtk.Template.Child()
     machines_list = Gtk.Template.Child()
     machines_window = Gtk.Template.Child()
+    bulk_bar = Gtk.Template.Child()
+    bulk_label = Gtk.Template.Child()
+    bulk_start_button = Gtk.Template.Child()
+    bulk_stop_button = Gtk.Template.Child()
+    bulk_configure_button = Gtk.Template.Child()
+    bulk_delete_button = Gtk.Template.Child()
     cost_window = Gtk.Template.Child()
 
     # vm_settings_button = Gtk.Template.Child()
@@ -62,18 +84,71 @@ class CloudsurgeWindow(Adw.ApplicationWindow):
     do_totalcost = Gtk.Template.Child()
     do_avgcost = Gtk.Template.Child()
     do_estcost = Gtk.Template.Child()
+    cost_range = Gtk.Template.Child()
 
-    def __init__(self, db, vms, providers, **kwargs):
+    def __init__(self, db, vms, providers, snapshot=None, **kwargs):
         super().__init__(**kwargs)
         # self.providers_button.set_active(True)
 
         self.vms = vms
         self.providers = providers
-        for provider in self.providers:
-            self.add_provider_to_gui(provider)
-        for vm in self.vms:
-            self.add_vm_to_gui(vm)
+        # List items by VM name / account name, they can exist before the objects are loaded
+        self.vm_store = FleetStore(VmItem)
+        self.provider_store = FleetStore(ProviderItem)
+        self.vm_selection = Gtk.MultiSelection.new(self.vm_store.model)
+        self.vm_selection.connect("selection-changed", self.on_vm_selection_changed)
+        self.machines_list.set_model(self.vm_selection)
+        self.machines_list.set_factory(
+            fleet_list_factory(self.show_vm_settings_window)
+        )
+        self.providers_list.set_model(Gtk.NoSelection.new(self.provider_store.model))
+        self.providers_list.set_factory(
+            fleet_list_factory(self.show_provider_settings_window)
+        )
+        if snapshot:
+            self.show_snapshot(snapshot)
+        self.provider_store.add(
+            ProviderItem(p.get_account_name(), p.get_provider_name())
+            for p in self.providers
+        )
+        self.vm_store.add(
+            VmItem(vm.get_vm_name(), str(vm.get_public_ip())) for vm in self.vms
+        )
         self.db = db
+        # Rows and cost labels are patched by the deltas of these changes, never rebuilt
+        self.fleet_changes = FleetChanges()
+        self.fleet_changes.add_listener(
+            lambda deltas: GLib.idle_add(self.apply_changes, deltas)
+        )
+        self.cost_totals = CostTotals()
+        # Version of the daemon's changes last applied
+        self.daemon_version = 0
+        # Hourly rates by VM name, kept across cost refreshes
+        self.hourly_rates = {}
+        # The cost refresh in flight (a threading.Event cancelling it), None while idle
+        self.cost_refresh = None
+        self.cost_refresh_pending = False
+        # Cost over time by provider name, in the expander of the provider
+        self.cost_charts = {"AWS": CostChart(), "DigitalOcean": CostChart()}
+        self.aws_totalcost.add_row(self.cost_charts["AWS"])
+        self.do_totalcost.add_row(self.cost_charts["DigitalOcean"])
+        # Only the history read last is shown, earlier reads still in flight are dropped
+        self.history_generation = 0
+        self.cost_range.connect("notify::selected", lambda *_: self.refresh_history())
+        self.connect("close-request", self.on_close_request)
+        self.poller = FleetPoller(self)
+        # Lifecycle action in flight by VM name
+        self.lifecycle_actions = {}
+        # Progress of the bulk action in flight: [done, failed, total], None while idle
+        self.bulk_progress = None
+        self.bulk_buttons = {
+            "start": self.bulk_start_button,
+            "stop": self.bulk_stop_button,
+            "configure": self.bulk_configure_button,
+            "delete": self.bulk_delete_button,
+        }
+        for action, button in self.bulk_buttons.items():
+            button.connect("clicked", lambda _, action=action: self.run_bulk_action(action))
         self.home_button.connect("clicked", self.show_home)
         self.providers_button.connect("clicked", self.show_providers)
         self.machines_button.connect("clicked", self.show_machines)
@@ -124,23 +199,38 @@ class CloudsurgeWindow(Adw.ApplicationWindow):
         self.machines_button.set_active(False)
         self.cost_button.set_active(True)
 
-        thread_values = threading.Thread(target=self.update_cost)
-        thread_values.start()
+        self.refresh_cost()
+        self.refresh_history()
+
+    def on_close_request(self, _):
+        if self.cost_refresh is not None:
+            self.cost_refresh.set()
+        return False
 
     def save_zerotier_id(self, _):
         zero_tier_id = self.zerotier_id.get_text()
         self.db.insert_zerotier_id(zerotier_id=zero_tier_id)
         self.zerotier_id.set_title("current: " + zero_tier_id)
 
-    def show_vm_settings_window(self, _, vm, vm_gui_widget):
-        dialog = VmSettingsWindow(vm, vm_gui_widget, self.db, self, self.vms)
+    def show_vm_settings_window(self, _, vm_name):
+        vm = self.find_vm(vm_name)
+        if vm is None:
+            print(f"VM '{vm_name}' is still loading")
+            return
+        dialog = VmSettingsWindow(
+            vm, self.vm_store.get(vm_name), self.db, self, self.vms
+        )
         dialog.app = self.app
         dialog.present()
 
-    def show_provider_settings_window(self, _, provider, provider_gui_widget):
+    def show_provider_settings_window(self, _, account_name):
+        provider = self.find_provider(account_name)
+        if provider is None:
+            print(f"Provider '{account_name}' is still loading")
+            return
         dialog = ProviderSettingsWindow(
             provider,
-            provider_gui_widget,
+            self.provider_store.get(account_name),
             self.db,
             self,
             self.vms,
@@ -149,47 +239,155 @@ class CloudsurgeWindow(Adw.ApplicationWindow):
         dialog.app = self.app
         dialog.present()
 
-    # Cost Update
-    def update_cost(self):
-        total_digitalocean_instances = 0
-        total_aws_instances = 0
+    def find_vm(self, vm_name):
+        for vm in self.vms:
+            if vm.get_vm_name() == vm_name:
+                return vm
+        return None
 
-        hourly_rates_digitalocean = 0
-        hourly_rates_aws = 0
+    def find_provider(self, account_name):
+        for provider in self.providers:
+            if provider.get_account_name() == account_name:
+                return provider
+        return None
+
+    # Snapshot-Methods
+    def show_snapshot(self, snapshot):
+        """Renders the cached fleet view before the database and providers are loaded."""
+        self.provider_store.add(
+            ProviderItem(entry["account_name"], entry["provider_name"])
+            for entry in snapshot["providers"]
+        )
+        items = []
+        for entry in snapshot["vms"]:
+            item = VmItem(entry["vm_name"], entry["public_ip"])
+            item.update(entry["public_ip"], entry["state"], entry["accrued_cost"])
+            items.append(item)
+        self.vm_store.add(items)
+
+    def sync_with_backend(self, accrued_costs):
+        """Reconciles the rendered rows with the loaded providers and VMs."""
+        account_names = {p.get_account_name() for p in self.providers}
+        self.provider_store.remove_all(
+            name for name in self.provider_store.names() if name not in account_names
+        )
+        self.provider_store.add(
+            ProviderItem(p.get_account_name(), p.get_provider_name())
+            for p in self.providers
+        )
 
-        aws_total_cost = 0
-        digitalocean_total_cost = 0
-        for vm in self.vms:
-            vm_provider_name = vm.get_provider().get_provider_name()
-            if vm_provider_name == "AWS":
-                aws_total_cost += vm.get_provider().get_vm_cost(vm)
-                total_aws_instances += 1
-                hourly_rates_aws += vm.get_provider().get_vm_hourly_rate(vm)
-            elif vm_provider_name == "DigitalOcean":
-                digitalocean_total_cost += vm.get_provider().get_vm_cost(vm)
-                total_digitalocean_instances += 1
-                hourly_rates_digitalocean += (
-                    vm.get_provider().get_vm_hourly_rate(vm)
+        vm_names = {vm.get_vm_name() for vm in self.vms}
+        self.vm_store.remove_all(
+            name for name in self.vm_store.names() if name not in vm_names
+        )
+        self.fleet_changes.remove(
+            name for name in self.fleet_changes.get_records() if name not in vm_names
+        )
+        self.vm_store.add(
+            VmItem(vm.get_vm_name(), str(vm.get_public_ip())) for vm in self.vms
+        )
+        self.fleet_changes.update(
+            [ledger_record(vm, accrued_costs.get(vm.get_vm_name())) for vm in self.vms],
+            complete=False,
+            checked=False,
+        )
+        # The VMs are known now, start polling them
+        self.poller.on_window_state()
+
+    def apply_changes(self, deltas):
+        """Patches the rows and cost labels affected by fleet deltas."""
+        for delta in deltas:
+            if delta["change"] == "removed":
+                self.vm_store.remove(delta["vm_name"])
+            elif {"public_ip", "state", "accrued_cost", "online"}.intersection(
+                delta["fields"]
+            ):
+                record = delta["record"]
+                self.update_vm_row(
+                    delta["vm_name"],
+                    record["public_ip"],
+                    record.get("state"),
+                    record.get("accrued_cost"),
+                    record.get("online"),
                 )
+        if self.cost_totals.apply(deltas):
+            self.update_cost_gui(
+                self.cost_totals.get_total_cost("AWS"),
+                self.cost_totals.get_avg_hourly_rate("AWS"),
+                self.cost_totals.get_total_cost("DigitalOcean"),
+                self.cost_totals.get_avg_hourly_rate("DigitalOcean"),
+            )
+
+    # Cost Update
+    def refresh_cost(self):
+        """Starts a cost refresh, or queues one behind the refresh already in flight."""
+        if self.cost_refresh is not None:
+            # Clicks during a refresh are coalesced into a single follow-up refresh
+            self.cost_refresh_pending = True
+            return
+        self.cost_refresh = threading.Event()
+        self.cost_refresh_pending = False
+        thread_values = threading.Thread(
+            target=self.update_cost, args=(self.cost_refresh, list(self.vms))
+        )
+        thread_values.start()
+
+    def on_cost_refreshed(self):
+        self.cost_refresh = None
+        # The refresh sampled every VM, so the charts end at its results
+        self.refresh_history()
+        if self.cost_refresh_pending:
+            self.refresh_cost()
 
+    def update_cost(self, cancelled, vms):
+        """Refreshes the costs in a worker thread, the widgets are only updated through GLib.idle_add."""
         try:
-            avg_hourly_cost_digitalocean = (
-                hourly_rates_digitalocean / total_digitalocean_instances
+            # Answer instantly from the local cost ledger, then reconcile it with the providers
+            accrued_costs = self.db.read_accrued_costs()
+            self.fleet_changes.update(
+                [
+                    ledger_record(vm, accrued_costs[vm.get_vm_name()])
+                    for vm in vms
+                    if vm.get_vm_name() in accrued_costs
+                ],
+                complete=False,
+                checked=False,
             )
-        except ZeroDivisionError:
-            avg_hourly_cost_digitalocean = 0
 
-        try:
-            avg_hourly_cost_aws = hourly_rates_aws / total_aws_instances
-        except ZeroDivisionError:
-            avg_hourly_cost_aws = 0
-
-        self.update_cost_gui(
-            aws_total_cost,
-            avg_hourly_cost_aws,
-            digitalocean_total_cost,
-            avg_hourly_cost_digitalocean,
+            # A running daemon already keeps the costs warm, the providers are not asked twice
+            if self.apply_daemon_changes(vms):
+                return
+
+            # Every VM is patched as its provider answers
+            refresh_costs(
+                self.db,
+                vms,
+                accrued_costs,
+                self.hourly_rates,
+                on_result=self.poller.on_result,
+                cancelled=cancelled,
+            )
+            if not cancelled.is_set():
+                save_snapshot(build_snapshot(self.providers, vms, accrued_costs))
+        finally:
+            GLib.idle_add(self.on_cost_refreshed)
+
+    def apply_daemon_changes(self, vms) -> bool:
+        """Applies what changed in the daemon's fleet to vms, returns False if there is no daemon."""
+        changes = query_changes(self.daemon_version)
+        if changes is None:
+            return False
+        self.daemon_version = changes["version"]
+        vm_names = {vm.get_vm_name() for vm in vms}
+        self.fleet_changes.update(
+            [
+                delta["record"]
+                for delta in changes["deltas"]
+                if delta["record"] is not None and delta["vm_name"] in vm_names
+            ],
+            complete=False,
         )
+        return True
 
     def update_cost_gui(
         self, aws_total_cost, aws_avg_cost, do_total_cost, do_avg_cost
@@ -204,63 +402,270 @@ class CloudsurgeWindow(Adw.ApplicationWindow):
         )
         self.do_avgcost.set_title("Current cost: " + str(do_avg_cost) + "$/h")
 
+    # Cost History
+    def refresh_history(self):
+        """Reads the cost history of the selected range in the background and draws it."""
+        self.history_generation += 1
+        seconds = cost_ranges[self.cost_range.get_selected()]
+        start = time.time() - seconds if seconds is not None else 0
+        thread = threading.Thread(
+            target=self.load_history,
+            args=(self.history_generation, list(self.vms), start),
+            daemon=True,
+        )
+        thread.start()
+
+    def load_history(self, generation, vms, start):
+        try:
+            history = read_cost_history(self.db, vms, start)
+        except Exception as e:
+            print(f"Error reading the cost history: {e}")
+            return
+        GLib.idle_add(self.show_history, generation, history)
+
+    def show_history(self, generation, history):
+        if generation != self.history_generation:
+            return
+        for provider_name, chart in self.cost_charts.items():
+            chart.set_series(
+                history["providers"].get(provider_name, []),
+                history["start"] or None,
+                history["now"],
+            )
+        for provider_name, row in (
+            ("AWS", self.aws_estcost),
+            ("DigitalOcean", self.do_estcost),
+        ):
+            projected = history["projected"].get(provider_name, 0)
+            row.set_title(f"Projected month-end cost: {projected:.2f}$")
+
+    # Job-Methods
+    def on_job_finished(self, job, result):
+        """Shows the outcome of a job that was resumed in the background."""
+        if result is None:
+            return
+        if job.kind in ("create_vm", "provision_vm"):
+            if all(vm.get_vm_name() != result.get_vm_name() for vm in self.vms):
+                self.vms.append(result)
+                self.add_vm_to_gui(result)
+        elif job.kind == "delete_provider":
+            for provider in list(self.providers):
+                if provider.get_account_name() == result.get_account_name():
+                    self.remove_provider_from_gui(provider)
+
     # Provider-Methods
     def add_provider_to_gui(self, provider):
-        self.providers_list.append(self.provider_to_widget(provider))
-
-    def provider_to_widget(self, provider) -> Adw.ActionRow:
-        row = Adw.ActionRow()
-        row.set_title(provider.get_account_name())
-        row.set_subtitle(provider.get_provider_name())
-
-        # Create the button and add the desired child elements
-        button = Gtk.Button()
-        # button.set_action_name("app.test")
-        button.connect(
-            "clicked", self.show_provider_settings_window, provider, row
+        self.provider_store.add(
+            [ProviderItem(provider.get_account_name(), provider.get_provider_name())]
         )
-        # Define the Box to hold the child widget, with appropriate spacing
-        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
 
-        # Create the Image widget with the icon
-        image = Gtk.Image(icon_name="applications-system-symbolic")
+    def remove_provider_from_gui(self, provider):
+        """Removes a provider and all of its VMs from the GUI."""
+        self.provider_store.remove(provider.get_account_name())
+        if provider in self.providers:
+            self.providers.remove(provider)
+
+        removed = [
+            vm
+            for vm in self.vms
+            if vm.get_provider().get_account_name() == provider.get_account_name()
+        ]
+        for vm in removed:
+            self.vms.remove(vm)
+        self.vm_store.remove_all(vm.get_vm_name() for vm in removed)
+        self.fleet_changes.remove(vm.get_vm_name() for vm in removed)
+
+    # Lifecycle-Methods
+    def run_lifecycle_action(self, vm, action):
+        """Runs a lifecycle action in the background, the VM's row shows it right away."""
+        vm_name = vm.get_vm_name()
+        if vm_name in self.lifecycle_actions:
+            print(f"VM '{vm_name}' is still busy with '{self.lifecycle_actions[vm_name]}'")
+            return
+        self.lifecycle_actions[vm_name] = action
+        previous_state = self.fleet_changes.get_record(vm_name).get("state")
+        self.fleet_changes.update(
+            [dict(ledger_record(vm, None), state=lifecycle_actions[action][1])],
+            complete=False,
+            checked=False,
+        )
+        thread = threading.Thread(
+            target=self.confirm_lifecycle_action,
+            args=(vm, action, previous_state),
+            daemon=True,
+        )
+        thread.start()
 
-        # Add the image to the box
-        box.append(image)
+    def confirm_lifecycle_action(self, vm, action, previous_state):
+        """Performs the action and waits for its final state in a worker thread."""
+        vm_name = vm.get_vm_name()
+        try:
+            state = perform_action(action, vm, self.db)
+        except Exception as e:
+            # Roll the row back, then let the provider tell the actual state
+            self.fleet_changes.update(
+                [dict(ledger_record(vm, None), state=previous_state)],
+                complete=False,
+                checked=False,
+            )
+            GLib.idle_add(self.on_lifecycle_action_failed, vm, action, str(e))
+            return
+        finally:
+            GLib.idle_add(self.end_lifecycle_action, vm_name)
+
+        if action == "delete":
+            GLib.idle_add(self.remove_vm_from_gui, vm)
+        else:
+            if state is not None:
+                self.fleet_changes.update(
+                    [dict(ledger_record(vm, None), state=state)], complete=False
+                )
+            GLib.idle_add(self.poller.poll_soon, [vm_name])
 
-        # Set the Box as the child of the button
-        button.set_child(box)
+    def end_lifecycle_action(self, vm_name):
+        """Marks a VM as no longer busy, runs once as an idle callback."""
+        self.lifecycle_actions.pop(vm_name, None)
+        return GLib.SOURCE_REMOVE
 
-        # Add the button to the ActionRow
-        row.add_suffix(button)
-        return row
+    def on_lifecycle_action_failed(self, vm, action, message):
+        self.poller.poll_soon([vm.get_vm_name()])
+        dialog = ErrorWindow(
+            f"Could not {action} VM '{vm.get_vm_name()}': {message}", self
+        )
+        dialog.present()
 
-    # VM-Methods
-    def add_vm_to_gui(self, vm):
-        self.machines_list.append(self.vm_to_widget(vm))
+    # Bulk-Methods
+    def get_selected_vms(self) -> list:
+        selected = self.vm_selection.get_selection()
+        vms = []
+        for i in range(selected.get_size()):
+            item = self.vm_store.model.get_item(selected.get_nth(i))
+            vm = self.find_vm(item.name) if item is not None else None
+            if vm is not None:
+                vms.append(vm)
+        return vms
+
+    def on_vm_selection_changed(self, *_):
+        if self.bulk_progress is not None:
+            return
+        count = self.vm_selection.get_selection().get_size()
+        self.bulk_label.set_label(f"{count} selected")
+        self.bulk_bar.set_revealed(count > 0)
+
+    def run_bulk_action(self, action):
+        """Runs an action on the selected VMs, batched by provider account and region."""
+        if self.bulk_progress is not None:
+            return
+        vms = [
+            vm
+            for vm in self.get_selected_vms()
+            if vm.get_vm_name() not in self.lifecycle_actions
+        ]
+        if not vms:
+            return
+        previous_states = {}
+        for vm in vms:
+            self.lifecycle_actions[vm.get_vm_name()] = action
+            previous_states[vm.get_vm_name()] = self.fleet_changes.get_record(
+                vm.get_vm_name()
+            ).get("state")
+        if action in lifecycle_actions:
+            self.fleet_changes.update(
+                [
+                    dict(ledger_record(vm, None), state=lifecycle_actions[action][1])
+                    for vm in vms
+                ],
+                complete=False,
+                checked=False,
+            )
+        self.bulk_progress = [0, 0, len(vms)]
+        self.show_bulk_progress(action)
+        thread = threading.Thread(
+            target=self.confirm_bulk_action,
+            args=(vms, action, previous_states),
+            daemon=True,
+        )
+        thread.start()
 
-    def vm_to_widget(self, vm) -> Adw.ActionRow:
-        row = Adw.ActionRow()
-        row.set_title(vm.get_vm_name())
-        row.set_subtitle(str(vm.get_public_ip()))
+    def confirm_bulk_action(self, vms, action, previous_states):
+        """Performs a bulk action and waits for its final states in a worker thread."""
 
-        # Create the button and add the desired child elements
-        button = Gtk.Button()
-        button.set_action_name("app.test")
-        button.connect("clicked", self.show_vm_settings_window, vm, row)
+        def on_progress(vm, error):
+            if error is None and action in lifecycle_actions and action != "delete":
+                self.fleet_changes.update(
+                    [dict(ledger_record(vm, None), state=lifecycle_actions[action][0])],
+                    complete=False,
+                )
+            GLib.idle_add(self.on_bulk_progress, action, error is not None)
 
-        # Define the Box to hold the child widget, with appropriate spacing
-        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        try:
+            errors = perform_bulk_action(action, vms, self.db, on_progress)
+        except Exception as e:
+            errors = {vm.get_vm_name(): str(e) for vm in vms}
+
+        # Roll the failed rows back, then let the providers tell the actual states
+        if action in lifecycle_actions:
+            self.fleet_changes.update(
+                [
+                    dict(ledger_record(vm, None), state=previous_states[vm.get_vm_name()])
+                    for vm in vms
+                    if vm.get_vm_name() in errors
+                ],
+                complete=False,
+                checked=False,
+            )
+        GLib.idle_add(self.on_bulk_action_finished, vms, action, errors)
+
+    def on_bulk_progress(self, action, failed):
+        done, failures, total = self.bulk_progress
+        self.bulk_progress = [done + 1, failures + failed, total]
+        self.show_bulk_progress(action)
+
+    def show_bulk_progress(self, action):
+        done, failed, total = self.bulk_progress
+        label = f"{action.capitalize()}: {done}/{total}"
+        if failed:
+            label += f", {failed} failed"
+        self.bulk_label.set_label(label)
+        for button in self.bulk_buttons.values():
+            button.set_sensitive(False)
+
+    def on_bulk_action_finished(self, vms, action, errors):
+        for vm in vms:
+            self.lifecycle_actions.pop(vm.get_vm_name(), None)
+        self.bulk_progress = None
+        for button in self.bulk_buttons.values():
+            button.set_sensitive(True)
+
+        if action == "delete":
+            for vm in vms:
+                if vm.get_vm_name() not in errors:
+                    self.remove_vm_from_gui(vm)
+        self.poller.poll_soon([vm.get_vm_name() for vm in vms if vm in self.vms])
+        self.on_vm_selection_changed()
+
+        if errors:
+            dialog = ErrorWindow(
+                f"Could not {action} {len(errors)} of {len(vms)} VMs:\n"
+                + "\n".join(f"{name}: {error}" for name, error in errors.items()),
+                self,
+            )
+            dialog.present()
 
-        # Create the Image widget with the icon
-        image = Gtk.Image(icon_name="applications-system-symbolic")
+    # VM-Methods
+    def add_vm_to_gui(self, vm):
+        self.vm_store.add([VmItem(vm.get_vm_name(), str(vm.get_public_ip()))])
 
-        # Add the image to the box
-        box.append(image)
+    def remove_vm_from_gui(self, vm):
+        if vm in self.vms:
+            self.vms.remove(vm)
+        self.vm_store.remove(vm.get_vm_name())
+        self.fleet_changes.remove([vm.get_vm_name()])
 
-        # Set the Box as the child of the button
-        button.set_child(box)
+    def update_vm_row(
+        self, vm_name, public_ip, state=None, accrued_cost=None, online=None
+    ):
+        item = self.vm_store.get(vm_name)
+        if item is not None:
+            item.update(public_ip, state, accrued_cost, online)
 
-        # Add the button to the ActionRow
-        row.add_suffix(button)
-        return row